@@ -0,0 +1,200 @@
+"""Sweep CPU inference settings on this host and write the best configuration.
+
+    python autotune.py --latency-target-ms 150 --output runtime_config.json
+    python autotune.py --runtime tflite --threads 1,2,4 --batch-sizes 1,8,16,32 --report autotune_report.json
+
+Every combination of intra/inter-op threads, XLA and oneDNN is measured in a
+fresh process against the real model (TensorFlow only reads these settings
+when it initialises), at each batch size and inference concurrency. The
+combination with the highest throughput whose p95 batch latency plus
+BATCH_MAX_WAIT_MS stays under the target is written to ``--output``; the
+backend picks that file up through RUNTIME_CONFIG (default
+runtime_config.json), and environment variables still take precedence.
+"""
+import argparse
+import importlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+RESULT_PREFIX = "AUTOTUNE_RESULT "
+
+
+# -------------------------------------
+# Trial (runs in a child process)
+# -------------------------------------
+def measure(runtime, batch_size, concurrency, repeats):
+    """Per-call latencies (ms) and images/s with ``concurrency`` threads calling predict"""
+    batch = np.random.default_rng(0).uniform(0, 255, (batch_size, *runtime.input_size, 3)).astype(np.float32)
+    runtime.predict(batch)  # 预热（XLA 在此编译该批大小）
+
+    def worker():
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            runtime.predict(batch)
+            timings.append((time.perf_counter() - started) * 1000.0)
+        return timings
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = list(itertools.chain.from_iterable(pool.map(lambda _: worker(), range(concurrency))))
+    wall = time.perf_counter() - started
+    return {
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "images_per_second": batch_size * len(timings) / wall,
+    }
+
+def run_trial(batch_sizes, concurrencies, repeats):
+    backend = importlib.import_module("plant-disease-backend")
+    started = time.perf_counter()
+    runtime = backend.load_model()
+    load_seconds = time.perf_counter() - started
+    points = []
+    for batch_size, concurrency in itertools.product(batch_sizes, concurrencies):
+        point = measure(runtime, batch_size, concurrency, repeats)
+        point.update(batch_size=batch_size, concurrency=concurrency)
+        points.append(point)
+    print(RESULT_PREFIX + json.dumps({"load_seconds": load_seconds, "settings": backend.runtime_settings(),
+                                      "points": points}))
+
+# -------------------------------------
+# Sweep
+# -------------------------------------
+def default_thread_counts():
+    available = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    return sorted({count for count in (1, 2, 4, available // 2, available) if 1 <= count <= available})
+
+def trial_settings(args):
+    """Environment overrides for each process-level combination"""
+    if args.runtime == "tflite":
+        # TFLite 只有解释器线程数一个参数
+        return [{"TF_INTRA_OP_THREADS": str(threads), "TFLITE_NUM_THREADS": str(threads)}
+                for threads in args.threads]
+    return [
+        {
+            "TF_INTRA_OP_THREADS": str(threads),
+            "TF_INTER_OP_THREADS": str(inter),
+            "TF_XLA_JIT": str(xla),
+            "TF_ENABLE_ONEDNN_OPTS": str(onednn),
+        }
+        for threads, inter, xla, onednn in itertools.product(args.threads, args.inter_threads, args.xla, args.onednn)
+    ]
+
+def run_subprocess_trial(args, overrides):
+    env = dict(os.environ, **overrides, INFERENCE_RUNTIME=args.runtime, RUNTIME_CONFIG="",
+               TF_CPP_MIN_LOG_LEVEL=os.environ.get("TF_CPP_MIN_LOG_LEVEL", "2"))
+    if args.affinity:
+        env["CPU_AFFINITY"] = args.affinity
+    command = [
+        sys.executable, os.path.abspath(__file__), "--trial",
+        "--batch-sizes", ",".join(map(str, args.batch_sizes)),
+        "--concurrency", ",".join(map(str, args.concurrency)),
+        "--repeats", str(args.repeats),
+    ]
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    print(f"  试验失败 {overrides}: {completed.stderr.strip()[-500:]}")
+    return None
+
+def choose(candidates, target_ms, batch_wait_ms):
+    """Highest throughput under the latency target; falls back to the lowest latency"""
+    within = [c for c in candidates if c["p95_ms"] + batch_wait_ms <= target_ms]
+    if within:
+        return max(within, key=lambda c: (c["images_per_second"], -c["p95_ms"])), True
+    return min(candidates, key=lambda c: c["p95_ms"]), False
+
+def config_for(args, best, met_target):
+    config = {
+        "INFERENCE_RUNTIME": args.runtime,
+        **best["overrides"],
+        "BATCH_MAX_SIZE": str(best["batch_size"]),
+        "WARMUP_BATCH_SIZES": ",".join(sorted({"1", str(best["batch_size"])}, key=int)),
+        "INFERENCE_CONCURRENCY": str(best["concurrency"]),
+    }
+    if args.affinity:
+        config["CPU_AFFINITY"] = args.affinity
+    config["_autotune"] = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "cpu_count": os.cpu_count(),
+        "latency_target_ms": args.latency_target_ms,
+        "met_latency_target": met_target,
+        "p50_ms": best["p50_ms"],
+        "p95_ms": best["p95_ms"],
+        "images_per_second": best["images_per_second"],
+    }
+    return config
+
+def run_sweep(args):
+    batch_wait_ms = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+    candidates, trials = [], []
+    settings = trial_settings(args)
+    print(f"共 {len(settings)} 组进程级设置，每组测量批大小 {args.batch_sizes} × 并发 {args.concurrency}")
+    for index, overrides in enumerate(settings, 1):
+        result = run_subprocess_trial(args, overrides)
+        if result is None:
+            continue
+        trials.append({"overrides": overrides, **result})
+        for point in result["points"]:
+            candidates.append({"overrides": overrides, **point})
+        best_here = max(result["points"], key=lambda p: p["images_per_second"])
+        print(f"  [{index}/{len(settings)}] {overrides}: 最高 {best_here['images_per_second']:.0f} images/s "
+              f"(bs={best_here['batch_size']}, c={best_here['concurrency']}, p95={best_here['p95_ms']:.1f}ms)")
+
+    if not candidates:
+        raise SystemExit("所有试验均失败")
+    best, met_target = choose(candidates, args.latency_target_ms, batch_wait_ms)
+    if not met_target:
+        print(f"没有组合满足 {args.latency_target_ms}ms 的延迟目标，使用延迟最低的组合")
+    config = config_for(args, best, met_target)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    print(f"最佳配置: {best['overrides']} bs={best['batch_size']} c={best['concurrency']} "
+          f"-> {best['images_per_second']:.0f} images/s, p95={best['p95_ms']:.1f}ms")
+    print(f"已写入 {args.output}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "trials": trials}, f, ensure_ascii=False, indent=2)
+        print(f"详细结果已写入 {args.report}")
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Autotune CPU inference settings for the plant disease model")
+    parser.add_argument("--runtime", choices=["keras", "tflite"], default=os.getenv("INFERENCE_RUNTIME", "keras"))
+    parser.add_argument("--latency-target-ms", type=float, default=200.0,
+                        help="p95 budget for one model call plus BATCH_MAX_WAIT_MS")
+    parser.add_argument("--threads", type=parse_int_list, default=default_thread_counts(),
+                        help="intra-op (TFLite: interpreter) thread counts to try")
+    parser.add_argument("--inter-threads", type=parse_int_list, default=[1, 2], help="inter-op thread counts")
+    parser.add_argument("--xla", type=parse_int_list, default=[0, 1], help="XLA settings to try (0/1)")
+    parser.add_argument("--onednn", type=parse_int_list, default=[0, 1], help="oneDNN settings to try (0/1)")
+    parser.add_argument("--batch-sizes", type=parse_int_list, default=[1, 4, 8, 16, 32])
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1, 2],
+                        help="concurrent model calls (INFERENCE_CONCURRENCY)")
+    parser.add_argument("--repeats", type=int, default=10, help="timed calls per point and thread")
+    parser.add_argument("--affinity", default=os.getenv("CPU_AFFINITY", ""),
+                        help="CPU list to pin trials (and the written config) to, e.g. 0-3")
+    parser.add_argument("--output", default="runtime_config.json", help="config file to write")
+    parser.add_argument("--report", default=None, help="write every trial's measurements as JSON")
+    parser.add_argument("--trial", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.trial:
+        run_trial(args.batch_sizes, args.concurrency, args.repeats)
+    else:
+        run_sweep(args)
+
+if __name__ == "__main__":
+    main()
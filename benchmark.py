@@ -0,0 +1,331 @@
+"""Benchmarks for the backend's hot paths and an end-to-end load generator.
+
+    # preprocess_image across sizes/formats, model calls at several batch sizes
+    python benchmark.py micro --output bench-micro.json
+    # start fake_llm.py + the backend, then load /predict at several concurrency levels
+    python benchmark.py load --spawn --concurrency 1,8,32 --duration 20 --output bench-load.json
+    # load an already running backend
+    python benchmark.py load --url http://127.0.0.1:8503 --concurrency 16
+    # compare two result files (e.g. before/after a commit)
+    python benchmark.py compare bench-before.json bench-after.json
+
+Synthetic images are generated from a fixed seed, and ``--spawn`` points the
+backend at the local fake LLM, so runs are offline and repeatable. Every
+result file records the git commit it was produced from.
+"""
+import argparse
+import asyncio
+import base64
+import importlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+IMAGE_SIZES = ((256, 256), (1024, 768), (4032, 3024))
+IMAGE_FORMATS = ("JPEG", "PNG", "WEBP")
+BATCH_SIZES = (1, 8, 16, 32)
+
+
+# -------------------------------------
+# Helpers
+# -------------------------------------
+def synthetic_image(size, fmt="JPEG", seed=0):
+    """Encoded leaf-like test image: smooth colour gradient plus noise, deterministic per seed"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        60 + 80 * x / width,
+        140 + 60 * y / height,
+        40 + 40 * (x + y) / (width + height),
+    ], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    options = {"quality": 90} if fmt in ("JPEG", "WEBP") else {}
+    Image.fromarray(pixels).save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+def summarize(samples_ms):
+    """Latency summary (milliseconds) of a list of samples"""
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    if not len(samples):
+        return {"count": 0}
+    return {
+        "count": int(len(samples)),
+        "mean_ms": float(samples.mean()),
+        "min_ms": float(samples.min()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "max_ms": float(samples.max()),
+    }
+
+def time_calls(func, repeats, warmup=2):
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return timings
+
+def run_metadata(kind, argv):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "kind": kind,
+        "git_commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "argv": argv,
+    }
+
+def write_results(path, results):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {path}")
+
+# -------------------------------------
+# Microbenchmarks
+# -------------------------------------
+def bench_preprocess(backend, repeats):
+    """preprocess_image (base64 -> model input) for each size and format"""
+    results = {}
+    for width, height in IMAGE_SIZES:
+        for fmt in IMAGE_FORMATS:
+            encoded = synthetic_image((width, height), fmt)
+            payload = base64.b64encode(encoded).decode()
+            name = f"{fmt.lower()}_{width}x{height}"
+            try:
+                summary = summarize(time_calls(lambda: backend.preprocess_image(payload), repeats))
+            except Exception as e:
+                # 例如超过 DECODE_MAX_BYTES 的大尺寸 PNG
+                results[name] = {"skipped": str(getattr(e, "detail", e)), "encoded_bytes": len(encoded)}
+                print(f"  preprocess {fmt:4s} {width}x{height}: 跳过 ({results[name]['skipped']})")
+                continue
+            summary["encoded_bytes"] = len(encoded)
+            results[name] = summary
+            print(f"  preprocess {fmt:4s} {width}x{height}: p50={summary['p50_ms']:.2f}ms "
+                  f"p95={summary['p95_ms']:.2f}ms ({len(encoded) / 1024:.0f} KB)")
+    return results
+
+def bench_predict(backend, batch_sizes, repeats):
+    """predict_disease (batch of 1) and predict_batch at each batch size"""
+    backend.load_model()
+    rng = np.random.default_rng(0)
+    results = {}
+    for batch_size in batch_sizes:
+        batch = rng.uniform(0, 255, (batch_size, 128, 128, 3)).astype(np.float32)
+        if batch_size == 1:
+            summary = summarize(time_calls(lambda: backend.predict_disease(batch), repeats))
+        else:
+            summary = summarize(time_calls(lambda: backend.predict_batch(batch), repeats))
+        summary["images_per_second"] = batch_size / (summary["p50_ms"] / 1000.0)
+        results[str(batch_size)] = summary
+        print(f"  predict bs={batch_size:3d}: p50={summary['p50_ms']:.2f}ms "
+              f"({summary['images_per_second']:.1f} images/s)")
+    return results
+
+def run_micro(args):
+    backend = importlib.import_module("plant-disease-backend")
+    print(f"运行时: {backend.INFERENCE_RUNTIME}")
+    results = {"meta": run_metadata("micro", sys.argv[1:]), "runtime": backend.INFERENCE_RUNTIME}
+    print("preprocess_image:")
+    results["preprocess_image"] = bench_preprocess(backend, args.repeats)
+    print("predict_disease / predict_batch:")
+    results["predict"] = bench_predict(backend, args.batch_sizes, args.repeats)
+    write_results(args.output, results)
+
+# -------------------------------------
+# Load Generator
+# -------------------------------------
+def build_payloads(images_dir, count, size):
+    """Request bodies for /predict: real images from a directory or synthetic ones"""
+    encoded = []
+    if images_dir:
+        for name in sorted(os.listdir(images_dir)):
+            if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+                with open(os.path.join(images_dir, name), "rb") as f:
+                    encoded.append((name, f.read()))
+    else:
+        encoded = [(f"synthetic-{seed}.jpg", synthetic_image(size, "JPEG", seed)) for seed in range(count)]
+    if not encoded:
+        raise SystemExit(f"No images found in {images_dir}")
+    return [
+        json.dumps({"image": base64.b64encode(data).decode(), "filename": name}).encode()
+        for name, data in encoded
+    ]
+
+async def load_level(url, payloads, concurrency, duration, timeout):
+    """Keep ``concurrency`` requests in flight for ``duration`` seconds"""
+    import httpx
+
+    latencies, statuses = [], {}
+    next_payload = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as http:
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal next_payload
+            while time.perf_counter() < deadline:
+                body = payloads[next_payload % len(payloads)]
+                next_payload += 1
+                started = time.perf_counter()
+                try:
+                    response = await http.post(url, content=body, headers={"Content-Type": "application/json"})
+                    status = str(response.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                elapsed = (time.perf_counter() - started) * 1000.0
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == "200":
+                    latencies.append(elapsed)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    result = summarize(latencies)
+    result.update(
+        concurrency=concurrency,
+        duration_s=wall,
+        throughput_rps=len(latencies) / wall if wall else 0.0,
+        statuses=statuses,
+        error_rate=1.0 - len(latencies) / max(1, sum(statuses.values())),
+    )
+    return result
+
+def wait_ready(base_url, timeout):
+    import httpx
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{base_url}/readyz", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"{base_url} 在 {timeout}s 内未就绪")
+
+def spawn_servers(args):
+    """Start fake_llm.py and the backend (pointed at it); returns the processes"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    fake_llm = subprocess.Popen([
+        sys.executable, os.path.join(here, "fake_llm.py"), "--port", str(args.llm_port),
+        "--latency-ms", str(args.llm_latency_ms), "--token-ms", str(args.llm_token_ms),
+    ])
+    env = dict(os.environ, LLM_BASE_URL=f"http://127.0.0.1:{args.llm_port}/v1/", DISEASE_INFO_CACHE_PATH="")
+    # 合成图片循环发送，默认关闭预测缓存以测量真实推理路径；可通过环境变量覆盖
+    env.setdefault("PREDICTION_CACHE_MODE", "off")
+    backend = subprocess.Popen([sys.executable, os.path.join(here, "plant-disease-backend.py")], env=env)
+    return [backend, fake_llm]
+
+def run_load(args):
+    processes = spawn_servers(args) if args.spawn else []
+    try:
+        wait_ready(args.url, args.ready_timeout)
+        payloads = build_payloads(args.images, args.synthetic_images, (args.image_width, args.image_height))
+        url = f"{args.url}{args.endpoint}"
+        results = {"meta": run_metadata("load", sys.argv[1:]), "url": url, "levels": {}}
+        if args.spawn:
+            results["fake_llm"] = {"latency_ms": args.llm_latency_ms, "token_ms": args.llm_token_ms}
+
+        if args.warmup:
+            asyncio.run(load_level(url, payloads, 1, args.warmup, args.timeout))
+        for concurrency in args.concurrency:
+            level = asyncio.run(load_level(url, payloads, concurrency, args.duration, args.timeout))
+            results["levels"][str(concurrency)] = level
+            print(f"  concurrency={concurrency:3d}: {level['throughput_rps']:.1f} req/s, "
+                  f"p50={level.get('p50_ms', 0):.0f}ms p95={level.get('p95_ms', 0):.0f}ms "
+                  f"p99={level.get('p99_ms', 0):.0f}ms, errors={level['error_rate']:.1%}")
+        write_results(args.output, results)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+# -------------------------------------
+# Comparison
+# -------------------------------------
+COMPARED_KEYS = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "images_per_second")
+
+def flatten(results, prefix=""):
+    """{"a.b.p50_ms": value} for the comparable numbers in a result file"""
+    flat = {}
+    for key, value in results.items():
+        if key == "meta":
+            continue
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif key in COMPARED_KEYS and isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def run_compare(args):
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    print(f"baseline:  {baseline['meta'].get('git_commit')}  {args.baseline}")
+    print(f"candidate: {candidate['meta'].get('git_commit')}  {args.candidate}")
+    before, after = flatten(baseline), flatten(candidate)
+    for key in sorted(before.keys() & after.keys()):
+        change = (after[key] - before[key]) / before[key] * 100.0 if before[key] else 0.0
+        print(f"  {key:50s} {before[key]:10.2f} -> {after[key]:10.2f}  ({change:+.1f}%)")
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the plant disease backend")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    micro = commands.add_parser("micro", help="preprocess_image and model-call microbenchmarks")
+    micro.add_argument("--batch-sizes", type=parse_int_list, default=list(BATCH_SIZES))
+    micro.add_argument("--repeats", type=int, default=20, help="timed calls per case")
+    micro.add_argument("--output", default="benchmark-micro.json", help="results file (JSON)")
+
+    load = commands.add_parser("load", help="end-to-end load test of /predict")
+    load.add_argument("--url", default="http://127.0.0.1:8503", help="backend base URL")
+    load.add_argument("--endpoint", default="/predict", help="JSON endpoint to load")
+    load.add_argument("--concurrency", type=parse_int_list, default=[1, 8, 32],
+                      help="comma-separated concurrency levels")
+    load.add_argument("--duration", type=float, default=20.0, help="seconds per concurrency level")
+    load.add_argument("--warmup", type=float, default=3.0, help="seconds of warm-up traffic before measuring")
+    load.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds")
+    load.add_argument("--images", default=None, help="directory of images to send (default: synthetic)")
+    load.add_argument("--synthetic-images", type=int, default=64, help="distinct synthetic images")
+    load.add_argument("--image-width", type=int, default=1024)
+    load.add_argument("--image-height", type=int, default=768)
+    load.add_argument("--spawn", action="store_true", help="start fake_llm.py and the backend for the run")
+    load.add_argument("--llm-port", type=int, default=8600)
+    load.add_argument("--llm-latency-ms", type=float, default=800.0, help="fake LLM time to first token")
+    load.add_argument("--llm-token-ms", type=float, default=0.0, help="fake LLM delay per streamed chunk")
+    load.add_argument("--ready-timeout", type=float, default=180.0, help="seconds to wait for /readyz")
+    load.add_argument("--output", default="benchmark-load.json", help="results file (JSON)")
+
+    compare = commands.add_parser("compare", help="compare two result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+
+    args = parser.parse_args(argv)
+    {"micro": run_micro, "load": run_load, "compare": run_compare}[args.command](args)
+
+if __name__ == "__main__":
+    main()
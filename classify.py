@@ -0,0 +1,226 @@
+"""Offline bulk classification of leaf images.
+
+Streams images from a directory or a tar archive, decodes/resizes them in a
+process pool, feeds fixed-size batches to the same model the backend serves
+and appends one result per image to a JSONL or CSV file. Re-running with the
+same output file skips images that already have a result, so an interrupted
+run resumes where it stopped.
+
+    python classify.py /data/leaves results.jsonl
+    python classify.py archive.tar.gz results.csv --batch-size 128 --workers 8
+"""
+import argparse
+import csv
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import tarfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from image_decode import TARGET_SIZE as IMAGE_SIZE, decode_image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+CSV_FIELDS = ["path", "disease_name", "confidence", "error"]
+
+
+# -------------------------------------
+# Input Streaming
+# -------------------------------------
+def iter_directory(root):
+    """Yield (key, path) for every image under ``root`` in a stable order"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(dirpath, filename)
+                yield os.path.relpath(path, root), path
+
+def iter_tar(archive):
+    """Yield (member_name, bytes) from a tar archive without extracting it"""
+    # "r|*" 以流方式读取，不需要随机访问，也不会把整个归档读入内存
+    with tarfile.open(archive, "r|*") as tar:
+        for member in tar:
+            if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield member.name, tar.extractfile(member).read()
+
+def iter_source(source):
+    if os.path.isdir(source):
+        return iter_directory(source)
+    return iter_tar(source)
+
+# -------------------------------------
+# Decoding (runs in worker processes)
+# -------------------------------------
+def decode_task(source):
+    try:
+        return decode_image(source), None
+    except Exception as e:
+        return None, f"Image processing error: {str(e)}"
+
+# -------------------------------------
+# Output
+# -------------------------------------
+class ResultWriter:
+    """Append-only JSONL/CSV writer that remembers which keys are already done"""
+
+    def __init__(self, path, fmt=None):
+        self.path = path
+        self.format = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+        self.done = self._load_done()
+        write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", encoding="utf-8", newline="")
+        if self.format == "csv":
+            self._csv = csv.DictWriter(self._file, fieldnames=CSV_FIELDS)
+            if write_header:
+                self._csv.writeheader()
+                self._file.flush()
+
+    def _load_done(self):
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, "r", encoding="utf-8", newline="") as f:
+            if self.format == "csv":
+                for row in csv.DictReader(f):
+                    done.add(row["path"])
+            else:
+                for line in f:
+                    try:
+                        done.add(json.loads(line)["path"])
+                    except (ValueError, KeyError):
+                        # 上次中断时可能留下半行，忽略
+                        continue
+        return done
+
+    def write(self, records):
+        for record in records:
+            if self.format == "csv":
+                self._csv.writerow(record)
+            else:
+                self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # 每个批次落盘一次，中断时最多丢失一个批次
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+# -------------------------------------
+# Pipeline
+# -------------------------------------
+def load_backend():
+    """Import plant-disease-backend.py for its load_model_version/predict_batch"""
+    return importlib.import_module("plant-disease-backend")
+
+def run(source, output, batch_size=64, workers=None, fmt=None, report_every=10.0):
+    workers = workers or os.cpu_count() or 1
+    # 解码进程用 spawn 启动：主进程随后会加载多线程的 TensorFlow，fork 出的子进程可能死锁；
+    # 子进程只导入本模块（numpy + image_decode），不加载 TensorFlow 和模型
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        return _run(pool, source, output, batch_size, workers, fmt, report_every)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+def _run(pool, source, output, batch_size, workers, fmt, report_every):
+    backend = load_backend()
+    # 整个任务固定使用同一个模型版本
+    model_version = backend.load_model_version()
+
+    writer = ResultWriter(output, fmt)
+    # 在途解码任务数上限，保证内存有界
+    max_inflight = max(batch_size * 2, workers * 4)
+
+    batch = np.empty((batch_size, *IMAGE_SIZE, 3), dtype=np.float32)
+    batch_keys = []
+    pending_errors = []
+    processed = skipped = failed = 0
+    started = last_report = time.perf_counter()
+
+    def flush_batch():
+        nonlocal processed
+        records = list(pending_errors)
+        pending_errors.clear()
+        if batch_keys:
+            predictions = backend.predict_batch(batch[:len(batch_keys)], model_version)
+            for key, (predicted_index, confidence) in zip(batch_keys, predictions):
+                records.append({
+                    "path": key,
+                    "disease_name": model_version.class_names[predicted_index],
+                    "confidence": confidence,
+                    "error": None,
+                })
+            batch_keys.clear()
+        if records:
+            writer.write(records)
+            processed += len(records)
+
+    def report(final=False):
+        elapsed = time.perf_counter() - started
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        label = "完成" if final else "进度"
+        print(f"{label}: {processed} 张已处理, {failed} 张失败, {skipped} 张跳过, "
+              f"{rate:.1f} images/sec", file=sys.stderr)
+
+    def handle(key, outcome):
+        nonlocal failed
+        image_array, error = outcome
+        if error is not None:
+            failed += 1
+            pending_errors.append({"path": key, "disease_name": None, "confidence": None, "error": error})
+            return
+        batch[len(batch_keys)] = image_array
+        batch_keys.append(key)
+        if len(batch_keys) == batch_size:
+            flush_batch()
+
+    inflight = deque()
+    try:
+        for key, item in iter_source(source):
+            if key in writer.done:
+                skipped += 1
+                continue
+            inflight.append((key, pool.submit(decode_task, item)))
+            # 按提交顺序取回结果，窗口满时等待最早的任务
+            while len(inflight) >= max_inflight or (inflight and inflight[0][1].done()):
+                key_done, future = inflight.popleft()
+                handle(key_done, future.result())
+
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                report()
+                last_report = now
+
+        while inflight:
+            key_done, future = inflight.popleft()
+            handle(key_done, future.result())
+        flush_batch()
+    except KeyboardInterrupt:
+        # 丢弃未完成的任务，已写入的结果保留，下次运行会从这里继续
+        print("已中断，重新运行相同命令即可继续", file=sys.stderr)
+    finally:
+        writer.close()
+        report(final=True)
+
+    return processed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-classify leaf images with the plant disease model")
+    parser.add_argument("source", help="image directory or tar archive (.tar, .tar.gz, ...)")
+    parser.add_argument("output", help="results file (.jsonl or .csv); existing results are skipped")
+    parser.add_argument("--batch-size", type=int, default=64, help="images per model call")
+    parser.add_argument("--workers", type=int, default=None, help="decode processes (default: CPU count)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None,
+                        help="output format (default: from the output file extension)")
+    args = parser.parse_args(argv)
+
+    run(args.source, args.output, batch_size=max(1, args.batch_size), workers=args.workers, fmt=args.format)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Export the Keras model to TFLite and compare it against the original.
+
+    # float32 TFLite
+    python convert.py --output plant_disease_model.tflite
+    # float16 weights
+    python convert.py --quantize float16 --output plant_disease_model_fp16.tflite
+    # int8 post-training quantization calibrated on sample images
+    python convert.py --quantize int8 --calibration-dir samples/ --output plant_disease_model_int8.tflite \
+        --holdout-dir holdout/ --report conversion_report.json
+
+The holdout directory may be flat or use one sub-directory per class name
+(the PlantVillage layout); with class sub-directories the report also
+includes top-1 accuracy. Serve the result with INFERENCE_RUNTIME=tflite
+and TFLITE_MODEL_PATH=<output>.
+"""
+import argparse
+import importlib
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from classify import iter_directory
+from image_decode import decode_image
+
+QUANTIZATION_MODES = ("none", "float16", "int8")
+
+
+# -------------------------------------
+# Export
+# -------------------------------------
+def load_images(directory, limit=None):
+    """Decode up to ``limit`` images from ``directory`` as (keys, (N, 128, 128, 3) float32)"""
+    keys, arrays = [], []
+    for key, path in itertools.islice(iter_directory(directory), limit):
+        try:
+            arrays.append(decode_image(path))
+        except Exception as e:
+            print(f"跳过无法读取的图片 {key}: {e}")
+            continue
+        keys.append(key)
+    if not arrays:
+        raise SystemExit(f"No readable images found in {directory}")
+    return keys, np.stack(arrays)
+
+def export_tflite(keras_model, output, quantize="none", calibration=None):
+    """Convert ``keras_model`` to a TFLite flatbuffer at ``output``"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+
+    if quantize == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == "int8":
+        if calibration is None:
+            raise SystemExit("--quantize int8 requires --calibration-dir")
+
+        def representative_dataset():
+            for image_array in calibration:
+                yield [image_array[np.newaxis]]
+
+        # 权重与激活均量化为int8，输入输出保持float32，接口与原模型一致
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    tflite_model = converter.convert()
+    with open(output, "wb") as f:
+        f.write(tflite_model)
+    return len(tflite_model)
+
+# -------------------------------------
+# Comparison Report
+# -------------------------------------
+def measure_latency(runtime, images, batch_size, repeats):
+    """Median milliseconds per call of ``runtime.predict`` on a batch of ``batch_size``"""
+    batch = images[:batch_size]
+    if len(batch) < batch_size:
+        batch = np.resize(images, (batch_size, *images.shape[1:]))
+    runtime.predict(batch)  # 预热
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        runtime.predict(batch)
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return float(np.median(timings))
+
+def predict_all(runtime, images, batch_size=32):
+    return np.concatenate([
+        runtime.predict(images[start:start + batch_size])
+        for start in range(0, len(images), batch_size)
+    ])
+
+def compare(backend, runtimes, keys, images, batch_sizes=(1, 8, 32), repeats=20):
+    """Top-1 agreement with the Keras reference, accuracy (if labelled) and latency"""
+    labels = [backend.class_names.index(key.split(os.sep)[0])
+              if os.sep in key and key.split(os.sep)[0] in backend.class_names else None
+              for key in keys]
+    labelled = [i for i, label in enumerate(labels) if label is not None]
+
+    reference = None
+    report = {"holdout_images": len(keys), "labelled_images": len(labelled), "runtimes": {}}
+    for name, runtime in runtimes.items():
+        top1 = np.argmax(predict_all(runtime, images), axis=1)
+        if reference is None:
+            reference = top1
+        entry = {
+            "path": runtime.path,
+            "size_bytes": os.path.getsize(runtime.path) if os.path.isfile(runtime.path) else None,
+            "top1_agreement_with_keras": float(np.mean(top1 == reference)),
+            "changed_top1": [keys[i] for i in np.flatnonzero(top1 != reference)],
+            "latency_ms": {
+                str(batch_size): measure_latency(runtime, images, batch_size, repeats)
+                for batch_size in batch_sizes
+            },
+        }
+        if labelled:
+            entry["top1_accuracy"] = float(np.mean([top1[i] == labels[i] for i in labelled]))
+        report["runtimes"][name] = entry
+    return report
+
+def print_report(report):
+    print(f"holdout: {report['holdout_images']} 张图片, 其中 {report['labelled_images']} 张带标签")
+    for name, entry in report["runtimes"].items():
+        latency = ", ".join(f"bs{size}={ms:.2f}ms" for size, ms in entry["latency_ms"].items())
+        accuracy = f", acc={entry['top1_accuracy']:.4f}" if "top1_accuracy" in entry else ""
+        print(f"  {name:8s} agree={entry['top1_agreement_with_keras']:.4f}{accuracy}, "
+              f"changed={len(entry['changed_top1'])}, {latency}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the plant disease model to TFLite")
+    parser.add_argument("--model", default="new_trained_plant_disease_model.keras", help="source Keras model")
+    parser.add_argument("--output", default="plant_disease_model.tflite", help="TFLite file to write")
+    parser.add_argument("--quantize", choices=QUANTIZATION_MODES, default="none",
+                        help="post-training quantization mode")
+    parser.add_argument("--calibration-dir", help="sample images for int8 calibration")
+    parser.add_argument("--calibration-size", type=int, default=200, help="max calibration images")
+    parser.add_argument("--holdout-dir", help="images used to compare TFLite against Keras")
+    parser.add_argument("--holdout-size", type=int, default=1000, help="max holdout images")
+    parser.add_argument("--report", default=None, help="write the comparison report as JSON")
+    args = parser.parse_args(argv)
+
+    backend = importlib.import_module("plant-disease-backend")
+    keras_runtime = backend.KerasRuntime(args.model)
+
+    calibration = None
+    if args.calibration_dir:
+        _, calibration = load_images(args.calibration_dir, args.calibration_size)
+        print(f"校准图片: {len(calibration)} 张")
+
+    started = time.perf_counter()
+    size = export_tflite(keras_runtime.model, args.output, args.quantize, calibration)
+    print(f"已导出 {args.output} ({size / 1024 / 1024:.1f} MB, quantize={args.quantize}) "
+          f"用时 {time.perf_counter() - started:.1f}s")
+
+    if not args.holdout_dir:
+        return
+
+    keys, images = load_images(args.holdout_dir, args.holdout_size)
+    runtimes = {
+        "keras": keras_runtime,
+        f"tflite-{args.quantize}": backend.TFLiteRuntime(args.output),
+    }
+    report = compare(backend, runtimes, keys, images)
+    report["quantize"] = args.quantize
+    print_report(report)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"报告已写入 {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Local stand-in for the OpenAI-compatible LLM used by the backend.
+
+Answers ``POST /v1/chat/completions`` (plain and ``stream=True``) with a
+fixed, well-formed disease description after a configurable delay, so
+benchmarks and load tests run offline and give repeatable numbers.
+
+    python fake_llm.py --port 8600 --latency-ms 800 --token-ms 5
+    LLM_BASE_URL=http://127.0.0.1:8600/v1/ python plant-disease-backend.py
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI(title="Fake LLM")
+
+# 由命令行参数覆盖
+settings = {"latency_ms": 800.0, "token_ms": 0.0, "chunk_chars": 8}
+
+REPLY_TEMPLATE = (
+    "<think>整理{name}的资料。</think>\n"
+    "1. 描述：{name}是一种常见的植物病害，会降低作物产量。\n"
+    "2. 原因：病原菌在温暖潮湿的环境中传播。\n"
+    "3. 症状：叶片出现褐色或黄色病斑，严重时叶片枯萎脱落。\n"
+    "4. 治疗：清除病叶，按说明喷洒对应的杀菌剂。\n"
+    "5. 预防：轮作、保持通风、避免叶面长时间潮湿。\n"
+    "6. 有用资源：搜索\"{name} 防治\"查看相关视频教程。"
+)
+
+def reply_for(messages):
+    """Deterministic reply text for the disease named in the prompt"""
+    prompt = messages[-1]["content"] if messages else ""
+    match = re.search(r"疾病'(.+?)'", prompt)
+    return REPLY_TEMPLATE.format(name=match.group(1) if match else "该病害")
+
+def completion_body(model, text):
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(text), "total_tokens": len(text)},
+    }
+
+def chunk_body(model, delta, finish_reason=None):
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "fake", "object": "model", "owned_by": "fake_llm"}]}
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "fake")
+    text = reply_for(body.get("messages", []))
+    chunk_chars = settings["chunk_chars"]
+    chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+
+    # 首 token 延迟
+    await asyncio.sleep(settings["latency_ms"] / 1000.0)
+
+    if not body.get("stream"):
+        # 非流式请求等价于生成完全部 token 后一次返回
+        await asyncio.sleep(settings["token_ms"] * len(chunks) / 1000.0)
+        return completion_body(model, text)
+
+    async def events():
+        yield f"data: {json.dumps(chunk_body(model, {'role': 'assistant'}))}\n\n"
+        for chunk in chunks:
+            if settings["token_ms"]:
+                await asyncio.sleep(settings["token_ms"] / 1000.0)
+            yield f"data: {json.dumps(chunk_body(model, {'content': chunk}), ensure_ascii=False)}\n\n"
+        yield f"data: {json.dumps(chunk_body(model, {}, 'stop'))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="delay before the first token")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="delay between streamed chunks")
+    parser.add_argument("--chunk-chars", type=int, default=8, help="characters per streamed chunk")
+    args = parser.parse_args(argv)
+
+    settings.update(latency_ms=args.latency_ms, token_ms=args.token_ms, chunk_chars=max(1, args.chunk_chars))
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
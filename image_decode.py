@@ -0,0 +1,303 @@
+"""Image decode stage shared by the backend and the offline tools.
+
+Decodes an upload straight into a caller-provided float32 buffer of the
+model's input size. For JPEGs much larger than the target it asks libjpeg
+for a reduced-size (DCT-scaled) decode via ``Image.draft``, so a 12 MP phone
+photo is never materialised at full resolution. Byte-size and pixel-count
+limits are checked before any pixel data is decoded.
+
+``TiledImage`` serves the tiled high-resolution mode: it cuts a large photo
+into overlapping square tiles at model input size, filling float32 tile
+batches one at a time from a bounded uint8 working copy.
+"""
+import io
+import math
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+TARGET_SIZE = (128, 128)
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_MAX_PIXELS = 50_000_000
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured byte or pixel limit"""
+
+
+class MemoryBudgetError(ImageTooLargeError):
+    """Raised when decoding an upload for tiling would exceed its memory budget"""
+
+
+class DecodeStats:
+    """Thread-safe counters for decode time and decoded-image memory"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.decoded = 0
+        self.reduced = 0
+        self.rejected = 0
+        self.failed = 0
+        self.decode_seconds_total = 0.0
+        self.decode_seconds_max = 0.0
+        self.peak_bytes_max = 0
+        self.peak_bytes_last = 0
+
+    def record(self, seconds, peak_bytes, reduced):
+        with self._lock:
+            self.decoded += 1
+            self.reduced += int(reduced)
+            self.decode_seconds_total += seconds
+            self.decode_seconds_max = max(self.decode_seconds_max, seconds)
+            self.peak_bytes_last = peak_bytes
+            self.peak_bytes_max = max(self.peak_bytes_max, peak_bytes)
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def record_failed(self):
+        with self._lock:
+            self.failed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "decoded": self.decoded,
+                "reduced_jpeg_decodes": self.reduced,
+                "rejected_too_large": self.rejected,
+                "failed": self.failed,
+                "decode_mean_ms": self.decode_seconds_total / self.decoded * 1000.0 if self.decoded else 0.0,
+                "decode_max_ms": self.decode_seconds_max * 1000.0,
+                "peak_image_bytes_last": self.peak_bytes_last,
+                "peak_image_bytes_max": self.peak_bytes_max,
+            }
+
+decode_stats = DecodeStats()
+
+def _image_bytes(image):
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+def _open_checked(source, max_bytes, max_pixels):
+    """Open ``source`` lazily and enforce the byte and pixel limits"""
+    if isinstance(source, (str, os.PathLike)):
+        size = os.path.getsize(source)
+    else:
+        size = len(source)
+        # BytesIO 直接包装调用方的缓冲区
+        source = io.BytesIO(source)
+    if max_bytes and size > max_bytes:
+        raise ImageTooLargeError(f"Image is {size} bytes, limit is {max_bytes}")
+
+    image = Image.open(source)
+    # Image.open 只读取文件头，此时还没有解码像素
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        image.close()
+        raise ImageTooLargeError(f"Image is {width}x{height} pixels, limit is {max_pixels}")
+    return image
+
+def _draft(image, mode, target):
+    """Request a DCT-scaled JPEG decode no smaller than ``target``; True if reduced"""
+    width, height = image.size
+    if image.format == "JPEG" and (width >= 2 * target[0] or height >= 2 * target[1]):
+        # JPEG按1/2、1/4、1/8缩放解码，结果仍不小于目标尺寸
+        image.draft(mode, target)
+        return image.size != (width, height)
+    return False
+
+def decode_into(source, out, max_bytes=DEFAULT_MAX_BYTES, max_pixels=DEFAULT_MAX_PIXELS, stats=decode_stats,
+                timings=None):
+    """Decode ``source`` (bytes, memoryview or path) into ``out``.
+
+    ``out`` must be a float32 array of shape ``(height, width, 3)``; it is
+    filled in place and returned. Raises ``ImageTooLargeError`` when a limit
+    is exceeded and PIL's errors for unreadable data. If ``timings`` is a
+    dict, the ``decode`` and ``resize`` durations (seconds) are stored in it.
+    """
+    started = time.perf_counter()
+    target = (out.shape[1], out.shape[0])
+    try:
+        with _open_checked(source, max_bytes, max_pixels) as image:
+            reduced = _draft(image, "RGB", target)
+            image = image.convert("RGB")
+            peak_bytes = _image_bytes(image)
+            decoded = time.perf_counter()
+            if image.size != target:
+                image = image.resize(target)
+            # uint8 -> float32 直接写入目标缓冲区，不产生中间 float 数组
+            np.copyto(out, np.asarray(image), casting="unsafe")
+    except ImageTooLargeError:
+        stats.record_rejected()
+        raise
+    except Exception:
+        stats.record_failed()
+        raise
+
+    finished = time.perf_counter()
+    if timings is not None:
+        timings["decode"] = decoded - started
+        timings["resize"] = finished - decoded
+    stats.record(finished - started, peak_bytes + out.nbytes, reduced)
+    return out
+
+def decode_image(source, size=TARGET_SIZE, **limits):
+    """Decode ``source`` into a new ``(height, width, 3)`` float32 array"""
+    out = np.empty((size[1], size[0], 3), dtype=np.float32)
+    return decode_into(source, out, **limits)
+
+def _decoded_bytes(size, mode):
+    """Bytes held while decoding an image of ``size`` in ``mode`` and converting it to RGB"""
+    bands = Image.getmodebands(mode)
+    return size[0] * size[1] * (bands + (3 if mode != "RGB" else 0))
+
+def _jpeg_scale(size, target):
+    """DCT scale denominator ``Image.draft`` picks for ``target`` (the result stays at least ``target``)"""
+    for denominator in (8, 4, 2):
+        if math.ceil(size[0] / denominator) >= target[0] and math.ceil(size[1] / denominator) >= target[1]:
+            return denominator
+    return 1
+
+def tile_offsets(length, window, count):
+    """``count`` evenly spread start offsets of a ``window`` sliding over ``length``; the last ends at the edge"""
+    if count <= 1:
+        return [max(0, (length - window) // 2)]
+    return [round(i * (length - window) / (count - 1)) for i in range(count)]
+
+class TiledImage:
+    """Overlapping square tiles of a large image, resized to ``tile_size`` batch by batch.
+
+    The tile window is ``1 / tiles_per_side`` of the shorter side (never
+    less than ``tile_size`` pixels); neighbouring windows overlap by
+    ``overlap``. When the grid would exceed ``max_tiles`` the window grows
+    until it fits. Only a uint8 working copy at tile scale is kept and it
+    is shrunk further to stay within ``memory_budget`` bytes, so the
+    full-resolution float array never exists; float32 data is produced by
+    ``fill`` for one batch at a time. The decode itself is checked against
+    the budget before any pixels are read: JPEGs are DCT-scaled (down to
+    1/8) until they fit, other formats can only be decoded at full size
+    and raise ``MemoryBudgetError`` when that does not fit.
+    """
+
+    def __init__(self, source, tile_size=TARGET_SIZE, tiles_per_side=3, overlap=0.25, max_tiles=64,
+                 memory_budget=32 * 1024 * 1024, max_bytes=DEFAULT_MAX_BYTES, max_pixels=DEFAULT_MAX_PIXELS,
+                 stats=decode_stats):
+        started = time.perf_counter()
+        self.tile_size = tile_size
+        try:
+            with _open_checked(source, max_bytes, max_pixels) as image:
+                self.image_size = width, height = image.size
+                self._plan_grid(tiles_per_side, overlap, max_tiles)
+                # 工作副本的缩放比例：窗口缩放到模型输入大小即可，内存预算不足时进一步缩小
+                scale = min(1.0, tile_size[0] / self.window)
+                if width * height * 3 * scale * scale > memory_budget:
+                    scale = math.sqrt(memory_budget / (width * height * 3))
+                    self.budget_limited = True
+                else:
+                    self.budget_limited = False
+                working = (max(1, round(width * scale)), max(1, round(height * scale)))
+                reduced = False
+                if image.format == "JPEG":
+                    # 选择 DCT 缩放比例：结果不小于工作副本，解码结果超出预算时继续缩小（最多 1/8）
+                    denominator = _jpeg_scale(image.size, working)
+                    while denominator < 8 and _decoded_bytes(
+                            (math.ceil(width / denominator), math.ceil(height / denominator)), "RGB") > memory_budget:
+                        denominator *= 2
+                    if denominator > 1:
+                        image.draft("RGB", (math.ceil(width / denominator), math.ceil(height / denominator)))
+                        reduced = image.size != (width, height)
+                decode_bytes = _decoded_bytes(image.size, image.mode)
+                if decode_bytes > memory_budget:
+                    # 在读取像素之前拒绝：非 JPEG 格式只能按原尺寸解码
+                    raise MemoryBudgetError(f"Decoding {width}x{height} {image.format} needs {decode_bytes} bytes, "
+                                            f"tiling memory budget is {int(memory_budget)}")
+                if image.size[0] < working[0] or image.size[1] < working[1]:
+                    working = image.size
+                    self.budget_limited = True
+                image = image.convert("RGB")
+                peak_bytes = _image_bytes(image)
+                if image.size != working:
+                    image = image.resize(working, Image.BOX)
+                self._working = image
+        except ImageTooLargeError:
+            stats.record_rejected()
+            raise
+        except Exception:
+            stats.record_failed()
+            raise
+
+        self.working_size = working
+        self.peak_bytes = max(peak_bytes, _image_bytes(self._working))
+        self.decode_seconds = time.perf_counter() - started
+        stats.record(self.decode_seconds, self.peak_bytes, reduced)
+
+    def _plan_grid(self, tiles_per_side, overlap, max_tiles):
+        width, height = self.image_size
+        short_side = min(width, height)
+        window = min(short_side, max(self.tile_size[0], short_side / max(1, tiles_per_side)))
+        overlap = min(max(overlap, 0.0), 0.9)
+        max_tiles = max(1, max_tiles)
+        self.capped = False
+        while True:
+            stride = window * (1.0 - overlap)
+            cols = math.ceil(max(0.0, width - window) / stride) + 1
+            rows = math.ceil(max(0.0, height - window) / stride) + 1
+            if rows * cols <= max_tiles or window >= short_side:
+                break
+            # 瓦片数超出上限：放大窗口（降低瓦片分辨率）直到放得下
+            window = min(short_side, window * 1.25)
+            self.capped = True
+        if rows * cols > max_tiles:
+            # 极端长宽比的图片：沿长边均匀抽取瓦片
+            self.capped = True
+            if width >= height:
+                cols = max(1, max_tiles // rows)
+            else:
+                rows = max(1, max_tiles // cols)
+        self.window = window = int(round(window))
+        self.rows, self.cols = rows, cols
+        self.boxes = [
+            (left, top, left + window, top + window)
+            for top in tile_offsets(height, window, rows)
+            for left in tile_offsets(width, window, cols)
+        ]
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def fill(self, out, start):
+        """Write tiles ``start:start + len(out)`` into the float32 batch ``out``; returns the number written"""
+        scale_x = self.working_size[0] / self.image_size[0]
+        scale_y = self.working_size[1] / self.image_size[1]
+        boxes = self.boxes[start:start + len(out)]
+        for row, (left, top, right, bottom) in enumerate(boxes):
+            box = (left * scale_x, top * scale_y, right * scale_x, bottom * scale_y)
+            # 直接从工作副本的对应区域缩放出一个瓦片，不产生整图的 float 数组
+            tile = self._working.resize(self.tile_size, Image.BILINEAR, box=box)
+            np.copyto(out[row], np.asarray(tile), casting="unsafe")
+        return len(boxes)
+
+    def close(self):
+        self._working.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def perceptual_hash(source, hash_size=8, max_bytes=DEFAULT_MAX_BYTES, max_pixels=DEFAULT_MAX_PIXELS):
+    """64-bit difference hash (dHash) of ``source``; re-encodes of one photo hash alike.
+
+    Only a tiny grayscale thumbnail is decoded (JPEGs at 1/8 scale), so this is
+    much cheaper than the full decode-resize path.
+    """
+    thumbnail = (hash_size + 1, hash_size)
+    with _open_checked(source, max_bytes, max_pixels) as image:
+        _draft(image, "L", thumbnail)
+        pixels = np.asarray(image.convert("L").resize(thumbnail), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
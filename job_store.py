@@ -0,0 +1,326 @@
+"""SQLite-backed store for asynchronous prediction jobs.
+
+A job is a list of images submitted in one ``POST /jobs``; every image is an
+item that moves through
+
+    pending -> running -> classified -> done
+                  \\-> (retry) pending      \\-> failed
+
+``running`` items carry a lease, so items claimed by a process that died are
+picked up again once the lease expires; together with the database file this
+lets pending jobs resume after a restart. Items that need LLM disease info
+wait in ``classified`` until the info has been filled in. Image bytes are
+kept only until the item is finished.
+
+Every method is blocking; the backend calls them from a worker thread. The
+database runs in WAL mode, so several backend processes can share one file.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    total INTEGER NOT NULL,
+    disease_info INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    filename TEXT,
+    payload BLOB,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    disease_name TEXT,
+    confidence REAL,
+    model_version TEXT,
+    disease_info TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, position)
+);
+CREATE INDEX IF NOT EXISTS items_by_status ON items (status, available_at);
+"""
+
+PENDING, RUNNING, CLASSIFIED, DONE, FAILED = "pending", "running", "classified", "done", "failed"
+
+
+class JobStore:
+    """Persistent job queue; see the module docstring for the item lifecycle"""
+
+    def __init__(self, path, max_attempts=3, retry_backoff=5.0, lease_seconds=300.0):
+        self.path = path
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+        self.retried = 0
+
+    def _transaction(self, func, *args):
+        # BEGIN IMMEDIATE：多个进程同时领取任务时互斥
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(*args)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return result
+
+    def create_job(self, images, disease_info=True):
+        """Store ``[(filename, image_bytes)]`` as a new job and return its id"""
+        job_id = uuid.uuid4().hex
+
+        def insert():
+            self._db.execute(
+                "INSERT INTO jobs (id, created_at, total, disease_info) VALUES (?, ?, ?, ?)",
+                (job_id, time.time(), len(images), int(disease_info)),
+            )
+            self._db.executemany(
+                "INSERT INTO items (job_id, position, filename, payload, status) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, position, filename, payload, PENDING)
+                 for position, (filename, payload) in enumerate(images)],
+            )
+
+        self._transaction(insert)
+        return job_id
+
+    def claim(self, limit):
+        """Lease up to ``limit`` items ready for classification, oldest jobs first.
+
+        Returns ``[(job_id, position, payload)]``. Items left ``running`` by a
+        process that died become claimable again once their lease expires;
+        every claim counts as an attempt, so an image that keeps killing the
+        process eventually fails instead of looping.
+        """
+        def claim():
+            now = time.time()
+            rows = self._db.execute(
+                """
+                SELECT items.job_id, items.position, items.payload, items.status, items.attempts
+                FROM items JOIN jobs ON jobs.id = items.job_id
+                WHERE (items.status = ? OR items.status = ?) AND items.available_at <= ?
+                ORDER BY jobs.created_at, items.position LIMIT ?
+                """,
+                (PENDING, RUNNING, now, limit),
+            ).fetchall()
+            claimed, abandoned = [], []
+            for row in rows:
+                if row["status"] == RUNNING and row["attempts"] >= self.max_attempts:
+                    abandoned.append((row["job_id"], row["position"]))
+                else:
+                    claimed.append(row)
+            self._db.executemany(
+                "UPDATE items SET status = ?, attempts = attempts + 1, available_at = ? WHERE job_id = ? AND position = ?",
+                [(RUNNING, now + self.lease_seconds, row["job_id"], row["position"]) for row in claimed],
+            )
+            if abandoned:
+                self._db.executemany(
+                    "UPDATE items SET status = ?, error = ?, payload = NULL WHERE job_id = ? AND position = ?",
+                    [(FAILED, "Processing did not finish (lease expired)", *key) for key in abandoned],
+                )
+                self._finish_jobs({job_id for job_id, _ in abandoned})
+            return [(row["job_id"], row["position"], row["payload"]) for row in claimed]
+
+        return self._transaction(claim)
+
+    def classified(self, results):
+        """Record ``[(job_id, position, disease_name, confidence, model_version)]``.
+
+        Items of jobs that asked for disease info and are not healthy move on
+        to ``classified``; the rest are done.
+        """
+        def update():
+            for job_id, position, disease_name, confidence, model_version in results:
+                wants_info = self._db.execute(
+                    "SELECT disease_info FROM jobs WHERE id = ?", (job_id,)
+                ).fetchone()["disease_info"]
+                needs_info = wants_info and "healthy" not in disease_name.lower()
+                self._db.execute(
+                    """
+                    UPDATE items SET status = ?, disease_name = ?, confidence = ?, model_version = ?,
+                        attempts = 0, available_at = 0, error = NULL, payload = NULL
+                    WHERE job_id = ? AND position = ?
+                    """,
+                    (CLASSIFIED if needs_info else DONE, disease_name, confidence, model_version, job_id, position),
+                )
+            self._finish_jobs({job_id for job_id, *_ in results})
+
+        self._transaction(update)
+
+    def failed(self, keys, error, retry=True):
+        """Record a failed attempt for ``[(job_id, position)]``.
+
+        Retryable failures go back to ``pending`` with exponential backoff
+        until ``max_attempts`` is reached; the rest fail for good.
+        """
+        def update():
+            now = time.time()
+            for job_id, position in keys:
+                # claim 时已计入本次尝试
+                attempts = self._db.execute(
+                    "SELECT attempts FROM items WHERE job_id = ? AND position = ?", (job_id, position)
+                ).fetchone()["attempts"]
+                if retry and attempts < self.max_attempts:
+                    self.retried += 1
+                    self._db.execute(
+                        "UPDATE items SET status = ?, available_at = ?, error = ? WHERE job_id = ? AND position = ?",
+                        (PENDING, now + self.retry_backoff * 2 ** (attempts - 1), error, job_id, position),
+                    )
+                else:
+                    self._db.execute(
+                        "UPDATE items SET status = ?, error = ?, payload = NULL WHERE job_id = ? AND position = ?",
+                        (FAILED, error, job_id, position),
+                    )
+            self._finish_jobs({job_id for job_id, _ in keys})
+
+        self._transaction(update)
+
+    def diseases_awaiting_info(self, limit):
+        """Distinct disease names of ``classified`` items whose next attempt is due"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT disease_name FROM items WHERE status = ? AND available_at <= ? LIMIT ?",
+                (CLASSIFIED, time.time(), limit),
+            ).fetchall()
+        return [row["disease_name"] for row in rows]
+
+    def info_ready(self, disease_name, disease_info):
+        """Attach ``disease_info`` to every item waiting on ``disease_name``"""
+        def update():
+            job_ids = [row["job_id"] for row in self._db.execute(
+                "SELECT DISTINCT job_id FROM items WHERE status = ? AND disease_name = ?", (CLASSIFIED, disease_name)
+            )]
+            self._db.execute(
+                "UPDATE items SET status = ?, disease_info = ?, error = NULL WHERE status = ? AND disease_name = ?",
+                (DONE, json.dumps(disease_info, ensure_ascii=False), CLASSIFIED, disease_name),
+            )
+            self._finish_jobs(job_ids)
+
+        self._transaction(update)
+
+    def info_failed(self, disease_name, error, fallback, delay=None):
+        """Back off the items waiting on ``disease_name``; after ``max_attempts`` finish them with ``fallback``.
+
+        A ``delay`` postpones them without counting an attempt, for when the
+        upstream is known to be unavailable (circuit breaker open).
+        """
+        def update():
+            now = time.time()
+            rows = self._db.execute(
+                "SELECT job_id, position, attempts FROM items WHERE status = ? AND disease_name = ?",
+                (CLASSIFIED, disease_name),
+            ).fetchall()
+            for row in rows:
+                attempts = row["attempts"] + (delay is None)
+                if attempts < self.max_attempts:
+                    self.retried += 1
+                    wait = delay if delay is not None else self.retry_backoff * 2 ** (attempts - 1)
+                    self._db.execute(
+                        "UPDATE items SET attempts = ?, available_at = ?, error = ? WHERE job_id = ? AND position = ?",
+                        (attempts, now + wait, error, row["job_id"], row["position"]),
+                    )
+                else:
+                    # 分类结果仍然有效，只是没有病害信息
+                    self._db.execute(
+                        "UPDATE items SET status = ?, attempts = ?, disease_info = ?, error = ? "
+                        "WHERE job_id = ? AND position = ?",
+                        (DONE, attempts, json.dumps(fallback, ensure_ascii=False), error,
+                         row["job_id"], row["position"]),
+                    )
+            self._finish_jobs({row["job_id"] for row in rows})
+
+        self._transaction(update)
+
+    def _finish_jobs(self, job_ids):
+        for job_id in job_ids:
+            outstanding = self._db.execute(
+                "SELECT COUNT(*) FROM items WHERE job_id = ? AND status NOT IN (?, ?)", (job_id, DONE, FAILED)
+            ).fetchone()[0]
+            if not outstanding:
+                self._db.execute(
+                    "UPDATE jobs SET finished_at = ? WHERE id = ? AND finished_at IS NULL", (time.time(), job_id)
+                )
+
+    def job(self, job_id):
+        """Job summary with per-status item counts, or None"""
+        with self._lock:
+            job = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(self._db.execute(
+                "SELECT status, COUNT(*) FROM items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        finished = counts.get(DONE, 0) + counts.get(FAILED, 0)
+        if job["finished_at"] is not None:
+            status = "completed"
+        elif finished or counts.get(CLASSIFIED) or counts.get(RUNNING):
+            status = "running"
+        else:
+            status = "queued"
+        return {
+            "job_id": job_id,
+            "status": status,
+            "total": job["total"],
+            "disease_info": bool(job["disease_info"]),
+            "counts": {name: counts.get(name, 0) for name in (PENDING, RUNNING, CLASSIFIED, DONE, FAILED)},
+            "progress": finished / job["total"] if job["total"] else 1.0,
+            "created_at": job["created_at"],
+            "finished_at": job["finished_at"],
+        }
+
+    def results(self, job_id):
+        """Per-item results in submission order"""
+        with self._lock:
+            rows = self._db.execute(
+                """
+                SELECT position, filename, status, disease_name, confidence, model_version, disease_info, error
+                FROM items WHERE job_id = ? ORDER BY position
+                """,
+                (job_id,),
+            ).fetchall()
+        results = []
+        for row in rows:
+            result = {key: row[key] for key in ("filename", "status", "disease_name", "confidence",
+                                                "model_version", "error")}
+            result.update(json.loads(row["disease_info"]) if row["disease_info"] else {})
+            results.append(result)
+        return results
+
+    def delete(self, job_id):
+        """Delete a job and its items; True if it existed"""
+        return self._transaction(
+            lambda: self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount > 0
+        )
+
+    def purge(self, older_than_seconds):
+        """Delete finished jobs older than ``older_than_seconds``; returns how many"""
+        return self._transaction(lambda: self._db.execute(
+            "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+            (time.time() - older_than_seconds,),
+        ).rowcount)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+            jobs_open = self._db.execute("SELECT COUNT(*) FROM jobs WHERE finished_at IS NULL").fetchone()[0]
+        return {
+            "jobs_open": jobs_open,
+            **{f"items_{name}": counts.get(name, 0) for name in (PENDING, RUNNING, CLASSIFIED, DONE, FAILED)},
+            "retried": self.retried,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,239 @@
+"""Resilient wrapper around the OpenAI-compatible LLM client.
+
+Every call gets a deadline, transient failures (connection errors, timeouts,
+429 and 5xx) are retried a bounded number of times with full-jitter
+exponential backoff, and a circuit breaker stops calling an upstream that
+keeps failing: while it is open calls fail immediately with
+``CircuitOpenError`` instead of tying up a request for the whole timeout.
+An optional ``total_timeout`` bounds one call across all its attempts and
+backoff sleeps.
+After ``reset_timeout`` seconds one probe call is let through (half-open);
+its outcome closes or re-opens the breaker.
+"""
+import asyncio
+import random
+import threading
+import time
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the upstream while the breaker is open"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_total = 0
+        self.rejected = 0
+        self._probe_started = None
+
+    def allow(self):
+        """True if a call may go upstream now"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            # 半开状态只放行一个探测请求；探测请求被取消而没有结果时，超时后再放行一个
+            if self.state == HALF_OPEN and (self._probe_started is None
+                                            or now - self._probe_started >= self.reset_timeout):
+                self._probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_started = None
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened_total += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def retry_after(self):
+        """Seconds until the next probe is allowed (0 unless open)"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "open": int(self.state == OPEN),
+                "consecutive_failures": self.failures,
+                "opened_total": self.opened_total,
+                "rejected": self.rejected,
+            }
+
+
+def _retryable(error):
+    """Transient upstream errors worth retrying (and counting against the breaker)"""
+    import openai
+
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError, openai.RateLimitError,
+                          openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class ResilientLLMClient:
+    """Pooled AsyncOpenAI client with deadlines, bounded retries and a circuit breaker.
+
+    ``complete(**request)`` returns the chat completion; ``stream(**request)``
+    is an async generator of completion chunks. ``request`` is passed through
+    to ``chat.completions.create``.
+    """
+
+    def __init__(self, base_url, api_key, timeout=30.0, max_retries=2, backoff=0.2, backoff_max=5.0,
+                 max_connections=8, breaker=None, total_timeout=None):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.total_timeout = total_timeout or None
+        self.max_retries = max(0, max_retries)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.max_connections = max(1, max_connections)
+        self.breaker = breaker or CircuitBreaker()
+        self._client = None
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.timeouts = 0
+
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+            from openai import AsyncOpenAI
+
+            # 连接池复用到上游的 keep-alive 连接；重试由本类负责，关闭 SDK 自带重试
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=httpx.Timeout(self.timeout, connect=min(5.0, self.timeout)),
+            )
+            self._client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key,
+                                       max_retries=0, timeout=self.timeout, http_client=http_client)
+        return self._client
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"LLM circuit open, retry in {self.breaker.retry_after():.0f}s")
+
+    def _deadline(self):
+        return None if self.total_timeout is None else time.monotonic() + self.total_timeout
+
+    def _attempt_timeout(self, deadline):
+        """Timeout for the next attempt; TimeoutError once the overall deadline has passed"""
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError("LLM call exceeded its total timeout")
+        return min(self.timeout, remaining)
+
+    async def _backoff(self, attempt, deadline):
+        # full jitter: 在 [0, base * 2^attempt] 内随机等待，避免多个请求同时重试
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+        if deadline is not None:
+            delay = min(delay, max(0.0, deadline - time.monotonic()))
+        await asyncio.sleep(delay)
+
+    def _failed(self, error):
+        """Record a failed attempt; True if it should be retried"""
+        if not _retryable(error):
+            # 4xx 等错误说明上游可达，不计入熔断
+            self.breaker.record_success()
+            return False
+        self.failures += 1
+        if isinstance(error, asyncio.TimeoutError):
+            self.timeouts += 1
+        self.breaker.record_failure()
+        return True
+
+    async def complete(self, **request):
+        deadline = self._deadline()
+        for attempt in range(self.max_retries + 1):
+            timeout = self._attempt_timeout(deadline)
+            self._check_breaker()
+            self.calls += 1
+            try:
+                response = await asyncio.wait_for(
+                    self._get_client().chat.completions.create(**request), timeout=timeout
+                )
+            except Exception as e:
+                if not self._failed(e) or attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                await self._backoff(attempt, deadline)
+                continue
+            self.breaker.record_success()
+            return response
+
+    async def stream(self, **request):
+        """Yield chunks; retried only until the first chunk has been yielded"""
+        request["stream"] = True
+        deadline = self._deadline()
+        for attempt in range(self.max_retries + 1):
+            timeout = self._attempt_timeout(deadline)
+            self._check_breaker()
+            self.calls += 1
+            started = False
+            try:
+                stream = await asyncio.wait_for(
+                    self._get_client().chat.completions.create(**request), timeout=timeout
+                )
+                try:
+                    iterator = stream.__aiter__()
+                    while True:
+                        # 每个分片都有超时，上游中途卡住时不会无限等待
+                        try:
+                            chunk = await asyncio.wait_for(iterator.__anext__(), timeout=self.timeout)
+                        except StopAsyncIteration:
+                            break
+                        started = True
+                        yield chunk
+                finally:
+                    # 调用方提前退出（客户端断开）或分片超时时关闭上游响应，归还连接池中的连接
+                    await stream.close()
+            except Exception as e:
+                if not self._failed(e) or started or attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                await self._backoff(attempt, deadline)
+                continue
+            self.breaker.record_success()
+            return
+
+    def stats(self):
+        return {
+            "base_url": self.base_url,
+            "timeout_seconds": self.timeout,
+            "total_timeout_seconds": self.total_timeout or 0.0,
+            "max_retries": self.max_retries,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            **{f"breaker_{key}": value for key, value in self.breaker.stats().items()},
+        }
@@ -0,0 +1,131 @@
+"""Prometheus metrics and per-request stage timing for the backend.
+
+Request handlers wrap each step of the request path in ``stage(name)``.
+Every stage is observed in the ``plant_stage_seconds`` histogram, failures
+count toward ``plant_stage_errors_total``, and the durations of the current
+request are collected for the ``Server-Timing`` response header.
+
+With several uvicorn workers each process exports its own metrics unless
+``PROMETHEUS_MULTIPROC_DIR`` is set before start-up: then every worker
+writes its samples there and ``render_metrics`` aggregates all workers
+(prometheus_client's multiprocess mode). The ``/stats/*`` gauges live in
+each worker's memory, so in that mode they are exported for the worker
+that answered the scrape, labelled with its ``pid``.
+"""
+import contextvars
+import glob
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+
+# 多进程模式：必须在导入 prometheus_client 之前设置，各 worker 把样本写入该目录
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+# 覆盖从亚毫秒（缓存命中、解码）到数十秒（LLM）的范围
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "plant_stage_seconds", "Time spent in each stage of the request path", ["stage"], buckets=LATENCY_BUCKETS
+)
+STAGE_ERRORS = Counter("plant_stage_errors_total", "Errors raised per request stage", ["stage"])
+REQUEST_SECONDS = Histogram(
+    "plant_request_seconds", "End-to-end request latency", ["endpoint", "status"], buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge("plant_requests_in_flight", "Requests currently being processed", ["endpoint"],
+                           multiprocess_mode="livesum")
+INFERENCE_BATCH_SIZE = Histogram(
+    "plant_inference_batch_size", "Images per model call", buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+STARTUP_PHASE_SECONDS = Gauge("plant_startup_phase_seconds", "Duration of each startup phase", ["phase"],
+                              multiprocess_mode="liveall")
+
+# 当前请求的各阶段耗时（毫秒），由中间件为每个请求创建
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def record_stage(name, seconds):
+    """Observe a stage duration that was measured elsewhere (e.g. inside an executor)"""
+    STAGE_SECONDS.labels(name).observe(seconds)
+    timings = request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds * 1000.0
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as request stage ``name``"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+def server_timing_header(timings):
+    """Format stage timings as a Server-Timing header value"""
+    return ", ".join(f"{name};dur={duration:.2f}" for name, duration in timings.items())
+
+class StatsCollector:
+    """Export the numeric fields of the backend's ``stats()`` dicts as gauges.
+
+    ``sources`` maps a component name to a zero-argument callable returning a
+    dict; ``{"prediction_cache": cache.stats}`` becomes
+    ``plant_prediction_cache_hits`` and so on.
+    """
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    def collect(self):
+        labels = {"pid": str(os.getpid())} if MULTIPROC_DIR else {}
+        for component, stats in self.sources.items():
+            for key, value in stats().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                gauge = GaugeMetricFamily(f"plant_{component}_{key}", f"{component} {key}", labels=list(labels))
+                gauge.add_metric(list(labels.values()), value)
+                yield gauge
+
+_stats_collector = None
+
+def register_stats(sources):
+    """Export ``sources`` via /metrics, replacing any earlier registration.
+
+    The backend module can be imported twice in one process (a spawned worker
+    runs it as ``__mp_main__`` and uvicorn imports it again by name), so a
+    second call must not register the same metric names again.
+    """
+    global _stats_collector
+    if _stats_collector is not None:
+        REGISTRY.unregister(_stats_collector)
+    _stats_collector = StatsCollector(sources)
+    REGISTRY.register(_stats_collector)
+
+def render_metrics():
+    """(body, content_type) for the /metrics endpoint"""
+    if not MULTIPROC_DIR:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    # 每次抓取新建 registry，汇总所有 worker 写入的样本
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    if _stats_collector is not None:
+        registry.register(_stats_collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_worker_dead():
+    """Drop this worker's live gauges from the aggregate (call on shutdown)"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+def reset_multiprocess_dir():
+    """Remove samples left by a previous run, keeping this process's own files"""
+    if not MULTIPROC_DIR:
+        return
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, "*.db")):
+        if not path.endswith(f"_{os.getpid()}.db"):
+            os.remove(path)
@@ -1,31 +1,236 @@
-from fastapi import FastAPI, HTTPException, Body
+import time
+
+# 记录进程开始导入的时间，用于统计启动各阶段耗时
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Body, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-import tensorflow as tf
 import numpy as np
 import os
 import base64
+import json
+import asyncio
+import sys
+import argparse
+import threading
+import hashlib
+import hmac
+import csv
 import io
-from PIL import Image
+import itertools
+import re
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from typing import Dict, Any, List, Optional
-from openai import OpenAI
-import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.routing import Match
+
+from image_decode import (
+    ImageTooLargeError, MemoryBudgetError, TiledImage, decode_into, decode_stats, perceptual_hash,
+)
+from job_store import JobStore
+from llm_client import CircuitBreaker, CircuitOpenError, ResilientLLMClient
+from metrics import (
+    INFERENCE_BATCH_SIZE, REQUEST_SECONDS, REQUESTS_IN_FLIGHT, STARTUP_PHASE_SECONDS, mark_worker_dead,
+    record_stage, register_stats, render_metrics, request_timings, server_timing_header,
+    stage,
+)
 
 # -------------------------------
 # API Configuration
 # -------------------------------
-client = OpenAI(
-    base_url="http://39.105.194.16:6691/v1/",  # 设置自定义API地址
-    api_key="YOUR_API_KEY"  # 替换为您的API密钥
-)
+client = None
+
+def get_llm_client():
+    """Create the LLM client on first use so importing this module stays cheap"""
+    global client
+    if client is None:
+        # 异步客户端 + 连接池、超时、重试与熔断，避免上游变慢时拖住所有请求
+        client = ResilientLLMClient(
+            base_url=LLM_BASE_URL,  # 设置自定义API地址
+            api_key=LLM_API_KEY,  # 替换为您的API密钥
+            timeout=LLM_TIMEOUT,
+            max_retries=LLM_MAX_RETRIES,
+            backoff=LLM_RETRY_BACKOFF_MS / 1000.0,
+            max_connections=LLM_CONCURRENCY,
+            breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS),
+            total_timeout=LLM_TOTAL_TIMEOUT or REQUEST_TIMEOUT_SECONDS,
+        )
+    return client
+
+# -------------------------------------
+# Runtime Configuration
+# -------------------------------------
+def load_runtime_config(path):
+    """Use the values of a JSON config file (e.g. from autotune.py) as environment defaults"""
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            settings = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"无法读取运行时配置 {path}: {e}")
+        return
+    for key, value in settings.items():
+        # 以 "_" 开头的键是说明信息；已设置的环境变量优先
+        if not key.startswith("_"):
+            os.environ.setdefault(key, str(value))
+
+RUNTIME_CONFIG = os.getenv("RUNTIME_CONFIG", "runtime_config.json")
+load_runtime_config(RUNTIME_CONFIG)
+
+# LLM 服务地址；压测时可指向本地的 fake_llm.py
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "http://39.105.194.16:6691/v1/")
+LLM_API_KEY = os.getenv("LLM_API_KEY", "YOUR_API_KEY")
+LLM_MODEL = os.getenv("LLM_MODEL", "Qwen/Qwen3-8B")
+# 单次调用超时（秒）、失败重试次数与退避基数；连续失败 LLM_BREAKER_FAILURES 次后熔断
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF_MS = float(os.getenv("LLM_RETRY_BACKOFF_MS", "200"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+# 一次LLM调用（包括所有重试与退避）的总时限（秒），0 表示使用 REQUEST_TIMEOUT_SECONDS
+LLM_TOTAL_TIMEOUT = float(os.getenv("LLM_TOTAL_TIMEOUT", "0"))
+# /predict 最多等待病害信息的秒数，超时先返回分类结果（状态 pending），LLM调用在后台继续并写入缓存；0 表示不限制
+DISEASE_INFO_WAIT_SECONDS = float(os.getenv("DISEASE_INFO_WAIT_SECONDS", "15"))
+
+# 动态批处理：最多攒够 BATCH_MAX_SIZE 张图片，或等待 BATCH_MAX_WAIT_MS 毫秒后统一推理
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+# 病害信息缓存：按病害名称缓存LLM结果，持久化到本地文件
+DISEASE_INFO_CACHE_PATH = os.getenv("DISEASE_INFO_CACHE_PATH", "disease_info_cache.json")
+DISEASE_INFO_CACHE_TTL = float(os.getenv("DISEASE_INFO_CACHE_TTL", str(7 * 24 * 3600)))
+DISEASE_INFO_CACHE_MAX_ENTRIES = int(os.getenv("DISEASE_INFO_CACHE_MAX_ENTRIES", "256"))
+DISEASE_INFO_PREWARM = os.getenv("DISEASE_INFO_PREWARM", "0") == "1"
+
+# 并发控制：图片解码线程数、同时进行的推理批次数、同时进行的LLM调用数
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(os.cpu_count() or 1)))
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", "2"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+
+# 批量预测接口单次请求允许的最大图片数
+BATCH_REQUEST_MAX_IMAGES = int(os.getenv("BATCH_REQUEST_MAX_IMAGES", "64"))
+
+# 异步任务（/jobs）：SQLite 任务库路径（为空时关闭）、单个任务最多图片数、每次推理合并的图片数（跨任务）
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.sqlite3")
+JOB_MAX_IMAGES = int(os.getenv("JOB_MAX_IMAGES", "1000"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", str(BATCH_MAX_SIZE)))
+# 失败重试：最多尝试次数与退避基数（秒）；处理中的图片超过租约（秒）仍未完成（如进程退出）时重新领取
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "5"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# 空闲时轮询任务库的间隔（秒）；已完成任务保留的小时数
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "72"))
+
+# 推理运行时：keras（默认）或 tflite（需先用 convert.py 导出模型）
+INFERENCE_RUNTIME = os.getenv("INFERENCE_RUNTIME", "keras")
+MODEL_PATH = os.getenv("MODEL_PATH", "new_trained_plant_disease_model.keras")
+TFLITE_MODEL_PATH = os.getenv("TFLITE_MODEL_PATH", "plant_disease_model.tflite")
+# 模型仓库：每个版本一个子目录（模型文件 + classes.json），ACTIVE 文件记录当前版本；为空时使用上面的单个模型文件
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "")
+# 启动时加载的版本，为空时依次使用 ACTIVE 文件、仓库中最新的版本（单文件模式下仅作为版本名）
+MODEL_VERSION = os.getenv("MODEL_VERSION", "")
+# 轮询 ACTIVE 文件的间隔（秒），内容变化时后台加载新版本并切换；0 表示关闭
+MODEL_REGISTRY_POLL_SECONDS = float(os.getenv("MODEL_REGISTRY_POLL_SECONDS", "0"))
+# 影子模式：候选版本在抽样的批次上同时推理，只统计一致率与延迟，不影响返回结果
+MODEL_SHADOW_VERSION = os.getenv("MODEL_SHADOW_VERSION", "")
+MODEL_SHADOW_RATE = float(os.getenv("MODEL_SHADOW_RATE", "0.1"))
+# 管理接口（/admin/*）的令牌，通过 X-Admin-Token 头传入；为空时只允许本机访问
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# CPU 推理调优：TensorFlow 线程池大小（0 为默认）、XLA 编译、进程绑定的 CPU（如 "0-3,8"）
+TF_INTRA_OP_THREADS = int(os.getenv("TF_INTRA_OP_THREADS", "0"))
+TF_INTER_OP_THREADS = int(os.getenv("TF_INTER_OP_THREADS", "0"))
+TF_XLA_JIT = os.getenv("TF_XLA_JIT", "0") == "1"
+CPU_AFFINITY = os.getenv("CPU_AFFINITY", "")
+# oneDNN 开关使用 TensorFlow 自带的 TF_ENABLE_ONEDNN_OPTS 环境变量，在导入 TensorFlow 前读取
+TFLITE_NUM_THREADS = int(os.getenv("TFLITE_NUM_THREADS", str(TF_INTRA_OP_THREADS))) or None
+
+# 级联推理：设置 CASCADE_MODEL_PATH 后先用小模型识别，top-1 置信度低于 CASCADE_THRESHOLD 时再交给完整模型
+CASCADE_MODEL_PATH = os.getenv("CASCADE_MODEL_PATH", "")
+CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD", "0.9"))
+# 小模型已足够自信的样本中，按此比例抽样同时跑完整模型，统计两者不一致率
+CASCADE_SHADOW_RATE = float(os.getenv("CASCADE_SHADOW_RATE", "0.05"))
+
+# 准入控制：同时处理的请求数与排队上限，超出返回 429；请求超时（秒，可被 X-Request-Timeout 头覆盖），0 表示不限制
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "30"))
+# 按客户端限流（每秒请求数，令牌桶），0 表示关闭
+RATE_LIMIT_PER_CLIENT = float(os.getenv("RATE_LIMIT_PER_CLIENT", "0"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "10"))
+
+# 摄像头流（/ws/stream）：同时打开的会话数上限；相邻帧 32x32 灰度缩略图的平均像素差（0-255）低于该值时跳过推理，0 表示不去重
+STREAM_MAX_SESSIONS = int(os.getenv("STREAM_MAX_SESSIONS", "16"))
+STREAM_DEDUP_THRESHOLD = float(os.getenv("STREAM_DEDUP_THRESHOLD", "3"))
+
+# 分块高分辨率识别（/predict/tiled）：短边切成几块、相邻瓦片的重叠比例、单张图片的瓦片数上限、每次模型调用的瓦片数
+TILED_TILES_PER_SIDE = int(os.getenv("TILED_TILES_PER_SIDE", "3"))
+TILED_OVERLAP = float(os.getenv("TILED_OVERLAP", "0.25"))
+TILED_MAX_TILES = int(os.getenv("TILED_MAX_TILES", "64"))
+TILED_BATCH_SIZE = int(os.getenv("TILED_BATCH_SIZE", str(BATCH_MAX_SIZE)))
+# 单张图片的内存预算（MB）：缩小后的 uint8 工作副本加两个瓦片批次，超出时进一步缩小工作副本
+TILED_MEMORY_BUDGET_MB = float(os.getenv("TILED_MEMORY_BUDGET_MB", "64"))
+# 任一瓦片上某种病害的概率达到该值时整图判为该病害，否则按所有瓦片的平均概率判定
+TILED_DISEASE_THRESHOLD = float(os.getenv("TILED_DISEASE_THRESHOLD", "0.5"))
+
+# 多进程部署：worker 数量、优雅退出与模型加载超时由 serve_backend.py 读取（WORKERS / GRACEFUL_TIMEOUT / MODEL_LOAD_TIMEOUT）
+# 为 1 时 startup 等待模型加载预热完成后才开始接收请求（多 worker 滚动重启时使用）
+WAIT_FOR_MODEL_ON_STARTUP = os.getenv("WAIT_FOR_MODEL_ON_STARTUP", "0") == "1"
+
+# 启动预热：模型加载后用这些批大小各跑一次空输入，提前完成图追踪
+WARMUP_BATCH_SIZES = sorted({int(size) for size in os.getenv("WARMUP_BATCH_SIZES", f"1,{BATCH_MAX_SIZE}").split(",") if size.strip()})
+
+# 预测结果缓存：off / exact（按上传内容哈希）/ perceptual（按感知哈希，识别重新编码的近似图片）
+PREDICTION_CACHE_MODE = os.getenv("PREDICTION_CACHE_MODE", "exact")
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "4096"))
+# perceptual 模式下允许的最大汉明距离，0 表示只匹配哈希完全相同的图片
+PREDICTION_CACHE_MAX_DISTANCE = int(os.getenv("PREDICTION_CACHE_MAX_DISTANCE", "0"))
+
+# 解码保护：单张图片的最大字节数与最大像素数，防止解压炸弹
+DECODE_MAX_BYTES = int(os.getenv("DECODE_MAX_BYTES", str(20 * 1024 * 1024)))
+DECODE_MAX_PIXELS = int(os.getenv("DECODE_MAX_PIXELS", "50000000"))
 
 # -------------------------------------
 # FastAPI Application Setup
 # -------------------------------------
+@asynccontextmanager
+async def lifespan(app):
+    """Start background work in a fixed order and tear it down in reverse"""
+    # 模型在后台加载，服务先启动以便 /healthz 立即可用
+    app.state.model_loading = asyncio.get_running_loop().run_in_executor(None, load_and_warm_model)
+    if WAIT_FOR_MODEL_ON_STARTUP:
+        # 多 worker 模式下，新 worker 预热完成后才算就绪，旧 worker 才会被替换
+        await app.state.model_loading
+    batch_scheduler.start()
+    background = []
+    if model_registry.root and MODEL_REGISTRY_POLL_SECONDS > 0:
+        background.append(asyncio.create_task(watch_model_registry()))
+    if DISEASE_INFO_PREWARM:
+        # 后台预热，不阻塞服务启动
+        background.append(asyncio.create_task(prewarm_disease_info()))
+    # 重启后继续处理任务库中未完成的任务
+    if get_job_store() is not None:
+        job_runner.start()
+    try:
+        yield
+    finally:
+        # 先停止产生推理的后台任务，再停止批处理调度器
+        await job_runner.stop()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        await batch_scheduler.stop()
+        mark_worker_dead()
+
 app = FastAPI(
     title="Plant Disease Recognition API",
     description="Backend API for the Plant Disease Recognition System",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware to allow requests from the frontend
@@ -35,8 +240,41 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+def endpoint_label(request):
+    """Route path template for metric labels (keeps label cardinality bounded)"""
+    for route in request.app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Per-request latency, in-flight gauge and the Server-Timing breakdown"""
+    endpoint = endpoint_label(request)
+    timings = {}
+    token = request_timings.set(timings)
+    in_flight = REQUESTS_IN_FLIGHT.labels(endpoint)
+    in_flight.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        in_flight.dec()
+        REQUEST_SECONDS.labels(endpoint, str(status)).observe(elapsed)
+        request_timings.reset(token)
+
+    # 各阶段耗时（毫秒）通过 Server-Timing 返回，浏览器开发者工具可直接查看
+    timings["total"] = elapsed * 1000.0
+    response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
 # -------------------------------------
 # Data Models
 # -------------------------------------
@@ -52,17 +290,614 @@ class PredictionResponse(BaseModel):
     treatment: Optional[str] = None
     prevention: Optional[str] = None
     videos: Optional[str] = None
+    # ok / pending（仍在生成，稍后重试可从缓存取得）/ unavailable（LLM不可用）；健康叶片无此字段
+    disease_info_status: Optional[str] = None
+    # 给出该结果的模型版本
+    model_version: Optional[str] = None
+
+class BatchImageRequest(BaseModel):
+    images: List[ImageRequest]
+
+class BatchPredictionItem(PredictionResponse):
+    filename: Optional[str] = None
+    disease_name: Optional[str] = None
+    confidence: Optional[float] = None
+    error: Optional[str] = None
+
+class BatchPredictionResponse(BaseModel):
+    results: List[BatchPredictionItem]
+
+class TilePrediction(BaseModel):
+    row: int
+    col: int
+    box: List[int]  # 原图坐标 [left, top, right, bottom]
+    disease_name: str
+    confidence: float
+
+class TiledPredictionResponse(PredictionResponse):
+    image_size: List[int]
+    tile_pixels: int
+    rows: int
+    cols: int
+    tiles: List[TilePrediction]
+    # 每个瓦片上整图结果类别的置信度，rows x cols
+    heatmap: List[List[float]]
+    # decode、每个批次的 tile_ms / inference_ms 与 total（毫秒）
+    timings_ms: Dict[str, Any]
 
 # -------------------------------------
-# Model Loading
+# Inference Runtime
 # -------------------------------------
-model = None
+def parse_cpu_list(spec):
+    """CPU ids from a list such as "0-3,8" """
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+def apply_cpu_affinity(spec=CPU_AFFINITY):
+    """Pin this process to the CPUs in ``spec``; threads started afterwards inherit it"""
+    if not spec:
+        return
+    if not hasattr(os, "sched_setaffinity"):
+        print("当前平台不支持 CPU_AFFINITY，已忽略")
+        return
+    os.sched_setaffinity(0, parse_cpu_list(spec))
+    print(f"已绑定 CPU: {sorted(os.sched_getaffinity(0))}")
+
+def configure_tensorflow(tf):
+    """Apply thread-pool settings; only effective before TensorFlow runs its first op"""
+    try:
+        if TF_INTRA_OP_THREADS:
+            tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+        if TF_INTER_OP_THREADS:
+            tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+    except RuntimeError as e:
+        print(f"TensorFlow 已初始化，线程池设置未生效: {e}")
+
+def runtime_settings():
+    """Effective CPU runtime settings, reported by /model and autotune.py"""
+    return {
+        "intra_op_threads": TF_INTRA_OP_THREADS,
+        "inter_op_threads": TF_INTER_OP_THREADS,
+        "tflite_num_threads": TFLITE_NUM_THREADS,
+        "xla_jit": TF_XLA_JIT,
+        "onednn_opts": os.getenv("TF_ENABLE_ONEDNN_OPTS"),
+        "cpu_affinity": sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None,
+        "batch_max_size": BATCH_MAX_SIZE,
+        "inference_concurrency": INFERENCE_CONCURRENCY,
+    }
+
+class KerasRuntime:
+    """Full Keras model; ``predict`` returns class probabilities for a batch"""
+
+    name = "keras"
+
+    def __init__(self, path=MODEL_PATH):
+        import tensorflow as tf
+
+        configure_tensorflow(tf)
+        self.path = path
+        self.model = tf.keras.models.load_model(path)
+        self.input_size = tuple(self.model.input_shape[1:3])
+        # XLA 按输入形状编译，每个新的批大小首次调用时编译一次（启动预热覆盖 WARMUP_BATCH_SIZES）
+        self._forward = tf.function(self.model, jit_compile=True) if TF_XLA_JIT else self.model
+
+    def predict(self, batch_array):
+        # 直接调用模型，跳过 model.predict 每次调用的数据管道开销
+        return np.asarray(self._forward(batch_array, training=False))
+
+class TFLiteRuntime:
+    """TFLite interpreter (float32, float16 or int8 models from convert.py).
+
+    Interpreters are not thread-safe, so each inference thread gets its own,
+    resized on demand to the incoming batch size. The model file is opened
+    with ``model_path`` so TFLite memory-maps it: every interpreter, and every
+    worker process, shares the same page-cache copy of the weights.
+    """
+
+    name = "tflite"
+
+    def __init__(self, path=TFLITE_MODEL_PATH, num_threads=TFLITE_NUM_THREADS):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+        self.path = path
+        self.num_threads = num_threads
+        self._interpreter_class = Interpreter
+        self._local = threading.local()
+        # 在加载时就创建一个解释器，模型文件有问题时尽早失败
+        self.input_size = tuple(int(size) for size in self._interpreter().get_input_details()[0]["shape"][1:3])
+
+    def _interpreter(self):
+        interpreter = getattr(self._local, "interpreter", None)
+        if interpreter is None:
+            interpreter = self._interpreter_class(
+                model_path=self.path, num_threads=self.num_threads
+            )
+            interpreter.allocate_tensors()
+            self._local.interpreter = interpreter
+            self._local.batch_size = None
+        return interpreter
+
+    def predict(self, batch_array):
+        interpreter = self._interpreter()
+        input_detail = interpreter.get_input_details()[0]
+        if self._local.batch_size != len(batch_array):
+            interpreter.resize_tensor_input(input_detail["index"], batch_array.shape)
+            interpreter.allocate_tensors()
+            self._local.batch_size = len(batch_array)
+            input_detail = interpreter.get_input_details()[0]
+        output_detail = interpreter.get_output_details()[0]
+
+        # 全整型模型需要按量化参数转换输入输出
+        scale, zero_point = input_detail["quantization"]
+        if input_detail["dtype"] != np.float32 and scale:
+            batch_array = np.round(batch_array / scale + zero_point)
+        interpreter.set_tensor(input_detail["index"], batch_array.astype(input_detail["dtype"], copy=False))
+        interpreter.invoke()
+
+        predictions = interpreter.get_tensor(output_detail["index"])
+        scale, zero_point = output_detail["quantization"]
+        if output_detail["dtype"] != np.float32 and scale:
+            predictions = (predictions.astype(np.float32) - zero_point) * scale
+        return predictions
+
+INFERENCE_RUNTIMES = {
+    KerasRuntime.name: KerasRuntime,
+    TFLiteRuntime.name: TFLiteRuntime,
+}
+
+def create_runtime(name=INFERENCE_RUNTIME):
+    if name not in INFERENCE_RUNTIMES:
+        raise ValueError(f"Unknown inference runtime '{name}', expected one of {sorted(INFERENCE_RUNTIMES)}")
+    return INFERENCE_RUNTIMES[name]()
+
+def runtime_for_path(path):
+    """Runtime for a model file, chosen by extension (.tflite or Keras)"""
+    if path.endswith(".tflite"):
+        return TFLiteRuntime(path)
+    return KerasRuntime(path)
+
+def resize_batch(batch_array, size):
+    """Resize a (N, H, W, 3) batch to ``size``; block-averages when H, W are multiples"""
+    height, width = batch_array.shape[1:3]
+    if (height, width) == size:
+        return batch_array
+    if height % size[0] == 0 and width % size[1] == 0:
+        factor_h, factor_w = height // size[0], width // size[1]
+        return batch_array.reshape(len(batch_array), size[0], factor_h, size[1], factor_w, 3).mean(axis=(2, 4))
+    import tensorflow as tf
+
+    return tf.image.resize(batch_array, size).numpy()
+
+class CascadeRuntime:
+    """Two-stage cascade: a small model answers, the full model handles low-confidence rows.
+
+    Rows whose small-model top-1 probability is below ``threshold`` are
+    re-run on the full model and take its prediction. A random
+    ``shadow_rate`` fraction of the confident rows is also run on the full
+    model, only to measure how often the two disagree.
+    """
+
+    name = "cascade"
+
+    def __init__(self, small, full, threshold=CASCADE_THRESHOLD, shadow_rate=CASCADE_SHADOW_RATE):
+        self.small = small
+        self.full = full
+        self.threshold = threshold
+        self.shadow_rate = shadow_rate
+        self.path = f"{small.path} -> {full.path}"
+        self.input_size = full.input_size
+        self.stages = (small, full)
+        self._lock = threading.Lock()
+        self.items = 0
+        self.escalated = 0
+        self.escalation_changed = 0
+        self.shadowed = 0
+        self.shadow_disagreements = 0
+        self.small_seconds = 0.0
+        self.small_calls = 0
+        self.full_seconds = 0.0
+        self.full_calls = 0
+
+    def predict(self, batch_array):
+        started = time.perf_counter()
+        predictions = np.array(self.small.predict(resize_batch(batch_array, self.small.input_size)), dtype=np.float32)
+        small_seconds = time.perf_counter() - started
+        record_stage("cascade_small", small_seconds)
+
+        small_top1 = np.argmax(predictions, axis=1)
+        escalate = predictions[np.arange(len(predictions)), small_top1] < self.threshold
+        shadow = ~escalate & (np.random.random(len(predictions)) < self.shadow_rate)
+        rows = np.flatnonzero(escalate | shadow)
+
+        full_seconds = None
+        changed = disagreements = 0
+        if len(rows):
+            started = time.perf_counter()
+            full_predictions = np.asarray(self.full.predict(batch_array[rows]))
+            full_seconds = time.perf_counter() - started
+            record_stage("cascade_full", full_seconds)
+
+            differs = np.argmax(full_predictions, axis=1) != small_top1[rows]
+            escalated_rows = escalate[rows]
+            # 只有低置信度的行采用完整模型结果，影子样本仅用于统计
+            predictions[rows[escalated_rows]] = full_predictions[escalated_rows]
+            changed = int(np.sum(differs & escalated_rows))
+            disagreements = int(np.sum(differs & ~escalated_rows))
+
+        with self._lock:
+            self.items += len(predictions)
+            self.escalated += int(np.sum(escalate))
+            self.escalation_changed += changed
+            self.shadowed += int(np.sum(shadow))
+            self.shadow_disagreements += disagreements
+            self.small_seconds += small_seconds
+            self.small_calls += 1
+            if full_seconds is not None:
+                self.full_seconds += full_seconds
+                self.full_calls += 1
+        return predictions
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": True,
+                "threshold": self.threshold,
+                "shadow_rate": self.shadow_rate,
+                "items": self.items,
+                "escalated": self.escalated,
+                "escalation_rate": self.escalated / self.items if self.items else 0.0,
+                # 升级后完整模型改变了 top-1 的比例
+                "escalation_changed_rate": self.escalation_changed / self.escalated if self.escalated else 0.0,
+                "shadowed": self.shadowed,
+                "shadow_disagreement_rate": self.shadow_disagreements / self.shadowed if self.shadowed else 0.0,
+                "small_mean_ms": self.small_seconds / self.small_calls * 1000.0 if self.small_calls else 0.0,
+                "full_mean_ms": self.full_seconds / self.full_calls * 1000.0 if self.full_calls else 0.0,
+            }
+
+# -------------------------------------
+# Model Registry
+# -------------------------------------
+MODEL_FILE_SUFFIXES = (".keras", ".h5", ".tflite")
+
+class ModelLoadInProgressError(RuntimeError):
+    """Raised when another model version is still loading"""
+
+def version_sort_key(version):
+    """Natural sort key, so that v10 sorts after v9"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", version)]
+
+class ModelVersion:
+    """A loaded model version: its runtime and the class list its outputs index into"""
+
+    _generations = itertools.count(1)
+
+    def __init__(self, version, runtime, class_names):
+        self.version = version
+        self.runtime = runtime
+        self.class_names = list(class_names)
+        # 每次加载唯一；同名版本重新加载后，旧的预测缓存不会再命中
+        self.generation = next(self._generations)
+        self.loaded_at = time.time()
+
+    def info(self):
+        return {
+            "version": self.version,
+            "runtime": self.runtime.name,
+            "path": self.runtime.path,
+            "classes": len(self.class_names),
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.loaded_at)),
+        }
+
+class ModelRegistry:
+    """Versioned models on disk and the version currently serving.
+
+    With ``root`` set, each subdirectory is a version holding one model file
+    (``.keras``/``.h5``/``.tflite``) and optionally ``classes.json`` with its
+    class list, and the ``ACTIVE`` file names the version to serve. Without
+    it there is one unversioned model from MODEL_PATH / TFLITE_MODEL_PATH.
+
+    ``activate`` loads and warms the new version in the calling thread and
+    only then replaces ``active``. The swap is a single reference assignment:
+    batches already running keep the runtime they started with, and the old
+    version is freed once they finish.
+    """
+
+    ACTIVE_FILE = "ACTIVE"
+
+    def __init__(self, root=MODEL_REGISTRY_DIR):
+        self.root = root
+        self.active = None
+        self.shadow = None
+        self._initial_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.loading = None
+        self.last_error = None
+        self.swaps = 0
+        self.failed_loads = 0
+
+    def versions(self):
+        if not self.root:
+            return []
+        return sorted(
+            (name for name in os.listdir(self.root)
+             if not name.startswith(".") and os.path.isdir(os.path.join(self.root, name))),
+            key=version_sort_key,
+        )
+
+    def active_file(self):
+        return os.path.join(self.root, self.ACTIVE_FILE)
+
+    def read_active_file(self):
+        try:
+            with open(self.active_file(), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def write_active_file(self, version):
+        # 先写临时文件再原子替换，轮询的 worker 不会读到半个文件
+        temp_path = self.active_file() + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(version + "\n")
+        os.replace(temp_path, self.active_file())
+
+    def initial_version(self):
+        if not self.root:
+            return MODEL_VERSION or "default"
+        version = MODEL_VERSION or self.read_active_file()
+        if version:
+            return version
+        versions = self.versions()
+        if not versions:
+            raise FileNotFoundError(f"No model versions in {self.root}")
+        return versions[-1]
+
+    def model_file(self, version):
+        directory = os.path.join(self.root, version)
+        if not os.path.isdir(directory):
+            raise FileNotFoundError(f"Unknown model version '{version}'")
+        files = sorted(name for name in os.listdir(directory) if name.endswith(MODEL_FILE_SUFFIXES))
+        if not files:
+            raise FileNotFoundError(f"No model file in {directory}")
+        # 同一版本同时提供 Keras 和 TFLite 文件时，按 INFERENCE_RUNTIME 选择
+        preferred = [name for name in files if name.endswith(".tflite") == (INFERENCE_RUNTIME == "tflite")]
+        return os.path.join(directory, (preferred or files)[0])
+
+    def class_names_for(self, version):
+        path = os.path.join(self.root, version, "classes.json")
+        if not os.path.exists(path):
+            return class_names
+        with open(path, encoding="utf-8") as f:
+            names = json.load(f)
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise ValueError(f"{path} must be a JSON list of class names")
+        return names
+
+    def load(self, version):
+        """Build a ModelVersion without warming it up"""
+        if self.root:
+            runtime = runtime_for_path(self.model_file(version))
+            names = self.class_names_for(version)
+        else:
+            # 单文件模式：重新读取 MODEL_PATH / TFLITE_MODEL_PATH（文件被替换后即为新模型）
+            runtime = create_runtime()
+            names = class_names
+        if CASCADE_MODEL_PATH:
+            runtime = CascadeRuntime(runtime_for_path(CASCADE_MODEL_PATH), runtime)
+        return ModelVersion(version, runtime, names)
+
+    def ensure_loaded(self):
+        """The active version, loading the initial one on first use"""
+        if self.active is None:
+            with self._initial_lock:
+                if self.active is None:
+                    started = time.perf_counter()
+                    model_version = self.load(self.initial_version())
+                    record_startup_phase("model_load", time.perf_counter() - started)
+                    print(f"模型已加载：version={model_version.version} runtime={model_version.runtime.name} "
+                          f"path={model_version.runtime.path}")
+                    self.active = model_version
+        return self.active
+
+    def _load_and_warm(self, version):
+        if not self._load_lock.acquire(blocking=False):
+            raise ModelLoadInProgressError(f"Model version '{self.loading}' is still loading")
+        self.loading = version
+        try:
+            started = time.perf_counter()
+            model_version = self.load(version)
+            warm_up_model(model_version.runtime, num_classes=len(model_version.class_names))
+            print(f"模型版本 {version} 已加载并预热，耗时 {time.perf_counter() - started:.1f}s")
+            return model_version
+        except Exception as e:
+            self.failed_loads += 1
+            self.last_error = f"{version}: {e}"
+            raise
+        finally:
+            self.loading = None
+            self._load_lock.release()
+
+    def activate(self, version, persist=False):
+        """Load and warm ``version`` in this thread, then switch traffic to it"""
+        shadow = self.shadow
+        if shadow is not None and shadow.candidate.version == version:
+            # 影子版本已经加载预热，直接提升
+            model_version, self.shadow = shadow.candidate, None
+        else:
+            model_version = self._load_and_warm(version)
+        previous, self.active = self.active, model_version
+        self.swaps += 1
+        self.last_error = None
+        if persist and self.root:
+            self.write_active_file(version)
+        print(f"模型版本切换：{previous.version if previous else None} -> {version}")
+        return model_version
+
+    def start_shadow(self, version, rate=MODEL_SHADOW_RATE):
+        """Load and warm ``version`` as the shadow candidate"""
+        self.shadow = ShadowComparison(self._load_and_warm(version), rate)
+        print(f"影子模式：候选版本 {version}，抽样比例 {rate}")
+
+    def stop_shadow(self):
+        self.shadow = None
+
+    def stats(self):
+        active, shadow = self.active, self.shadow
+        return {
+            "registry_dir": self.root or None,
+            "active_version": active.version if active else None,
+            "shadow_version": shadow.candidate.version if shadow else None,
+            "loading_version": self.loading,
+            "swaps": self.swaps,
+            "failed_loads": self.failed_loads,
+            "last_error": self.last_error,
+        }
+
+class ShadowComparison:
+    """Run a candidate version on a sample of live batches and compare it with the active one.
+
+    A sampled batch is re-run on the candidate on the shadow thread after the
+    active result has been handed back, so callers never wait for it; while
+    one comparison is running further samples are skipped. Predictions are
+    compared by class name, so the candidate may use a different class list.
+    """
+
+    def __init__(self, candidate, rate=MODEL_SHADOW_RATE):
+        self.candidate = candidate
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._busy = False
+        self.batches = 0
+        self.items = 0
+        self.agreements = 0
+        self.skipped = 0
+        self.errors = 0
+        self.active_seconds = 0.0
+        self.candidate_seconds = 0.0
+        self.disagreements = Counter()
+
+    def sample(self, batch_array, active_results, active_seconds):
+        """Maybe compare the candidate on a batch the active version just answered"""
+        if np.random.random() >= self.rate:
+            return
+        with self._lock:
+            if self._busy:
+                self.skipped += 1
+                return
+            self._busy = True
+        shadow_executor.submit(self._compare, batch_array, active_results, active_seconds)
+
+    def _compare(self, batch_array, active_results, active_seconds):
+        try:
+            started = time.perf_counter()
+            candidate_results = predict_batch(batch_array, self.candidate)
+            candidate_seconds = time.perf_counter() - started
+        except Exception as e:
+            print(f"影子模型推理失败: {e}")
+            with self._lock:
+                self.errors += 1
+                self._busy = False
+            return
+        with self._lock:
+            self._busy = False
+            self.batches += 1
+            self.items += len(active_results)
+            self.active_seconds += active_seconds
+            self.candidate_seconds += candidate_seconds
+            for (active_name, _, _), (predicted_index, _) in zip(active_results, candidate_results):
+                candidate_name = self.candidate.class_names[predicted_index]
+                if candidate_name == active_name:
+                    self.agreements += 1
+                else:
+                    self.disagreements[(active_name, candidate_name)] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": True,
+                "version": self.candidate.version,
+                "rate": self.rate,
+                "batches": self.batches,
+                "items": self.items,
+                "agreement_rate": self.agreements / self.items if self.items else 0.0,
+                "skipped_busy": self.skipped,
+                "errors": self.errors,
+                "active_mean_ms": self.active_seconds / self.batches * 1000.0 if self.batches else 0.0,
+                "candidate_mean_ms": self.candidate_seconds / self.batches * 1000.0 if self.batches else 0.0,
+                "top_disagreements": [
+                    {"active": active_name, "candidate": candidate_name, "count": count}
+                    for (active_name, candidate_name), count in self.disagreements.most_common(10)
+                ],
+            }
+
+model_registry = ModelRegistry()
+
+def load_model_version():
+    """The active ModelVersion, loading the initial version on first use"""
+    return model_registry.ensure_loaded()
 
 def load_model():
-    global model
-    if model is None:
-        model = tf.keras.models.load_model("new_trained_plant_disease_model.keras")
-    return model
+    """Runtime of the active model version"""
+    return load_model_version().runtime
+
+# -------------------------------------
+# Startup & Readiness
+# -------------------------------------
+startup_phases = {}
+model_ready = threading.Event()
+model_load_error = None
+
+def record_startup_phase(name, seconds):
+    startup_phases[name] = round(seconds * 1000.0, 1)
+    STARTUP_PHASE_SECONDS.labels(name).set(seconds)
+    print(f"启动阶段 {name}: {seconds * 1000.0:.1f} ms")
+
+def warm_up_model(runtime, batch_sizes=WARMUP_BATCH_SIZES, num_classes=None):
+    """Run dummy batches so the first real request does not pay tracing cost.
+
+    With ``num_classes`` also checks that the outputs match the class list.
+    """
+    # 级联模式下两个模型分别预热，不计入路由统计
+    for stage_runtime in getattr(runtime, "stages", (runtime,)):
+        for batch_size in batch_sizes:
+            outputs = np.asarray(stage_runtime.predict(
+                np.zeros((batch_size, *stage_runtime.input_size, 3), dtype=np.float32)
+            ))
+            if num_classes is not None and outputs.shape[-1] != num_classes:
+                raise ValueError(f"{stage_runtime.path} outputs {outputs.shape[-1]} classes, "
+                                 f"but the class list has {num_classes}")
+
+def load_and_warm_model():
+    """Background startup task: load the model, warm it up, then mark ready"""
+    global model_load_error
+    started = time.perf_counter()
+    try:
+        model_version = load_model_version()
+        warm_started = time.perf_counter()
+        warm_up_model(model_version.runtime, num_classes=len(model_version.class_names))
+        record_startup_phase("warmup", time.perf_counter() - warm_started)
+    except Exception as e:
+        model_load_error = str(e)
+        print(f"模型加载失败: {e}")
+        return
+    record_startup_phase("model_ready_total", time.perf_counter() - started)
+    model_ready.set()
+    if MODEL_SHADOW_VERSION:
+        try:
+            model_registry.start_shadow(MODEL_SHADOW_VERSION)
+        except Exception as e:
+            print(f"影子版本加载失败: {e}")
 
 # -------------------------------------
 # Disease Classes
@@ -84,48 +919,511 @@ class_names = [
     'Tomato___Tomato_Yellow_Leaf_Curl_Virus', 'Tomato___Tomato_mosaic_virus', 'Tomato___healthy'
 ]
 
+# -------------------------------------
+# Executors
+# -------------------------------------
+# 在创建任何工作线程之前绑定 CPU，之后的线程（包括 TensorFlow 线程池）继承该设置
+apply_cpu_affinity()
+
+# CPU密集型工作（解码、缩放、推理）放到有界线程池中执行，事件循环只负责调度
+preprocess_executor = ThreadPoolExecutor(
+    max_workers=max(1, PREPROCESS_WORKERS), thread_name_prefix="preprocess"
+)
+inference_executor = ThreadPoolExecutor(
+    max_workers=max(1, INFERENCE_CONCURRENCY), thread_name_prefix="inference"
+)
+# 影子模式的候选模型推理单独一个线程，不占用在线推理的槽位
+shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+
+async def run_in_executor(executor, func, *args):
+    """Run a blocking function on ``executor`` without blocking the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
 # -------------------------------------
 # Image Processing and Prediction
 # -------------------------------------
-def preprocess_image(image_data):
-    """Process base64 encoded image for model prediction"""
+def preprocess_image_bytes(image_bytes, timings=None):
+    """Process raw image bytes (bytes or memoryview) for model prediction"""
+    # 预分配带批次维度的输出，解码结果直接写入 (统一为RGB三通道，保证批量推理时形状一致)
+    image_array = np.empty((1, 128, 128, 3), dtype=np.float32)
     try:
-        # Decode base64 image
-        decoded_image = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(decoded_image))
-        
-        # Resize and normalize
-        image = image.resize((128, 128))
-        image_array = tf.keras.preprocessing.image.img_to_array(image)
-        image_array = np.expand_dims(image_array, axis=0)  # Add batch dimension
-        
+        decode_into(image_bytes, image_array[0], max_bytes=DECODE_MAX_BYTES, max_pixels=DECODE_MAX_PIXELS,
+                    timings=timings)
         return image_array
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=f"Image too large: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Image processing error: {str(e)}")
+
+def decode_base64_image(image_data):
+    """Decode the base64 payload of an ImageRequest into raw image bytes"""
+    # 解码前先按base64长度估算原始大小
+    if DECODE_MAX_BYTES and len(image_data) * 3 // 4 > DECODE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image too large: limit is {DECODE_MAX_BYTES} bytes")
+    try:
+        # Decode base64 image
+        return base64.b64decode(image_data)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Image processing error: {str(e)}")
 
+def preprocess_image(image_data):
+    """Process base64 encoded image for model prediction"""
+    return preprocess_image_bytes(decode_base64_image(image_data))
+
+def predict_batch(batch_array, model_version=None):
+    """Run one forward pass over a stacked batch, returning (index, confidence) per row"""
+    model_version = model_version or load_model_version()
+    predictions = model_version.runtime.predict(batch_array)
+    predicted_indices = np.argmax(predictions, axis=1)
+    return [
+        (int(index), float(predictions[row][index] * 100))
+        for row, index in enumerate(predicted_indices)
+    ]
+
+def classify_batch(batch_array):
+    """Classify a stacked batch on the active version: ``(disease_name, confidence, model_version)`` per row.
+
+    The active version is read once, so a concurrent swap can never pair one
+    version's outputs with another version's class list.
+    """
+    model_version = load_model_version()
+    started = time.perf_counter()
+    results = [
+        (model_version.class_names[predicted_index], confidence, model_version)
+        for predicted_index, confidence in predict_batch(batch_array, model_version)
+    ]
+    shadow = model_registry.shadow
+    if shadow is not None:
+        shadow.sample(batch_array, results, time.perf_counter() - started)
+    return results
+
 def predict_disease(image_array):
     """Make prediction using the model"""
     try:
-        model = load_model()
-        predictions = model.predict(image_array)
-        predicted_index = np.argmax(predictions, axis=1)[0]
-        confidence = float(predictions[0][predicted_index] * 100)
-        
-        return predicted_index, confidence
+        return predict_batch(image_array)[0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
+# -------------------------------------
+# Dynamic Micro-Batching
+# -------------------------------------
+class BatchScheduler:
+    """Coalesce concurrent single-image predictions into one model call.
+
+    Callers await ``submit`` with a ``(1, H, W, C)`` array. A background task
+    collects pending requests until ``max_batch_size`` is reached or the oldest
+    request has waited ``max_wait_ms``, then runs ``classify_batch`` once and
+    resolves every caller with its own ``(disease_name, confidence, model_version)``.
+    """
+
+    def __init__(self, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                 concurrency=INFERENCE_CONCURRENCY):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.concurrency = max(1, concurrency)
+        self._queue = None
+        self._task = None
+        self._slots = None
+        self._running = set()
+        # 统计信息：批大小分布与排队等待时间
+        self.batch_size_counts = {}
+        self.batches = 0
+        self.items = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, image_array):
+        """Queue one preprocessed image and wait for its prediction"""
+        if self._task is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image_array, future, time.perf_counter()))
+        result, queue_wait, inference_seconds = await future
+        # 在调用方的请求上下文中记录，便于出现在 Server-Timing 中
+        record_stage("queue", queue_wait)
+        record_stage("inference", inference_seconds)
+        return result
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # 不再等待，但把已经排队的请求一并带上
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            # 所有推理槽位都忙时不再取新批次，排队请求会自然攒成更大的批
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            batch = [item for item in batch if not item[1].cancelled()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            task = asyncio.get_running_loop().create_task(self._execute(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, batch):
+        try:
+            started = time.perf_counter()
+            waits = [started - enqueued for _, _, enqueued in batch]
+            self._record(len(batch), waits)
+
+            try:
+                stacked = np.concatenate([image_array for image_array, _, _ in batch], axis=0)
+                results = await run_in_executor(inference_executor, classify_batch, stacked)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            inference_seconds = time.perf_counter() - started
+
+            for (_, future, _), result, wait in zip(batch, results, waits):
+                if not future.done():
+                    future.set_result((result, wait, inference_seconds))
+        finally:
+            self._slots.release()
+
+    def _record(self, size, waits):
+        self.batches += 1
+        self.items += size
+        self.batch_size_counts[size] = self.batch_size_counts.get(size, 0) + 1
+        INFERENCE_BATCH_SIZE.observe(size)
+        self.queue_wait_total += sum(waits)
+        self.queue_wait_max = max(self.queue_wait_max, max(waits))
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "concurrency": self.concurrency,
+            "running_batches": len(self._running),
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_wait_mean_ms": self.queue_wait_total / self.items * 1000.0 if self.items else 0.0,
+            "queue_wait_max_ms": self.queue_wait_max * 1000.0,
+        }
+
+batch_scheduler = BatchScheduler()
+
+# -------------------------------------
+# Admission Control
+# -------------------------------------
+class Admission:
+    """A held admission slot; ``release`` is idempotent"""
+
+    def __init__(self, controller, request, deadline):
+        self.controller = controller
+        self.request = request
+        self.deadline = deadline
+        self.started = time.monotonic()
+        self._released = False
+
+    def remaining(self):
+        """Seconds left before the request deadline, or None without one"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    async def check(self):
+        """Drop the request (via HTTPException) if its client left or its deadline passed"""
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            self.controller.shed("deadline")
+            raise HTTPException(status_code=504, detail="Request deadline exceeded")
+        if await self.request.is_disconnected():
+            self.controller.shed("disconnected")
+            # 499: 客户端已断开（nginx 约定），响应不会被接收
+            raise HTTPException(status_code=499, detail="Client disconnected")
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(time.monotonic() - self.started)
+
+class AdmissionController:
+    """Bounded admission in front of decode, inference and the LLM stage.
+
+    At most ``max_inflight`` requests run the expensive path at once and at
+    most ``max_queue`` wait for a slot; beyond that requests are rejected with
+    429 and a ``Retry-After`` estimated from recent service times. A request
+    is dropped when its deadline passes while queued, or when its client has
+    disconnected by the time it is admitted. An optional per-client token
+    bucket rate-limits individual callers.
+    """
+
+    SHED_REASONS = ("queue_full", "rate_limited", "deadline", "disconnected")
+
+    def __init__(self, max_inflight=ADMISSION_MAX_INFLIGHT, max_queue=ADMISSION_MAX_QUEUE,
+                 timeout=REQUEST_TIMEOUT_SECONDS, rate=RATE_LIMIT_PER_CLIENT, burst=RATE_LIMIT_BURST,
+                 max_clients=10000):
+        self.max_inflight = max(1, max_inflight)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_clients = max_clients
+        self._slots = None
+        self._buckets = OrderedDict()  # client -> (tokens, updated_at)
+        self.inflight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed_counts = dict.fromkeys(self.SHED_REASONS, 0)
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        # 最近请求处理耗时的指数移动平均，用于估算 Retry-After
+        self.service_time = 1.0
+
+    @staticmethod
+    def client_key(request):
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+        return request.client.host if request.client else "unknown"
+
+    def deadline_for(self, request):
+        timeout = self.timeout
+        header = request.headers.get("x-request-timeout")
+        if header:
+            try:
+                timeout = float(header)
+            except ValueError:
+                pass
+        return time.monotonic() + timeout if timeout > 0 else None
+
+    def shed(self, reason):
+        self.shed_counts[reason] += 1
+
+    def retry_after(self):
+        seconds = self.service_time * (self.waiting + 1) / self.max_inflight
+        return int(min(60, max(1, np.ceil(seconds))))
+
+    def _reject(self, reason, retry_after):
+        self.shed(reason)
+        raise HTTPException(status_code=429, detail=f"Server overloaded ({reason}), retry later",
+                            headers={"Retry-After": str(retry_after)})
+
+    def _take_token(self, client):
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(client, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated_at) * self.rate)
+        allowed = tokens >= 1.0
+        self._buckets[client] = (tokens - 1.0 if allowed else tokens, now)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return allowed
+
+    async def acquire(self, request):
+        """Wait for a slot; raises 429 / 504 / 499 instead of admitting"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_inflight)
+        if self.rate > 0 and not self._take_token(self.client_key(request)):
+            self._reject("rate_limited", int(np.ceil(1.0 / self.rate)))
+        # 在任何 await 之前同步计数：同一轮事件循环中的突发请求也不会超过上限
+        if self.inflight + self.waiting >= self.max_inflight + self.max_queue:
+            self._reject("queue_full", self.retry_after())
+        self.waiting += 1
+
+        deadline = self.deadline_for(request)
+        enqueued = time.monotonic()
+        try:
+            remaining = None if deadline is None else max(0.0, deadline - enqueued)
+            await asyncio.wait_for(self._slots.acquire(), remaining)
+        except asyncio.TimeoutError:
+            self.shed("deadline")
+            raise HTTPException(status_code=504, detail="Request deadline exceeded while queued")
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - enqueued
+        record_stage("admission", waited)
+        self.queue_wait_total += waited
+        self.queue_wait_max = max(self.queue_wait_max, waited)
+        self.inflight += 1
+        admission = Admission(self, request, deadline)
+        try:
+            # 排队期间客户端可能已经放弃，此时不再执行解码、推理和LLM
+            await admission.check()
+        except BaseException:
+            admission.release()
+            raise
+        self.admitted += 1
+        return admission
+
+    def _release(self, service_seconds):
+        self.inflight -= 1
+        self._slots.release()
+        self.service_time = 0.9 * self.service_time + 0.1 * service_seconds
+
+    @asynccontextmanager
+    async def admit(self, request):
+        admission = await self.acquire(request)
+        try:
+            yield admission
+        finally:
+            admission.release()
+
+    def stats(self):
+        return {
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "inflight": self.inflight,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            **{f"shed_{reason}": count for reason, count in self.shed_counts.items()},
+            "shed_total": sum(self.shed_counts.values()),
+            "queue_wait_mean_ms": self.queue_wait_total / self.admitted * 1000.0 if self.admitted else 0.0,
+            "queue_wait_max_ms": self.queue_wait_max * 1000.0,
+            "service_time_ewma_ms": self.service_time * 1000.0,
+            "rate_limit_per_client": self.rate,
+            "rate_limited_clients_tracked": len(self._buckets),
+        }
+
+admission_controller = AdmissionController()
+
+# -------------------------------------
+# Prediction Cache
+# -------------------------------------
+class PredictionCache:
+    """LRU cache of ``(disease_name, confidence, model_version)`` keyed by model and image content.
+
+    ``exact`` mode keys on a BLAKE2 digest of the uploaded bytes, so a hit
+    skips decoding entirely. ``perceptual`` mode keys on a 64-bit dHash that
+    only needs a tiny thumbnail decode, and also matches re-encoded or
+    resized copies of the same photo (optionally within ``max_distance``
+    bits). Entries are scoped to the model load (``ModelVersion.generation``)
+    that produced them, so a swapped-in version never serves the old
+    version's answers; those simply age out of the LRU.
+    """
+
+    MODES = ("off", "exact", "perceptual")
+
+    def __init__(self, mode=PREDICTION_CACHE_MODE, max_entries=PREDICTION_CACHE_SIZE,
+                 max_distance=PREDICTION_CACHE_MAX_DISTANCE):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown prediction cache mode '{mode}', expected one of {self.MODES}")
+        self.mode = mode
+        self.max_entries = max(1, max_entries)
+        self.max_distance = max(0, max_distance)
+        self._entries = OrderedDict()  # (generation, key) -> (disease_name, confidence, model_version)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def key_for(self, image_bytes):
+        """Cache key for an upload; may decode a thumbnail, so call it off the event loop"""
+        if self.mode == "perceptual":
+            return perceptual_hash(image_bytes, max_bytes=DECODE_MAX_BYTES, max_pixels=DECODE_MAX_PIXELS)
+        return hashlib.blake2b(image_bytes, digest_size=16).digest()
+
+    def _find(self, key):
+        if key in self._entries or self.mode != "perceptual" or not self.max_distance:
+            return key
+        # 近似匹配：线性扫描汉明距离，条目数有界，开销很小
+        generation, image_hash = key
+        for candidate in self._entries:
+            if candidate[0] == generation and (candidate[1] ^ image_hash).bit_count() <= self.max_distance:
+                return candidate
+        return key
+
+    def get(self, key, generation):
+        with self._lock:
+            key = self._find((generation, key))
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, generation, result):
+        with self._lock:
+            key = (generation, key)
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "mode": self.mode,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+prediction_cache = PredictionCache()
+
 # -------------------------------------
 # Disease Information from OpenAI
 # -------------------------------------
-def get_disease_info(disease_name):
-    """使用OpenAI获取详细的疾病信息"""
-    try:
-        # 清理疾病名称以获得更好的提示格式
-        cleaned_name = disease_name.replace('___', ' - ').replace('_', ' ')
-        
-        # 创建结构化提示
-        prompt = f"""
+def unavailable_disease_info(description="信息不可用。"):
+    """Placeholder sections used when the LLM cannot provide disease info"""
+    return {
+        "description": description,
+        "symptoms": "信息不可用。",
+        "treatment": "信息不可用。",
+        "prevention": "信息不可用。",
+        "videos": "没有可用的资源建议。"
+    }
+
+def build_disease_prompt(disease_name):
+    """Build the structured prompt sent to the LLM for one disease"""
+    # 清理疾病名称以获得更好的提示格式
+    cleaned_name = disease_name.replace('___', ' - ').replace('_', ' ')
+
+    # 创建结构化提示
+    return f"""
         提供关于植物疾病'{cleaned_name}'的详细信息，包含以下部分：
         
         1. 描述：该疾病的简要概述。
@@ -138,87 +1436,965 @@ def get_disease_info(disease_name):
         请为每个部分添加清晰的标题。
         """
 
-        # 使用新的API格式创建聊天完成
-        response = client.chat.completions.create(
-            model="Qwen/Qwen3-8B",
-            messages=[
-                {"role": "system", "content": "你是一个专业的植物病理学专家。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
-        
-        if not response or not response.choices:
+def parse_disease_info(content):
+    """Strip the <think> block and split the completion into sections"""
+    # 清理<think></think>标签及其内容
+    if "<think>" in content and "</think>" in content:
+        think_start = content.find("<think>")
+        think_end = content.find("</think>") + len("</think>")
+        content = content[:think_start] + content[think_end:]
+        content = content.strip()
+
+    # 提取各个部分（基本解析 - 可以用regex改进）
+    sections = unavailable_disease_info()
+
+    # 基本的部分提取 - 在实际应用中，建议使用regex进行更好的解析
+    if "描述" in content:
+        description_start = content.find("描述")
+        next_section = content.find("原因", description_start)
+        if next_section > 0:
+            sections["description"] = content[description_start:next_section].replace("描述：", "").strip()
+
+    if "症状" in content:
+        symptoms_start = content.find("症状")
+        next_section = content.find("治疗", symptoms_start)
+        if next_section > 0:
+            sections["symptoms"] = content[symptoms_start:next_section].replace("症状：", "").strip()
+
+    if "治疗" in content:
+        treatment_start = content.find("治疗")
+        next_section = content.find("预防", treatment_start)
+        if next_section > 0:
+            sections["treatment"] = content[treatment_start:next_section].replace("治疗：", "").strip()
+
+    if "预防" in content:
+        prevention_start = content.find("预防")
+        next_section = content.find("有用资源", prevention_start)
+        if next_section > 0:
+            sections["prevention"] = content[prevention_start:next_section].replace("预防：", "").strip()
+        else:
+            sections["prevention"] = content[prevention_start:].replace("预防：", "").strip()
+
+    if "有用资源" in content:
+        resources_start = content.find("有用资源")
+        sections["videos"] = content[resources_start:].replace("有用资源：", "").strip()
+
+    return sections
+
+class IncrementalDiseaseInfoParser:
+    """Streaming counterpart of ``parse_disease_info``.
+
+    ``feed`` takes LLM text deltas and returns ``(section, text)`` deltas as
+    soon as they can be attributed: the ``<think>`` block is dropped, and a
+    section runs from its heading keyword until the next heading in prompt
+    order. A short tail is held back so a keyword split across two chunks is
+    still recognised. ``finish`` flushes the tail and returns the
+    authoritative sections parsed from the full text.
+    """
+
+    # 与 parse_disease_info 使用相同的标题关键字；"原因" 部分不返回给前端
+    HEADINGS = [
+        ("描述", "description"),
+        ("原因", None),
+        ("症状", "symptoms"),
+        ("治疗", "treatment"),
+        ("预防", "prevention"),
+        ("有用资源", "videos"),
+    ]
+    HOLD_BACK = max(len("</think>"), max(len(keyword) for keyword, _ in HEADINGS)) - 1
+
+    def __init__(self):
+        self.content = []
+        self._buffer = ""
+        self._in_think = False
+        self._heading = -1
+        self._at_heading_start = False
+
+    def _strip_think(self):
+        """Remove <think>...</think> from the buffer; False while a block is still open"""
+        while True:
+            if self._in_think:
+                end = self._buffer.find("</think>")
+                if end < 0:
+                    # 思考内容不输出，只保留可能是结束标签前缀的尾部
+                    self._buffer = self._buffer[-self.HOLD_BACK:]
+                    return False
+                self._buffer = self._buffer[end + len("</think>"):]
+                self._in_think = False
+            start = self._buffer.find("<think>")
+            if start < 0:
+                return True
+            self._buffer = self._buffer[:start] + self._buffer[start + len("<think>"):]
+            self._in_think = True
+
+    def _next_heading(self):
+        """Earliest later heading in the buffer as (position, heading index), or None"""
+        found = None
+        for index in range(self._heading + 1, len(self.HEADINGS)):
+            position = self._buffer.find(self.HEADINGS[index][0])
+            if position >= 0 and (found is None or position < found[0]):
+                found = (position, index)
+        return found
+
+    def _emit(self, text, events):
+        section = self.HEADINGS[self._heading][1] if self._heading >= 0 else None
+        if self._at_heading_start:
+            text = text.lstrip("：: \n")
+            if text:
+                self._at_heading_start = False
+        if section and text:
+            events.append((section, text))
+
+    def _drain(self, final):
+        events = []
+        if not self._strip_think():
+            return events
+        while True:
+            found = self._next_heading()
+            if found is None:
+                break
+            position, index = found
+            self._emit(self._buffer[:position], events)
+            self._buffer = self._buffer[position + len(self.HEADINGS[index][0]):]
+            self._heading = index
+            self._at_heading_start = True
+        keep = 0 if final else self.HOLD_BACK
+        if len(self._buffer) > keep:
+            cut = len(self._buffer) - keep
+            self._emit(self._buffer[:cut], events)
+            self._buffer = self._buffer[cut:]
+        return events
+
+    def feed(self, text):
+        self.content.append(text)
+        self._buffer += text
+        return self._drain(final=False)
+
+    def finish(self):
+        """Flush remaining deltas and return ``(events, sections)``"""
+        events = self._drain(final=True)
+        return events, parse_disease_info("".join(self.content))
+
+# 限制同时进行的LLM调用数量
+llm_semaphore = asyncio.Semaphore(max(1, LLM_CONCURRENCY))
+
+def build_chat_request(disease_name, **kwargs):
+    """Keyword arguments for chat.completions.create for one disease"""
+    return dict(
+        model=LLM_MODEL,
+        messages=[
+            {"role": "system", "content": "你是一个专业的植物病理学专家。"},
+            {"role": "user", "content": build_disease_prompt(disease_name)}
+        ],
+        temperature=0.7,
+        max_tokens=1000,
+        **kwargs
+    )
+
+async def fetch_disease_info(disease_name):
+    """Call the LLM for one disease; returns None when the reply is empty"""
+    # 使用新的API格式创建聊天完成
+    async with llm_semaphore:
+        with stage("llm"):
+            response = await get_llm_client().complete(**build_chat_request(disease_name))
+
+    if not response or not response.choices:
+        return None
+
+    # 获取生成的内容并清理思考过程标签
+    return parse_disease_info(response.choices[0].message.content)
+
+async def stream_disease_info_text(disease_name):
+    """Yield completion text deltas for one disease as the LLM produces them"""
+    async with llm_semaphore:
+        # 流式响应时 Server-Timing 头已发出，此处耗时只进入 /metrics
+        with stage("llm"):
+            async for chunk in get_llm_client().stream(**build_chat_request(disease_name)):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+class TextBroadcast:
+    """Text deltas of one in-flight LLM stream, replayed from the start to every subscriber"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self._changed = asyncio.Event()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, text):
+        self.chunks.append(text)
+        self._wake()
+
+    def close(self):
+        self.done = True
+        self._wake()
+
+    async def subscribe(self):
+        position = 0
+        while True:
+            changed = self._changed
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                return
+            await changed.wait()
+
+class DiseaseInfoSubscription:
+    """One caller's view of a disease-info fetch: streamed text deltas, then the parsed sections"""
+
+    def __init__(self, broadcast=None, inflight=None, sections=None):
+        self.broadcast = broadcast
+        self._inflight = inflight
+        self._sections = sections
+
+    @property
+    def streaming(self):
+        """True if ``deltas`` yields the LLM text (False for cache hits and non-streamed fetches)"""
+        return self.broadcast is not None
+
+    async def deltas(self):
+        if self.broadcast is not None:
+            async for text in self.broadcast.subscribe():
+                yield text
+
+    async def result(self):
+        """Parsed sections, or None for an empty reply; raises the fetch's error"""
+        if self._inflight is None:
+            return self._sections
+        # shield: 单个客户端断开不会取消其他请求共享的上游调用
+        return await asyncio.shield(self._inflight)
+
+class DiseaseInfoCache:
+    """TTL + LRU cache of LLM disease info, keyed by disease name.
+
+    Concurrent misses for the same disease share one upstream call
+    (single-flight), whether it was started by ``get`` or by a streamed
+    ``subscribe``; a streamed call's text is replayed to every subscriber.
+    Entries are persisted to a JSON file so a restart does not start cold.
+    Failed or empty LLM replies are never cached.
+    """
+
+    def __init__(self, path=DISEASE_INFO_CACHE_PATH, ttl=DISEASE_INFO_CACHE_TTL,
+                 max_entries=DISEASE_INFO_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()  # disease_name -> (stored_at, sections)
+        self._inflight = {}  # disease_name -> asyncio.Task shared by waiters
+        self._broadcasts = {}  # disease_name -> TextBroadcast of a streamed in-flight call
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.load()
+
+    def _expired(self, stored_at):
+        return self.ttl > 0 and time.time() - stored_at > self.ttl
+
+    def peek(self, disease_name):
+        """Return a fresh cached entry without touching the upstream, or None"""
+        with self._lock:
+            entry = self._entries.get(disease_name)
+            if entry is None:
+                return None
+            if self._expired(entry[0]):
+                del self._entries[disease_name]
+                return None
+            self._entries.move_to_end(disease_name)
+            return entry[1]
+
+    async def put(self, disease_name, sections):
+        with self._lock:
+            self._entries[disease_name] = (time.time(), sections)
+            self._entries.move_to_end(disease_name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        await asyncio.get_running_loop().run_in_executor(None, self.save)
+
+    async def get(self, disease_name, loader=fetch_disease_info):
+        """Return cached info, awaiting ``loader`` once per disease on a miss"""
+        sections = self.peek(disease_name)
+        if sections is not None:
+            self.hits += 1
+            return sections
+
+        inflight = self._inflight.get(disease_name)
+        if inflight is None:
+            self.misses += 1
+            inflight = self._start(disease_name, loader)
+        else:
+            # 同一病害已有请求在调用LLM，等待其结果
+            self.coalesced += 1
+        # shield: 单个客户端断开不会取消其他请求共享的上游调用
+        return await asyncio.shield(inflight)
+
+    def subscribe(self, disease_name, text_source=stream_disease_info_text):
+        """A DiseaseInfoSubscription: cached info, or a share of the (possibly new) streamed fetch"""
+        sections = self.peek(disease_name)
+        if sections is not None:
+            self.hits += 1
+            return DiseaseInfoSubscription(sections=sections)
+        inflight = self._inflight.get(disease_name)
+        if inflight is None:
+            self.misses += 1
+            broadcast = TextBroadcast()
+            self._broadcasts[disease_name] = broadcast
+            inflight = self._start(disease_name, lambda name: self._stream_load(name, broadcast, text_source))
+        else:
+            # 加入进行中的调用；由 get 发起的非流式调用没有增量文本可共享
+            self.coalesced += 1
+            broadcast = self._broadcasts.get(disease_name)
+        return DiseaseInfoSubscription(broadcast, inflight)
+
+    def _start(self, disease_name, loader):
+        inflight = asyncio.get_running_loop().create_task(self._load(disease_name, loader))
+        # 所有等待者都已取消时，避免 "exception was never retrieved" 警告
+        inflight.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self._inflight[disease_name] = inflight
+        return inflight
+
+    @staticmethod
+    async def _stream_load(disease_name, broadcast, text_source):
+        try:
+            async for text in text_source(disease_name):
+                broadcast.append(text)
+        finally:
+            broadcast.close()
+        content = "".join(broadcast.chunks)
+        return parse_disease_info(content) if content else None
+
+    def is_pending(self, disease_name):
+        """True while an upstream fetch for ``disease_name`` is in flight"""
+        return disease_name in self._inflight
+
+    async def _load(self, disease_name, loader):
+        try:
+            sections = await loader(disease_name)
+            if sections is not None:
+                await self.put(disease_name, sections)
+            return sections
+        finally:
+            self._inflight.pop(disease_name, None)
+            self._broadcasts.pop(disease_name, None)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"无法读取病害信息缓存 {self.path}: {e}")
+            return
+        with self._lock:
+            for item in sorted(stored.values(), key=lambda item: item["stored_at"]):
+                if not self._expired(item["stored_at"]):
+                    self._entries[item["disease_name"]] = (item["stored_at"], item["sections"])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            stored = {
+                name: {"disease_name": name, "stored_at": stored_at, "sections": sections}
+                for name, (stored_at, sections) in self._entries.items()
+            }
+        tmp_path = f"{self.path}.tmp"
+        with self._save_lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(stored, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"无法写入病害信息缓存 {self.path}: {e}")
+
+    def stats(self):
+        with self._lock:
             return {
-                "description": "信息不可用。",
-                "symptoms": "信息不可用。",
-                "treatment": "信息不可用。",
-                "prevention": "信息不可用。",
-                "videos": "没有可用的资源建议。"
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "inflight": len(self._inflight),
             }
-        
-        # 获取生成的内容并清理思考过程标签
-        content = response.choices[0].message.content
-        
-        # 清理<think></think>标签及其内容
-        if "<think>" in content and "</think>" in content:
-            think_start = content.find("<think>")
-            think_end = content.find("</think>") + len("</think>")
-            content = content[:think_start] + content[think_end:]
-            content = content.strip()
-        
-        # 提取各个部分（基本解析 - 可以用regex改进）
-        sections = {
-            "description": "信息不可用。",
-            "symptoms": "信息不可用。",
-            "treatment": "信息不可用。",
-            "prevention": "信息不可用。",
-            "videos": "没有可用的资源建议。"
-        }
-        
-        # 基本的部分提取 - 在实际应用中，建议使用regex进行更好的解析
-        if "描述" in content:
-            description_start = content.find("描述")
-            next_section = content.find("原因", description_start)
-            if next_section > 0:
-                sections["description"] = content[description_start:next_section].replace("描述：", "").strip()
-        
-        if "症状" in content:
-            symptoms_start = content.find("症状")
-            next_section = content.find("治疗", symptoms_start)
-            if next_section > 0:
-                sections["symptoms"] = content[symptoms_start:next_section].replace("症状：", "").strip()
-        
-        if "治疗" in content:
-            treatment_start = content.find("治疗")
-            next_section = content.find("预防", treatment_start)
-            if next_section > 0:
-                sections["treatment"] = content[treatment_start:next_section].replace("治疗：", "").strip()
-        
-        if "预防" in content:
-            prevention_start = content.find("预防")
-            next_section = content.find("有用资源", prevention_start)
-            if next_section > 0:
-                sections["prevention"] = content[prevention_start:next_section].replace("预防：", "").strip()
+
+disease_info_cache = DiseaseInfoCache()
+
+def degraded_disease_info(status, description):
+    return {**unavailable_disease_info(description), "disease_info_status": status}
+
+async def get_disease_info(disease_name, wait=None):
+    """使用OpenAI获取详细的疾病信息"""
+    # 熔断打开且没有缓存时立即返回，不等待上游
+    if disease_info_cache.peek(disease_name) is None and get_llm_client().breaker.retry_after() > 0:
+        return degraded_disease_info("unavailable", "病害信息服务暂时不可用，请稍后重试。")
+    try:
+        with stage("disease_info"):
+            # 超时只取消本次等待，共享的LLM调用在后台继续并写入缓存
+            timeout = min(filter(None, (DISEASE_INFO_WAIT_SECONDS, wait)), default=None)
+            sections = await asyncio.wait_for(disease_info_cache.get(disease_name), timeout=timeout)
+        if sections is None:
+            return degraded_disease_info("unavailable", "信息不可用。")
+        return {**sections, "disease_info_status": "ok"}
+    except asyncio.TimeoutError:
+        if disease_info_cache.is_pending(disease_name):
+            return degraded_disease_info("pending", "病害信息正在生成，请稍后重试。")
+        return degraded_disease_info("unavailable", "获取信息超时。")
+    except CircuitOpenError:
+        return degraded_disease_info("unavailable", "病害信息服务暂时不可用，请稍后重试。")
+    except Exception as e:
+        return degraded_disease_info("unavailable", f"获取信息时出错：{str(e)}")
+
+def active_class_names():
+    """Class names of the serving version, or of the version that will be loaded first"""
+    active = model_registry.active
+    if active is not None:
+        return active.class_names
+    # 模型尚未加载（启动时或 --prewarm）：读取初始版本的 classes.json，不加载模型
+    return model_registry.class_names_for(model_registry.initial_version()) if model_registry.root else class_names
+
+async def prewarm_disease_info():
+    """Fill the cache for every non-healthy class of the active model version that is not cached yet"""
+    missing = [
+        name for name in active_class_names()
+        if "healthy" not in name.lower() and disease_info_cache.peek(name) is None
+    ]
+    # 并发度由 llm_semaphore 控制；直接等待缓存加载，不受 DISEASE_INFO_WAIT_SECONDS 限制
+    await asyncio.gather(*(disease_info_cache.get(name) for name in missing), return_exceptions=True)
+    print(f"病害信息预热完成：{len(missing)} 个类别已请求，缓存条目 {disease_info_cache.stats()['entries']}")
+    return missing
+
+# -------------------------------------
+# Asynchronous Jobs
+# -------------------------------------
+job_store = None
+job_store_lock = threading.Lock()
+
+def get_job_store():
+    """The SQLite job store, opened on first use; None when JOB_STORE_PATH is empty"""
+    global job_store
+    if job_store is None and JOB_STORE_PATH:
+        with job_store_lock:
+            if job_store is None:
+                job_store = JobStore(JOB_STORE_PATH, max_attempts=JOB_MAX_ATTEMPTS,
+                                     retry_backoff=JOB_RETRY_BACKOFF_SECONDS, lease_seconds=JOB_LEASE_SECONDS)
+    return job_store
+
+# SQLite 调用串行放到单独的线程，不阻塞事件循环
+job_store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+
+class JobRunner:
+    """In-process workers for the job store.
+
+    One loop claims pending images across all jobs (oldest job first) and
+    classifies up to ``batch_size`` of them in one model call; another fills
+    in disease info once per disease for every item waiting on it, so a slow
+    or unavailable LLM never holds up classification. Each backend process
+    runs its own pair, coordinating through the store's leases.
+    """
+
+    def __init__(self, batch_size=JOB_BATCH_SIZE, poll_seconds=JOB_POLL_SECONDS,
+                 retention_hours=JOB_RETENTION_HOURS):
+        self.batch_size = max(1, batch_size)
+        self.poll_seconds = poll_seconds
+        self.retention_seconds = retention_hours * 3600.0
+        self._work = None
+        self._info = None
+        self._tasks = []
+        self._last_purge = 0.0
+        self._stats_refreshed = 0.0
+        # 任务库计数的缓存，由任务线程定期刷新，/metrics 读取时不在事件循环中查询 SQLite
+        self.store_stats = {}
+        self.batches = 0
+        self.items = 0
+
+    def start(self):
+        if not self._tasks:
+            self._work = asyncio.Event()
+            self._info = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._classify_loop()), loop.create_task(self._info_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake the classify loop after a new job was stored"""
+        if self._work is not None:
+            self._work.set()
+
+    async def _idle(self, event):
+        try:
+            await asyncio.wait_for(event.wait(), self.poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+    async def _store(self, method, *args):
+        return await run_in_executor(job_store_executor, method, *args)
+
+    async def _classify_loop(self):
+        store = get_job_store()
+        while True:
+            try:
+                if time.monotonic() - self._stats_refreshed >= self.poll_seconds:
+                    self._stats_refreshed = time.monotonic()
+                    self.store_stats = await self._store(store.stats)
+                # 模型就绪前不领取，避免租约在等待加载时过期
+                claimed = await self._store(store.claim, self.batch_size) if model_ready.is_set() else []
+                if claimed:
+                    await self._classify(store, claimed)
+                    continue
+                if time.monotonic() - self._last_purge > 3600.0:
+                    self._last_purge = time.monotonic()
+                    await self._store(store.purge, self.retention_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"任务处理出错: {e}")
+            await self._idle(self._work)
+
+    async def _classify(self, store, claimed):
+        decoded = await asyncio.gather(
+            *(run_in_executor(preprocess_executor, preprocess_image_bytes, payload) for _, _, payload in claimed),
+            return_exceptions=True
+        )
+        valid = []
+        for (job_id, position, _), outcome in zip(claimed, decoded):
+            if isinstance(outcome, Exception):
+                detail = outcome.detail if isinstance(outcome, HTTPException) else f"Image processing error: {outcome}"
+                # 图片本身无法解码，重试没有意义
+                await self._store(store.failed, [(job_id, position)], detail, False)
             else:
-                sections["prevention"] = content[prevention_start:].replace("预防：", "").strip()
-        
-        if "有用资源" in content:
-            resources_start = content.find("有用资源")
-            sections["videos"] = content[resources_start:].replace("有用资源：", "").strip()
-        
-        return sections
-        
+                valid.append(((job_id, position), outcome))
+        if not valid:
+            return
+
+        # 不同任务的图片合并为一次模型调用
+        stacked = np.concatenate([image_array for _, image_array in valid], axis=0)
+        try:
+            predictions = await run_in_executor(inference_executor, classify_batch, stacked)
+        except Exception as e:
+            await self._store(store.failed, [key for key, _ in valid], f"Prediction error: {str(e)}")
+            return
+        INFERENCE_BATCH_SIZE.observe(len(stacked))
+        await self._store(store.classified, [
+            (*key, disease_name, confidence, model_version.version)
+            for (key, _), (disease_name, confidence, model_version) in zip(valid, predictions)
+        ])
+        self.batches += 1
+        self.items += len(valid)
+        self._info.set()
+
+    async def _info_loop(self):
+        store = get_job_store()
+        while True:
+            try:
+                diseases = await self._store(store.diseases_awaiting_info, max(1, LLM_CONCURRENCY))
+                if diseases:
+                    await asyncio.gather(*(self._fill_info(store, name) for name in diseases))
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"任务病害信息处理出错: {e}")
+            await self._idle(self._info)
+
+    async def _fill_info(self, store, disease_name):
+        delay = None
+        try:
+            # 与在线请求共用缓存与 single-flight，同一病害只调用一次LLM
+            sections = await disease_info_cache.get(disease_name)
+            error = None if sections is not None else "Empty disease info reply"
+        except CircuitOpenError as e:
+            # 熔断期间只推迟，不计入重试次数
+            sections, error, delay = None, str(e), max(1.0, get_llm_client().breaker.retry_after())
+        except Exception as e:
+            sections, error = None, f"Disease info error: {str(e)}"
+        if sections is not None:
+            await self._store(store.info_ready, disease_name, {**sections, "disease_info_status": "ok"})
+        else:
+            fallback = degraded_disease_info("unavailable", "信息不可用。")
+            await self._store(store.info_failed, disease_name, error, fallback, delay)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
+
+job_runner = JobRunner()
+
+# -------------------------------------
+# Tiled Inference
+# -------------------------------------
+class TiledStats:
+    """Counters for tiled high-resolution requests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.tiles = 0
+        self.batches = 0
+        self.capped = 0
+        self.budget_limited = 0
+        self.budget_rejected = 0
+        self.decode_seconds = 0.0
+        self.tile_seconds = 0.0
+        self.inference_seconds = 0.0
+        self.working_bytes_max = 0
+
+    def record(self, tiled, batch_timings):
+        with self._lock:
+            self.images += 1
+            self.tiles += len(tiled)
+            self.batches += len(batch_timings)
+            self.capped += int(tiled.capped)
+            self.budget_limited += int(tiled.budget_limited)
+            self.decode_seconds += tiled.decode_seconds
+            self.tile_seconds += sum(tile_seconds for _, tile_seconds, _ in batch_timings)
+            self.inference_seconds += sum(inference_seconds for _, _, inference_seconds in batch_timings)
+            self.working_bytes_max = max(self.working_bytes_max, tiled.peak_bytes)
+
+    def record_budget_rejected(self):
+        with self._lock:
+            self.budget_limited += 1
+            self.budget_rejected += 1
+
+    def stats(self):
+        with self._lock:
+            images = self.images or 1
+            return {
+                "images": self.images,
+                "tiles": self.tiles,
+                "batches": self.batches,
+                "tiles_per_image": self.tiles / images,
+                "batches_per_image": self.batches / images,
+                # 因瓦片数上限放大窗口的图片数；因内存预算缩小工作副本或拒绝（计入 budget_rejected）的图片数
+                "capped_grids": self.capped,
+                "budget_limited": self.budget_limited,
+                "budget_rejected": self.budget_rejected,
+                "decode_mean_ms": self.decode_seconds / images * 1000.0,
+                "tile_mean_ms": self.tile_seconds / images * 1000.0,
+                "inference_mean_ms": self.inference_seconds / images * 1000.0,
+                "working_bytes_max": self.working_bytes_max,
+            }
+
+tiled_stats = TiledStats()
+
+def tile_batch_bytes(batch_size):
+    return batch_size * 128 * 128 * 3 * np.dtype(np.float32).itemsize
+
+def open_tiled_image(image_bytes):
+    """Decode an upload into a TiledImage within TILED_MEMORY_BUDGET_MB"""
+    # 预算中先扣除两个瓦片批次（一个推理、一个准备中），剩余部分给 uint8 工作副本
+    budget = TILED_MEMORY_BUDGET_MB * 1024 * 1024 - 2 * tile_batch_bytes(TILED_BATCH_SIZE)
+    try:
+        return TiledImage(
+            image_bytes, tiles_per_side=TILED_TILES_PER_SIDE, overlap=TILED_OVERLAP, max_tiles=TILED_MAX_TILES,
+            memory_budget=max(budget, 1024 * 1024), max_bytes=DECODE_MAX_BYTES, max_pixels=DECODE_MAX_PIXELS,
+        )
+    except MemoryBudgetError as e:
+        tiled_stats.record_budget_rejected()
+        raise HTTPException(status_code=413, detail=f"Image too large for tiling: {str(e)}")
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=f"Image too large: {str(e)}")
     except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Image processing error: {str(e)}")
+
+def fill_tile_batch(tiled, out, start):
+    """Fill ``out`` with the next tiles: ``(count, seconds)``"""
+    started = time.perf_counter()
+    count = tiled.fill(out, start)
+    return count, time.perf_counter() - started
+
+def predict_tile_batch(model_version, batch_array):
+    """Class probabilities for one tile batch: ``(probabilities, seconds)``"""
+    started = time.perf_counter()
+    probabilities = np.asarray(model_version.runtime.predict(batch_array), dtype=np.float32)
+    return probabilities, time.perf_counter() - started
+
+def combine_tiles(probabilities, class_names, threshold=TILED_DISEASE_THRESHOLD):
+    """Image-level ``(class_index, probability)`` from per-tile class probabilities.
+
+    A lesion may cover a single tile, so a disease seen with at least
+    ``threshold`` probability on any tile wins (max-pooling); otherwise the
+    class with the highest mean probability over all tiles is returned.
+    """
+    pooled = probabilities.max(axis=0)
+    diseased = np.array(["healthy" not in name.lower() for name in class_names])
+    if diseased.any():
+        candidate = int(np.argmax(np.where(diseased, pooled, -1.0)))
+        if pooled[candidate] >= threshold:
+            return candidate, float(pooled[candidate])
+    mean = probabilities.mean(axis=0)
+    index = int(np.argmax(mean))
+    return index, float(mean[index])
+
+async def classify_tiled(image_bytes):
+    """Classify overlapping tiles of a large image in a few model calls and combine them.
+
+    Tiles are produced one batch at a time; the next batch is filled on the
+    preprocess pool while the current one runs on the inference pool.
+    """
+    started = time.perf_counter()
+    with stage("tile_decode"):
+        tiled = await run_in_executor(preprocess_executor, open_tiled_image, image_bytes)
+    pending = None
+    try:
+        # 所有瓦片使用同一个模型版本，切换版本不会混合两个版本的输出
+        model_version = await run_in_executor(inference_executor, load_model_version)
+        batch_size = max(1, min(TILED_BATCH_SIZE, len(tiled)))
+        buffers = [np.empty((batch_size, 128, 128, 3), dtype=np.float32)
+                   for _ in range(2 if len(tiled) > batch_size else 1)]
+        pending = asyncio.ensure_future(run_in_executor(preprocess_executor, fill_tile_batch, tiled, buffers[0], 0))
+        probabilities, batch_timings = [], []
+        start = 0
+        while start < len(tiled):
+            count, tile_seconds = await pending
+            pending = None
+            batch = buffers[len(batch_timings) % len(buffers)][:count]
+            inference = run_in_executor(inference_executor, predict_tile_batch, model_version, batch)
+            start += count
+            if start < len(tiled):
+                # 当前批次推理的同时准备下一批瓦片
+                pending = asyncio.ensure_future(run_in_executor(
+                    preprocess_executor, fill_tile_batch, tiled, buffers[(len(batch_timings) + 1) % len(buffers)],
+                    start,
+                ))
+            try:
+                batch_probabilities, inference_seconds = await inference
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+            INFERENCE_BATCH_SIZE.observe(count)
+            record_stage("tiles", tile_seconds)
+            record_stage("inference", inference_seconds)
+            probabilities.append(batch_probabilities)
+            batch_timings.append((count, tile_seconds, inference_seconds))
+    finally:
+        if pending is not None:
+            # 出错时等待正在填充的批次结束，再释放工作副本
+            await asyncio.gather(pending, return_exceptions=True)
+        tiled.close()
+
+    probabilities = np.concatenate(probabilities)
+    class_names = model_version.class_names
+    index, probability = combine_tiles(probabilities, class_names)
+    tiled_stats.record(tiled, batch_timings)
+    tile_indices = probabilities.argmax(axis=1)
+    return {
+        "disease_name": class_names[index],
+        "confidence": probability * 100,
+        "model_version": model_version.version,
+        "image_size": list(tiled.image_size),
+        "tile_pixels": tiled.window,
+        "rows": tiled.rows,
+        "cols": tiled.cols,
+        "tiles": [
+            {
+                "row": position // tiled.cols,
+                "col": position % tiled.cols,
+                "box": list(box),
+                "disease_name": class_names[tile_index],
+                "confidence": float(probabilities[position, tile_index] * 100),
+            }
+            for position, (box, tile_index) in enumerate(zip(tiled.boxes, tile_indices))
+        ],
+        "heatmap": np.round(probabilities[:, index] * 100, 1).reshape(tiled.rows, tiled.cols).tolist(),
+        "timings_ms": {
+            "decode": tiled.decode_seconds * 1000.0,
+            "batches": [
+                {"tiles": count, "tile_ms": tile_seconds * 1000.0, "inference_ms": inference_seconds * 1000.0}
+                for count, tile_seconds, inference_seconds in batch_timings
+            ],
+            "total": (time.perf_counter() - started) * 1000.0,
+        },
+    }
+
+# -------------------------------------
+# Camera Streams
+# -------------------------------------
+def frame_thumbnail(image_array):
+    """32x32 grayscale block average of a preprocessed (1, 128, 128, 3) frame, for cheap frame differencing"""
+    gray = image_array[0].mean(axis=2)
+    height, width = gray.shape
+    return gray.reshape(32, height // 32, 32, width // 32).mean(axis=(1, 3))
+
+class StreamStats:
+    """Counters shared by all camera-stream sessions"""
+
+    def __init__(self):
+        self.active = 0
+        self.sessions = 0
+        self.rejected = 0
+        self.frames = 0
+        self.stale = 0
+        self.duplicates = 0
+        self.inferred = 0
+        self.failed = 0
+        self.disease_info_sent = 0
+
+    def stats(self):
         return {
-            "description": f"获取信息时出错：{str(e)}",
-            "symptoms": "信息不可用。",
-            "treatment": "信息不可用。",
-            "prevention": "信息不可用。",
-            "videos": "没有可用的资源建议。"
+            "active_sessions": self.active,
+            "sessions": self.sessions,
+            "rejected_sessions": self.rejected,
+            "frames": self.frames,
+            "stale_dropped": self.stale,
+            "duplicates_skipped": self.duplicates,
+            "inferred": self.inferred,
+            "failed": self.failed,
+            "disease_info_sent": self.disease_info_sent,
+            # 真正进入模型的帧占比
+            "inference_ratio": self.inferred / self.frames if self.frames else 0.0,
         }
 
+stream_stats = StreamStats()
+
+class CameraStream:
+    """One WebSocket session classifying a camera feed, newest frame first.
+
+    Only one frame per session is in flight: frames arriving meanwhile
+    overwrite a single waiting slot, so when inference falls behind the
+    older ones are dropped (``skipped``/``stale``) and the newest always
+    wins. A frame that differs from the last classified one by less than
+    ``dedup_threshold`` is skipped (``skipped``/``duplicate``). Frames go
+    through the shared BatchScheduler, so concurrent sessions (and HTTP
+    requests) are classified together in one model call. Disease info is
+    sent once per class the session has not seen before.
+    """
+
+    def __init__(self, websocket, disease_info=True, dedup_threshold=STREAM_DEDUP_THRESHOLD):
+        self.websocket = websocket
+        self.disease_info = disease_info
+        self.dedup_threshold = dedup_threshold
+        self._latest = None  # (frame_id, received_at, image_bytes)
+        self._frame_ready = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+        self._reference = None  # (frame_id, thumbnail) of the last classified frame
+        self._announced = set()
+        self._info_tasks = set()
+
+    async def send(self, event):
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(event, ensure_ascii=False))
+
+    async def run(self):
+        tasks = {asyncio.create_task(self._receive_frames()), asyncio.create_task(self._process_frames())}
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            # 客户端断开或发送失败时，两个循环一起结束
+            for task in done:
+                task.result()
+        finally:
+            for task in (*tasks, *self._info_tasks):
+                task.cancel()
+            await asyncio.gather(*tasks, *self._info_tasks, return_exceptions=True)
+
+    async def _receive_frames(self):
+        next_id = 0
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            next_id += 1
+            frame_id = next_id
+            if message.get("bytes") is not None:
+                image_bytes = message["bytes"]
+            else:
+                # 文本消息：{"image": "<base64>", "frame": 可选的客户端帧号}
+                try:
+                    body = json.loads(message.get("text") or "")
+                    frame_id = body.get("frame", frame_id)
+                    image_bytes = decode_base64_image(body["image"])
+                except HTTPException as e:
+                    await self.send({"event": "error", "frame": frame_id, "detail": e.detail})
+                    continue
+                except Exception as e:
+                    await self.send({"event": "error", "frame": frame_id, "detail": f"Invalid frame message: {str(e)}"})
+                    continue
+            stream_stats.frames += 1
+
+            if self._latest is not None:
+                # 推理跟不上：丢弃还没开始处理的旧帧
+                stream_stats.stale += 1
+                await self.send({"event": "skipped", "frame": self._latest[0], "reason": "stale"})
+            self._latest = (frame_id, time.perf_counter(), image_bytes)
+            self._frame_ready.set()
+
+    async def _process_frames(self):
+        while True:
+            await self._frame_ready.wait()
+            self._frame_ready.clear()
+            frame_id, received_at, image_bytes = self._latest
+            self._latest = None
+            try:
+                await self._process(frame_id, received_at, image_bytes)
+            except HTTPException as e:
+                stream_stats.failed += 1
+                await self.send({"event": "error", "frame": frame_id, "detail": e.detail})
+            except Exception as e:
+                stream_stats.failed += 1
+                await self.send({"event": "error", "frame": frame_id, "detail": f"Prediction error: {str(e)}"})
+
+    async def _process(self, frame_id, received_at, image_bytes):
+        image_array = await run_in_executor(preprocess_executor, preprocess_image_bytes, image_bytes)
+        thumbnail = frame_thumbnail(image_array)
+        if self._reference is not None and self.dedup_threshold > 0:
+            # 与上一个已识别的帧比较，缓慢的累积变化最终仍会触发推理
+            if float(np.mean(np.abs(thumbnail - self._reference[1]))) < self.dedup_threshold:
+                stream_stats.duplicates += 1
+                await self.send({"event": "skipped", "frame": frame_id, "reason": "duplicate",
+                                 "same_as": self._reference[0]})
+                return
+
+        disease_name, confidence, model_version = await batch_scheduler.submit(image_array)
+        stream_stats.inferred += 1
+        self._reference = (frame_id, thumbnail)
+        await self.send({
+            "event": "prediction",
+            "frame": frame_id,
+            "disease_name": disease_name,
+            "confidence": confidence,
+            "model_version": model_version.version,
+            "latency_ms": (time.perf_counter() - received_at) * 1000.0,
+        })
+
+        if self.disease_info and "healthy" not in disease_name.lower() and disease_name not in self._announced:
+            self._announced.add(disease_name)
+            task = asyncio.create_task(self._send_disease_info(disease_name))
+            self._info_tasks.add(task)
+            task.add_done_callback(self._info_tasks.discard)
+
+    async def _send_disease_info(self, disease_name):
+        # 不阻塞后续帧的识别；同一会话中每种病害只发送一次
+        try:
+            sections = await disease_info_cache.get(disease_name)
+            if sections is None:
+                info = degraded_disease_info("unavailable", "信息不可用。")
+            else:
+                info = {**sections, "disease_info_status": "ok"}
+        except CircuitOpenError:
+            info = degraded_disease_info("unavailable", "病害信息服务暂时不可用，请稍后重试。")
+        except Exception as e:
+            info = degraded_disease_info("unavailable", f"获取信息时出错：{str(e)}")
+        stream_stats.disease_info_sent += 1
+        await self.send({"event": "disease_info", "disease_name": disease_name, **info})
+
 # -------------------------------------
 # API Endpoints
 # -------------------------------------
@@ -232,45 +2408,694 @@ async def root():
         "version": "1.0.0"
     }
 
-@app.post("/predict", response_model=PredictionResponse)
-async def predict(request: ImageRequest):
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and the event loop is responsive"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the model is loaded and warmed up"""
+    body = {
+        "ready": model_ready.is_set(),
+        "runtime": model_registry.active.runtime.name if model_registry.active is not None else None,
+        "model_version": model_registry.active.version if model_registry.active is not None else None,
+        "startup_phases_ms": startup_phases,
+    }
+    if model_load_error is not None:
+        body["error"] = model_load_error
+    return JSONResponse(body, status_code=200 if model_ready.is_set() else 503)
+
+@app.post("/predict", response_model=PredictionResponse, openapi_extra={"requestBody": {
+    "required": True, "content": {"application/json": {"schema": ImageRequest.model_json_schema()}},
+}})
+async def predict(http_request: Request):
     """Process image and return disease prediction with information"""
+    print("收到请求")
+    # 请求体自行按大小上限读取，不交给 FastAPI 整体读入后再校验
+    with stage("parse"):
+        request = await read_image_request(http_request)
+    async with admission_controller.admit(http_request) as admission:
+        with stage("parse"):
+            image_bytes = await run_in_executor(preprocess_executor, decode_base64_image, request.image)
+        return await predict_image_bytes(image_bytes, admission)
+
+@app.post("/predict/upload", response_model=PredictionResponse)
+async def predict_upload(request: Request, filename: Optional[str] = None):
+    """Same as /predict, but takes the raw image as multipart/form-data or application/octet-stream"""
+    print("收到请求")
+    with stage("parse"):
+        image_bytes = await read_image_body(request)
+    async with admission_controller.admit(request) as admission:
+        return await predict_image_bytes(image_bytes, admission)
+
+@app.post("/predict/tiled", response_model=TiledPredictionResponse)
+async def predict_tiled(request: Request, filename: Optional[str] = None):
+    """Tiled /predict/upload for large photos where lesions are small.
+
+    The image is cut into overlapping tiles, each classified at model input
+    size; the response adds the per-tile predictions, a rows x cols heatmap
+    of the image-level class and per-batch tile and inference timings.
+    """
+    print("收到分块请求")
+    with stage("parse"):
+        image_bytes = await read_image_body(request)
+    async with admission_controller.admit(request) as admission:
+        response = await classify_tiled(image_bytes)
+        if "healthy" not in response["disease_name"].lower():
+            await admission.check()
+            response.update(await get_disease_info(response["disease_name"], admission.remaining()))
+        return response
+
+@app.post("/predict/stream")
+async def predict_stream(request: Request, filename: Optional[str] = None):
+    """Streamed /predict: NDJSON events, classification first, then disease info as it is generated.
+
+    Accepts the same bodies as /predict/upload, or the /predict JSON body.
+    Events, one JSON object per line:
+    ``{"event": "prediction", "disease_name", "confidence", "model_version"}``, then for
+    non-healthy classes any number of ``{"event": "delta", "section", "text"}``,
+    and finally ``{"event": "done", ...full PredictionResponse fields}``.
+    Errors after the stream has started are sent as ``{"event": "error"}``.
+    """
+    print("收到流式请求")
+    with stage("parse"):
+        image_bytes = await read_image_body(request)
+    admission = await admission_controller.acquire(request)
     try:
-        print("收到请求")
-        # Process image
-        image_array = preprocess_image(request.image)
-        
-        # Make prediction
-        predicted_index, confidence = predict_disease(image_array)
-        disease_name = class_names[predicted_index]
+        disease_name, confidence, model_version = await classify_image_bytes(image_bytes)
+    except BaseException:
+        admission.release()
+        raise
+
+    async def events():
+        # 准入槽位一直占用到流结束（包括LLM生成阶段）
+        try:
+            async for event in stream_prediction_events(disease_name, confidence, model_version):
+                yield event
+        finally:
+            admission.release()
+
+    return StreamingResponse(
+        events(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def json_body_limit(image_count):
+    """Largest JSON body accepted for ``image_count`` base64 images of at most DECODE_MAX_BYTES"""
+    return image_count * (DECODE_MAX_BYTES * 4 // 3 + 4096) if DECODE_MAX_BYTES else None
+
+def check_content_length(request, limit):
+    """Reject the request with 413 when its declared length already exceeds ``limit``"""
+    content_length = request.headers.get("content-length", "")
+    if limit and content_length.isdigit() and int(content_length) > limit:
+        raise HTTPException(status_code=413, detail=f"Request body too large: limit is {limit} bytes")
+
+async def read_body_limited(request, limit):
+    """Read the request body, rejecting it with 413 as soon as it exceeds ``limit`` bytes"""
+    check_content_length(request, limit)
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if limit and size > limit:
+            raise HTTPException(status_code=413, detail=f"Request body too large: limit is {limit} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def read_upload_limited(upload):
+    """Bytes of a multipart upload; larger than DECODE_MAX_BYTES is rejected with 413 before reading"""
+    # 解析表单时文件已写入临时文件（超过 1MB 落盘），这里按大小检查后才读入内存
+    if DECODE_MAX_BYTES and (upload.size or 0) > DECODE_MAX_BYTES:
+        raise HTTPException(status_code=413,
+                            detail=f"Image too large: {upload.filename} exceeds {DECODE_MAX_BYTES} bytes")
+    return await upload.read()
+
+async def read_image_request(request):
+    """Parse a JSON ImageRequest, reading at most one base64 image's worth of body"""
+    body = await read_body_limited(request, json_body_limit(1))
+    try:
+        return ImageRequest(**json.loads(body))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request: {str(e)}")
+
+async def read_image_body(request):
+    """Raw image bytes from a multipart 'file' part, a JSON ImageRequest or the raw body"""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        # 声明的长度超限时不解析表单
+        check_content_length(request, json_body_limit(1))
+        form = await request.form(max_files=1)
+        try:
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="Missing 'file' field in multipart body")
+            image_bytes = await read_upload_limited(upload)
+        finally:
+            await form.close()
+    elif content_type.startswith("application/json"):
+        body = await read_image_request(request)
+        image_bytes = await run_in_executor(preprocess_executor, decode_base64_image, body.image)
+    else:
+        # 边读边计数，超过 DECODE_MAX_BYTES 立即以 413 结束，不先把整个请求体读入内存
+        image_bytes = await read_body_limited(request, DECODE_MAX_BYTES)
+
+    if not image_bytes:
+        raise HTTPException(status_code=400, detail="Empty image body")
+    return image_bytes
+
+def ndjson(event):
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+async def stream_prediction_events(disease_name, confidence, model_version=None):
+    response = {"disease_name": disease_name, "confidence": confidence, "model_version": model_version}
+    yield ndjson({"event": "prediction", **response})
+    if "healthy" in disease_name.lower():
+        yield ndjson({"event": "done", **response})
+        return
+
+    # 已缓存时直接使用完整结果；否则加入（或发起）同一病害共享的流式调用，并发请求只调用一次LLM
+    subscription = disease_info_cache.subscribe(disease_name)
+    status = "ok"
+    parser = IncrementalDiseaseInfoParser()
+    try:
+        async for text in subscription.deltas():
+            for section, delta in parser.feed(text):
+                yield ndjson({"event": "delta", "section": section, "text": delta})
+        if subscription.streaming:
+            events, _ = parser.finish()
+            for section, delta in events:
+                yield ndjson({"event": "delta", "section": section, "text": delta})
+        sections = await subscription.result()
+    except CircuitOpenError as e:
+        # 熔断时不等待上游，直接结束
+        sections, status = unavailable_disease_info("病害信息服务暂时不可用，请稍后重试。"), "unavailable"
+        yield ndjson({"event": "error", "detail": str(e)})
+    except Exception as e:
+        sections, status = unavailable_disease_info(f"获取信息时出错：{str(e)}"), "unavailable"
+        yield ndjson({"event": "error", "detail": str(e)})
+    else:
+        if sections is None:
+            sections, status = unavailable_disease_info(), "unavailable"
+        elif not subscription.streaming:
+            # 缓存命中或加入了非流式调用：一次性发送各部分
+            for section, text in sections.items():
+                yield ndjson({"event": "delta", "section": section, "text": text})
+    yield ndjson({"event": "done", **response, **sections, "disease_info_status": status})
+
+async def classify_image_bytes(image_bytes):
+    """Return ``(disease_name, confidence, model_version)``, serving repeats from the prediction cache"""
+    cache_key = None
+    active = model_registry.active
+    # 模型尚未加载时缓存必然为空，跳过查找
+    if prediction_cache.enabled and active is not None:
+        try:
+            with stage("cache_lookup"):
+                cache_key = await run_in_executor(preprocess_executor, prediction_cache.key_for, image_bytes)
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=f"Image too large: {str(e)}")
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Image processing error: {str(e)}")
+        cached = prediction_cache.get(cache_key, active.generation)
+        if cached is not None:
+            # 命中缓存：跳过解码、缩放和推理
+            return cached
+
+    # Process image (在线程池中解码，避免阻塞事件循环)
+    decode_timings = {}
+    with stage("preprocess"):
+        image_array = await run_in_executor(preprocess_executor, preprocess_image_bytes, image_bytes, decode_timings)
+    for name, seconds in decode_timings.items():
+        record_stage(name, seconds)
+
+    # Make prediction (合并并发请求为一次批量推理)
+    try:
+        disease_name, confidence, model_version = await batch_scheduler.submit(image_array)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+    result = (disease_name, confidence, model_version.version)
+    if cache_key is not None:
+        # 按实际推理的版本写入（排队期间可能已经切换了版本）
+        prediction_cache.put(cache_key, model_version.generation, result)
+    return result
+
+async def predict_image_bytes(image_bytes, admission=None):
+    """Shared request path: classify raw image bytes and attach disease info"""
+    try:
+        disease_name, confidence, model_version = await classify_image_bytes(image_bytes)
         
         # Get disease information for non-healthy plants
         disease_info = {}
         if "healthy" not in disease_name.lower():
-            disease_info = get_disease_info(disease_name)
+            wait = None
+            if admission is not None:
+                # 客户端已断开时不再等待LLM；剩余时间作为病害信息的等待上限
+                await admission.check()
+                wait = admission.remaining()
+            disease_info = await get_disease_info(disease_name, wait)
         
         # Prepare response
-        response = {
-            "disease_name": disease_name,
-            "confidence": confidence,
-            **disease_info
-        }
+        with stage("response"):
+            response = {
+                "disease_name": disease_name,
+                "confidence": confidence,
+                "model_version": model_version,
+                **disease_info
+            }
         
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
+@app.post("/predict/batch", response_model=BatchPredictionResponse)
+async def predict_batch_endpoint(request: Request):
+    """Classify N images in one request.
+
+    Accepts multipart/form-data with one or more ``file`` parts, or JSON
+    ``{"images": [{"image": "<base64>", "filename": "..."}]}``. Results are
+    returned in input order; an image that fails to decode gets an ``error``
+    instead of failing the whole batch.
+    """
+    print("收到批量请求")
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        # 解析时超过图片数上限立即以 400 结束；超过 DECODE_MAX_BYTES 的文件不读入内存
+        check_content_length(request, json_body_limit(BATCH_REQUEST_MAX_IMAGES))
+        form = await request.form(max_files=BATCH_REQUEST_MAX_IMAGES)
+        try:
+            uploads = [item for item in form.getlist("file") if not isinstance(item, str)]
+            items = [(upload.filename, preprocess_image_bytes, await read_upload_limited(upload)) for upload in uploads]
+        finally:
+            await form.close()
+    else:
+        body = await read_body_limited(request, json_body_limit(BATCH_REQUEST_MAX_IMAGES))
+        try:
+            body = BatchImageRequest(**json.loads(body))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid batch request: {str(e)}")
+        items = [(image.filename, preprocess_image, image.image) for image in body.images]
+
+    if not items:
+        raise HTTPException(status_code=400, detail="No images in batch request")
+    if len(items) > BATCH_REQUEST_MAX_IMAGES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many images: {len(items)} > {BATCH_REQUEST_MAX_IMAGES}"
+        )
+
+    async with admission_controller.admit(request) as admission:
+        return await predict_batch_items(items, admission)
+
+async def predict_batch_items(items, admission):
+    """Decode, classify and attach disease info for ``(filename, preprocess, payload)`` items"""
+    # 并行解码/缩放
+    with stage("preprocess"):
+        decoded = await asyncio.gather(
+            *(run_in_executor(preprocess_executor, preprocess, payload) for _, preprocess, payload in items),
+            return_exceptions=True
+        )
+    results = [{"filename": filename} for filename, _, _ in items]
+    valid = []
+    for position, outcome in enumerate(decoded):
+        if isinstance(outcome, HTTPException):
+            results[position]["error"] = outcome.detail
+        elif isinstance(outcome, Exception):
+            results[position]["error"] = f"Image processing error: {str(outcome)}"
+        else:
+            valid.append((position, outcome))
+
+    if valid:
+        # 所有成功解码的图片合并为一次模型调用
+        stacked = np.concatenate([image_array for _, image_array in valid], axis=0)
+        try:
+            with stage("inference"):
+                predictions = await run_in_executor(inference_executor, classify_batch, stacked)
+            INFERENCE_BATCH_SIZE.observe(len(stacked))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+        for (position, _), (disease_name, confidence, model_version) in zip(valid, predictions):
+            results[position]["disease_name"] = disease_name
+            results[position]["confidence"] = confidence
+            results[position]["model_version"] = model_version.version
+
+        # 每种病害只查询一次病害信息
+        diseases = sorted({
+            results[position]["disease_name"] for position, _ in valid
+            if "healthy" not in results[position]["disease_name"].lower()
+        })
+        await admission.check()
+        wait = admission.remaining()
+        infos = await asyncio.gather(*(get_disease_info(name, wait) for name in diseases))
+        info_by_disease = dict(zip(diseases, infos))
+        for position, _ in valid:
+            results[position].update(info_by_disease.get(results[position]["disease_name"], {}))
+
+    return {"results": results}
+
+@app.websocket("/ws/stream")
+async def stream_camera(websocket: WebSocket, disease_info: bool = True):
+    """Classify a continuous stream of frames (binary image messages or ``{"image": "<base64>"}``).
+
+    Replies are JSON text messages: ``prediction`` per classified frame,
+    ``skipped`` (``stale`` or ``duplicate``) for frames that were not,
+    ``disease_info`` once per newly detected disease and ``error``.
+    """
+    if stream_stats.active >= STREAM_MAX_SESSIONS:
+        stream_stats.rejected += 1
+        # 1013: try again later
+        await websocket.close(code=1013)
+        return
+    await websocket.accept()
+    stream_stats.active += 1
+    stream_stats.sessions += 1
+    try:
+        await CameraStream(websocket, disease_info).run()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        stream_stats.active -= 1
+
+@app.get("/stats/streams")
+async def get_stream_stats():
+    """Return camera-stream counters: sessions, frames dropped as stale or duplicate, frames classified"""
+    return stream_stats.stats()
+
+class JobRequest(BatchImageRequest):
+    disease_info: bool = True
+
+JOB_CSV_FIELDS = ["filename", "status", "disease_name", "confidence", "model_version", "disease_info_status",
+                  "description", "symptoms", "treatment", "prevention", "videos", "error"]
+
+def require_job_store():
+    store = get_job_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="Job API is disabled (JOB_STORE_PATH is empty)")
+    return store
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: Request, disease_info: bool = True):
+    """Queue a large submission and return its job id immediately.
+
+    Takes the same bodies as /predict/batch (JSON may also carry
+    ``"disease_info": false``), up to JOB_MAX_IMAGES images. Poll
+    ``GET /jobs/{id}`` for progress and download ``GET /jobs/{id}/results``.
+    """
+    store = require_job_store()
+    content_type = request.headers.get("content-type", "")
+    images = []
+    if content_type.startswith("multipart/form-data"):
+        # 解析时超过文件数上限立即以 400 结束；上传的文件先写入临时文件，不会整体留在内存中
+        form = await request.form(max_files=JOB_MAX_IMAGES)
+        try:
+            for upload in form.getlist("file"):
+                if isinstance(upload, str):
+                    continue
+                images.append((upload.filename, await read_upload_limited(upload)))
+        finally:
+            await form.close()
+    else:
+        # JSON 请求体按图片数上限对应的 base64 大小读取，超出即拒绝
+        body = await read_body_limited(request, json_body_limit(JOB_MAX_IMAGES))
+        try:
+            body = JobRequest(**json.loads(body))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid job request: {str(e)}")
+        if len(body.images) > JOB_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f"Too many images: {len(body.images)} > {JOB_MAX_IMAGES}")
+        disease_info = body.disease_info
+        # decode_base64_image 在解码前按 DECODE_MAX_BYTES 检查每张图片
+        for image in body.images:
+            images.append((image.filename, await run_in_executor(preprocess_executor, decode_base64_image, image.image)))
+
+    if not images:
+        raise HTTPException(status_code=400, detail="No images in job request")
+
+    job_id = await run_in_executor(job_store_executor, store.create_job, images, disease_info)
+    job_runner.notify()
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "total": len(images),
+        "status_url": f"/jobs/{job_id}",
+        "results_url": f"/jobs/{job_id}/results",
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Return job status and progress: item counts by state and the finished fraction"""
+    job = await run_in_executor(job_store_executor, require_job_store().job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return job
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(job_id: str, format: str = "json"):
+    """Download per-image results (JSON or CSV); items still in progress have no prediction yet"""
+    store = require_job_store()
+    job = await run_in_executor(job_store_executor, store.job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    results = await run_in_executor(job_store_executor, store.results, job_id)
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=JOB_CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+        return Response(content=buffer.getvalue(), media_type="text/csv; charset=utf-8",
+                        headers={"Content-Disposition": f'attachment; filename="job-{job_id}.csv"'})
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be json or csv")
+    return JSONResponse({**job, "results": results},
+                        headers={"Content-Disposition": f'attachment; filename="job-{job_id}.json"'})
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Delete a job and its stored images and results"""
+    if not await run_in_executor(job_store_executor, require_job_store().delete, job_id):
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return {"status": "deleted", "job_id": job_id}
+
+@app.get("/stats/jobs")
+async def get_job_stats():
+    """Return job-queue counters: open jobs, items by state, retries and cross-job batch sizes"""
+    store = get_job_store()
+    if store is None:
+        return {"enabled": False}
+    return {**await run_in_executor(job_store_executor, store.stats), **job_runner.stats()}
+
+@app.get("/stats/tiled")
+async def get_tiled_stats():
+    """Return tiled-inference counters: tiles and model calls per image, capped grids, mean timings"""
+    return tiled_stats.stats()
+
+@app.get("/stats/admission")
+async def get_admission_stats():
+    """Return admission counters: in-flight, queue depth and requests shed by reason"""
+    return admission_controller.stats()
+
+@app.get("/stats/batching")
+async def get_batching_stats():
+    """Return micro-batching counters (batch-size distribution and queue wait)"""
+    return batch_scheduler.stats()
+
+@app.get("/stats/decode")
+async def get_decode_stats():
+    """Return per-image decode timing and decoded-image memory counters"""
+    return decode_stats.stats()
+
+@app.get("/stats/prediction-cache")
+async def get_prediction_cache_stats():
+    """Return prediction-cache hit/miss counters"""
+    return prediction_cache.stats()
+
+@app.get("/stats/disease-info")
+async def get_disease_info_stats():
+    """Return disease-info cache counters"""
+    return disease_info_cache.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus exposition: stage/request latency histograms and the /stats counters"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+def active_cascade():
+    """The active version's CascadeRuntime, or None"""
+    runtime = model_registry.active.runtime if model_registry.active is not None else None
+    return runtime if isinstance(runtime, CascadeRuntime) else None
+
+register_stats({
+    "batching": batch_scheduler.stats,
+    "admission": admission_controller.stats,
+    "decode": decode_stats.stats,
+    "prediction_cache": prediction_cache.stats,
+    "disease_info": disease_info_cache.stats,
+    "llm": lambda: get_llm_client().stats(),
+    "cascade": lambda: active_cascade().stats() if active_cascade() else {},
+    "streams": stream_stats.stats,
+    "tiled": tiled_stats.stats,
+    "jobs": lambda: {**job_runner.store_stats, **job_runner.stats()} if job_store is not None else {},
+    "model_registry": model_registry.stats,
+    "model_shadow": lambda: model_registry.shadow.stats() if model_registry.shadow else {},
+})
+
+@app.get("/stats/cascade")
+async def get_cascade_stats():
+    """Return cascade routing counters: escalation rate, per-stage latency, shadow disagreement"""
+    cascade = active_cascade()
+    if cascade is None:
+        return {"enabled": False}
+    return cascade.stats()
+
+@app.get("/stats/model-shadow")
+async def get_model_shadow_stats():
+    """Return shadow-mode counters: agreement with the active version and per-batch latency of both"""
+    shadow = model_registry.shadow
+    if shadow is None:
+        return {"enabled": False}
+    return shadow.stats()
+
+@app.get("/stats/llm")
+async def get_llm_stats():
+    """Return LLM call/retry/timeout counters and the circuit-breaker state"""
+    return get_llm_client().stats()
+
+@app.get("/model")
+async def get_model_info():
+    """Return the active model version and inference runtime"""
+    active = model_registry.active
+    if active is None:
+        return {"runtime": INFERENCE_RUNTIME, "path": None, "loaded": False, "settings": runtime_settings()}
+    return {**active.info(), "loaded": True, "settings": runtime_settings()}
+
 @app.get("/classes")
 async def get_classes():
-    """Return all possible disease classes"""
-    return {"classes": class_names}
+    """Return all possible disease classes of the active model version"""
+    active = model_registry.active
+    return {"classes": active.class_names if active is not None else class_names}
+
+# -------------------------------------
+# Model Administration
+# -------------------------------------
+def require_admin(request):
+    """Admin endpoints need X-Admin-Token; without ADMIN_TOKEN only loopback clients may call them"""
+    if ADMIN_TOKEN:
+        if not hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+            raise HTTPException(status_code=403, detail="Invalid admin token")
+    elif request.client is None or request.client.host not in ("127.0.0.1", "::1"):
+        raise HTTPException(status_code=403, detail="Admin endpoints are limited to localhost unless ADMIN_TOKEN is set")
+
+def load_in_background(func, *args):
+    """Run a registry load on the default executor; failures end up in the registry's last_error"""
+    def run():
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"模型版本加载失败: {e}")
+
+    future = asyncio.get_running_loop().run_in_executor(None, run)
+    if DISEASE_INFO_PREWARM:
+        # 新版本可能带有不同的类别列表，切换后补充预热其病害信息（已缓存的类别不会重复请求）
+        future.add_done_callback(lambda _: asyncio.ensure_future(prewarm_disease_info()))
+    return future
+
+def check_version_loadable(version):
+    if model_registry.loading is not None:
+        raise HTTPException(status_code=409, detail=f"Model version '{model_registry.loading}' is still loading")
+    if not model_registry.root:
+        raise HTTPException(status_code=400, detail="MODEL_REGISTRY_DIR is not set; only /admin/models/reload is available")
+    if version not in model_registry.versions():
+        raise HTTPException(status_code=404, detail=f"Unknown model version '{version}'")
+
+@app.get("/admin/models")
+async def list_model_versions(request: Request):
+    """Return the versions in the registry, the active and shadow versions and any load in progress"""
+    require_admin(request)
+    return {
+        **model_registry.stats(),
+        "versions": model_registry.versions(),
+        "active": model_registry.active.info() if model_registry.active is not None else None,
+    }
+
+@app.post("/admin/models/{version}/activate", status_code=202)
+async def activate_model_version(version: str, request: Request):
+    """Load and warm ``version`` in the background, then swap it in; progress via GET /admin/models.
+
+    The choice is written to the registry's ACTIVE file, so it survives
+    restarts and workers polling the file follow it.
+    """
+    require_admin(request)
+    check_version_loadable(version)
+    load_in_background(model_registry.activate, version, True)
+    return {"status": "loading", "version": version}
+
+@app.post("/admin/models/reload", status_code=202)
+async def reload_model_version(request: Request):
+    """Reload the active version from disk (e.g. after replacing MODEL_PATH) and swap it in"""
+    require_admin(request)
+    if model_registry.loading is not None:
+        raise HTTPException(status_code=409, detail=f"Model version '{model_registry.loading}' is still loading")
+    if model_registry.active is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded yet")
+    version = model_registry.active.version
+    load_in_background(model_registry.activate, version)
+    return {"status": "loading", "version": version}
+
+@app.post("/admin/models/{version}/shadow", status_code=202)
+async def shadow_model_version(version: str, request: Request, rate: float = MODEL_SHADOW_RATE):
+    """Load ``version`` as the shadow candidate and compare it on ``rate`` of the batches"""
+    require_admin(request)
+    check_version_loadable(version)
+    if not 0.0 < rate <= 1.0:
+        raise HTTPException(status_code=400, detail="rate must be in (0, 1]")
+    load_in_background(model_registry.start_shadow, version, rate)
+    return {"status": "loading", "version": version, "rate": rate}
+
+@app.delete("/admin/models/shadow")
+async def stop_model_shadow(request: Request):
+    """Stop shadow mode and release the candidate"""
+    require_admin(request)
+    model_registry.stop_shadow()
+    return {"status": "stopped"}
+
+async def watch_model_registry():
+    """Poll the ACTIVE file and hot-swap when it names another version"""
+    attempted = None
+    while True:
+        await asyncio.sleep(MODEL_REGISTRY_POLL_SECONDS)
+        if not model_ready.is_set() or model_registry.loading is not None:
+            continue
+        try:
+            state = (model_registry.read_active_file(), os.stat(model_registry.active_file()).st_mtime)
+        except OSError:
+            continue
+        # 同一内容加载失败后不反复重试，直到 ACTIVE 文件被重新写入
+        if not state[0] or state[0] == model_registry.active.version or state == attempted:
+            continue
+        attempted = state
+        await load_in_background(model_registry.activate, state[0])
+
+record_startup_phase("import", time.perf_counter() - _import_started)
 
 # -------------------------------------
 # Server Startup
 # -------------------------------------
 if __name__ == "__main__":
-    # Load model at startup
-    load_model()
-    # Run server
-    uvicorn.run(app, host="0.0.0.0", port=8503)
+    parser = argparse.ArgumentParser(description="Plant Disease Recognition API")
+    parser.add_argument("--prewarm", action="store_true",
+                        help="fill the disease-info cache for all non-healthy classes and exit")
+    args, serve_args = parser.parse_known_args()
+
+    if args.prewarm:
+        asyncio.run(prewarm_disease_info())
+        raise SystemExit(0)
+
+    # 交给 serve_backend.py 启动服务（--workers / --graceful-timeout 等参数原样传递）：
+    # spawn 出的 worker 会重新执行入口脚本，入口不能是本模块，否则每个 worker 会导入两次
+    launcher = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve_backend.py")
+    os.execv(sys.executable, [sys.executable, launcher, *serve_args])
@@ -1,9 +1,15 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image
+from collections import OrderedDict
+import hashlib
 import io
-import base64
 import json
+import os
+import threading
+import time
 
 # -------------------------------------
 # 📌 Streamlit 页面配置
@@ -35,22 +41,111 @@ st.markdown("""
 # -------------------------------------
 # 📌 Backend API Configuration
 # -------------------------------------
-API_ENDPOINT = "http://39.105.194.16:8503"  # Change this to match your backend API endpoint
+API_ENDPOINT = os.getenv("API_ENDPOINT", "http://39.105.194.16:8503")  # Change this to match your backend API endpoint
 
+# 上传前把图片缩小到最长边 UPLOAD_MAX_SIDE 像素并重新编码为JPEG（模型输入只有128x128）；0 表示发送原图
+UPLOAD_MAX_SIDE = int(os.getenv("UPLOAD_MAX_SIDE", "512"))
+UPLOAD_JPEG_QUALITY = int(os.getenv("UPLOAD_JPEG_QUALITY", "90"))
+# (连接超时, 读取超时) 秒；流式请求的读取超时针对每一行
+REQUEST_TIMEOUT = (float(os.getenv("API_CONNECT_TIMEOUT", "5")), float(os.getenv("API_READ_TIMEOUT", "60")))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "128"))
 
-def analyze_image(image_file):
+
+@st.cache_resource
+def get_http_session():
+    """One pooled keep-alive session shared by all reruns and browser sessions"""
+    session = requests.Session()
+    # 只重试连接失败（请求尚未发出），POST 不会被重复提交
+    retry = Retry(total=2, connect=2, read=0, status=0, other=0, backoff_factor=0.2, allowed_methods=None)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class ResultCache:
+    """LRU of completed analyses keyed by image digest, shared across reruns"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(RESULT_CACHE_SIZE)
+
+
+def prepare_upload(image_file):
+    """Downscale and re-encode the upload; returns (payload, filename, debug info)"""
+    original = image_file.getvalue()
+    started = time.perf_counter()
+    debug = {"original_bytes": len(original), "sent_bytes": len(original)}
+    payload, filename = original, image_file.name
+    try:
+        with Image.open(io.BytesIO(original)) as image:
+            debug["original_size"] = f"{image.size[0]}x{image.size[1]}"
+            debug["sent_size"] = debug["original_size"]
+            # 超过目标尺寸时缩小；PNG 等无损格式即使不缩小，重新编码为JPEG通常也小得多
+            if UPLOAD_MAX_SIDE > 0 and (max(image.size) > UPLOAD_MAX_SIDE or image.format != "JPEG"):
+                # JPEG 先按 1/2、1/4、1/8 缩放解码，避免解码完整分辨率
+                image.draft("RGB", (UPLOAD_MAX_SIDE, UPLOAD_MAX_SIDE))
+                image = image.convert("RGB")
+                image.thumbnail((UPLOAD_MAX_SIDE, UPLOAD_MAX_SIDE))
+                buffer = io.BytesIO()
+                image.save(buffer, "JPEG", quality=UPLOAD_JPEG_QUALITY)
+                if buffer.tell() < len(original):
+                    payload = buffer.getvalue()
+                    filename = os.path.splitext(image_file.name)[0] + ".jpg"
+                    debug["sent_size"] = f"{image.size[0]}x{image.size[1]}"
+    except Exception:
+        # 本地无法解码时发送原图，由后端返回具体错误
+        pass
+    debug["sent_bytes"] = len(payload)
+    debug["prepare_ms"] = (time.perf_counter() - started) * 1000.0
+    return payload, filename, debug
+
+
+def server_time_ms(response):
+    """Total server-side time from the backend's Server-Timing header, if present"""
+    for metric in response.headers.get("Server-Timing", "").split(","):
+        name, _, params = metric.strip().partition(";")
+        if name == "total" and params.startswith("dur="):
+            return float(params[len("dur="):])
+    return None
+
+
+def analyze_image(payload, filename, debug=None):
     """Send image to backend API for analysis"""
+    reUrl = f"{API_ENDPOINT}/predict/upload"
+    debug = debug if debug is not None else {}
     try:
-        # Convert image to base64
-        img_bytes = image_file.getvalue()
-        encoded = base64.b64encode(img_bytes).decode('utf-8')
-        
-        # Send to backend
-        reUrl = f"{API_ENDPOINT}/predict"
-        response = requests.post(
+        # 直接发送图片字节，避免base64编码带来的体积膨胀
+        started = time.perf_counter()
+        response = get_http_session().post(
             reUrl,
-            json={"image": encoded, "filename": image_file.name}
+            params={"filename": filename},
+            data=payload,
+            headers={"Content-Type": "application/octet-stream"},
+            timeout=REQUEST_TIMEOUT
         )
+        debug["rtt_ms"] = (time.perf_counter() - started) * 1000.0
+        debug["server_ms"] = server_time_ms(response)
         
         if response.status_code == 200:
             return response.json()
@@ -59,6 +154,105 @@ def analyze_image(image_file):
     except Exception as e:
         return {"error": f"Connection Error: {reUrl} {str(e)}"}
 
+def analyze_image_stream(payload, filename, debug):
+    """Stream analysis events from the backend (NDJSON): prediction first, then disease info deltas"""
+    reUrl = f"{API_ENDPOINT}/predict/stream"
+    started = time.perf_counter()
+    with get_http_session().post(
+        reUrl,
+        params={"filename": filename},
+        data=payload,
+        headers={"Content-Type": "application/octet-stream"},
+        stream=True,
+        timeout=REQUEST_TIMEOUT
+    ) as response:
+        if response.status_code != 200:
+            yield {"event": "error", "error": f"API Error: {response.status_code}", "details": response.text}
+            return
+        debug["server_ms"] = server_time_ms(response)
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                event = json.loads(line)
+                if event["event"] == "prediction":
+                    # 识别结果的往返时间；病害信息随后继续流式返回
+                    debug["rtt_ms"] = (time.perf_counter() - started) * 1000.0
+                elif event["event"] == "done":
+                    debug["total_ms"] = (time.perf_counter() - started) * 1000.0
+                yield event
+
+
+def render_streaming_analysis(image_file, placeholder):
+    """Render the diagnosis progressively while the backend streams it; returns the final result"""
+    payload, filename, debug = prepare_upload(image_file)
+    st.session_state['debug_info'] = debug
+
+    # 同一张图片（且上传参数相同）已有完整结果时直接复用，不再请求后端
+    cache_key = (hashlib.sha256(image_file.getvalue()).hexdigest(), UPLOAD_MAX_SIDE, UPLOAD_JPEG_QUALITY)
+    cached = get_result_cache().get(cache_key)
+    debug["cache_hit"] = cached is not None
+    if cached is not None:
+        return cached
+
+    result = stream_analysis(payload, filename, debug, placeholder)
+    # 只缓存完整结果；pending / unavailable 的病害信息下次重新请求
+    if "error" not in result and result.get("disease_info_status") in (None, "ok"):
+        get_result_cache().put(cache_key, result)
+    return result
+
+
+def stream_analysis(payload, filename, debug, placeholder):
+    sections = {"description": "", "symptoms": "", "treatment": "", "prevention": "", "videos": ""}
+    titles = {"description": "描述", "symptoms": "症状", "treatment": "治疗", "prevention": "预防", "videos": "相关资源"}
+    prediction = None
+    try:
+        for event in analyze_image_stream(payload, filename, debug):
+            if event["event"] == "error" and prediction is None:
+                return {"error": event.get("error", "API Error"), "details": event.get("details", event.get("detail"))}
+            if event["event"] == "done":
+                return {key: value for key, value in event.items() if key != "event"}
+            if event["event"] == "prediction":
+                prediction = event
+            elif event["event"] == "delta":
+                sections[event["section"]] += event["text"]
+
+            with placeholder.container():
+                st.markdown(f"**检测结果**: {prediction['disease_name'].replace('___', ' - ').replace('_', ' ')}"
+                            f" （置信度 {prediction['confidence']:.1f}%）")
+                for key, text in sections.items():
+                    if text:
+                        st.markdown(f"**{titles[key]}**\n\n{text}")
+    except Exception:
+        if prediction is None:
+            # 流式接口不可用时退回普通接口
+            return analyze_image(payload, filename, debug)
+
+    # 流在 done 之前中断：返回已收到的部分结果（不缓存）
+    if prediction is None:
+        return {"error": "Empty response"}
+    prediction = {key: value for key, value in prediction.items() if key != "event"}
+    return {**prediction, **{key: text for key, text in sections.items() if text},
+            "disease_info_status": "unavailable"}
+
+
+def render_debug_info(debug):
+    """Upload size and round-trip numbers for the last analysis"""
+    with st.expander("🛠️ 调试信息"):
+        saved = debug["original_bytes"] - debug["sent_bytes"]
+        ratio = saved / debug["original_bytes"] * 100 if debug["original_bytes"] else 0.0
+        st.markdown(f"- 原图：{debug.get('original_size', '?')}，{debug['original_bytes'] / 1024:.1f} KB")
+        st.markdown(f"- 实际上传：{debug.get('sent_size', '?')}，{debug['sent_bytes'] / 1024:.1f} KB"
+                    f"（节省 {saved / 1024:.1f} KB，{ratio:.0f}%；本地缩放用时 {debug['prepare_ms']:.1f} ms）")
+        if debug.get("cache_hit"):
+            st.markdown("- 命中本地结果缓存：未请求后端，往返时间 0 ms")
+            return
+        if "rtt_ms" in debug:
+            st.markdown(f"- 识别结果往返时间：{debug['rtt_ms']:.0f} ms")
+        if debug.get("server_ms") is not None:
+            network = debug["rtt_ms"] - debug["server_ms"]
+            st.markdown(f"- 其中后端处理 {debug['server_ms']:.0f} ms，上传与网络 {network:.0f} ms")
+        if "total_ms" in debug:
+            st.markdown(f"- 含病害信息的总耗时：{debug['total_ms']:.0f} ms")
+
 # -------------------------------------
 # 📌 Initialize Session State
 # -------------------------------------
@@ -66,6 +260,8 @@ if 'analyzed' not in st.session_state:
     st.session_state['analyzed'] = False
 if 'prediction_result' not in st.session_state:
     st.session_state['prediction_result'] = None
+if 'debug_info' not in st.session_state:
+    st.session_state['debug_info'] = None
 
 # -------------------------------------
 # 📌 Sidebar Navigation
@@ -154,8 +350,10 @@ elif app_mode == "病害识别":
             analyze_clicked = st.button("🔬 分析图片", key="analyze_button")
             
             if analyze_clicked:
+                live_result = st.empty()
                 with st.spinner('正在分析您的植物...'):
-                    result = analyze_image(uploaded_file)
+                    result = render_streaming_analysis(uploaded_file, live_result)
+                    live_result.empty()
                     
                     if "error" in result:
                         st.error(f"错误: {result['error']}")
@@ -207,6 +405,9 @@ elif app_mode == "病害识别":
                     st.subheader("相关资源")
                     st.markdown(result["videos"])
 
+            if st.session_state['debug_info']:
+                render_debug_info(st.session_state['debug_info'])
+
 elif app_mode == "植物护理指南":
     st.title("🌱 植物护理指南")
     
@@ -12,33 +12,87 @@ pythonPath=${base_dir}/venv/bin/python
 . $base_dir/colors.sh
 
 logName=plant-disease-backend
-jobName=plant-disease-backend.py
+jobName=serve_backend.py
 
-# 停止已运行的进程
-TAILPID=`ps aux | grep "$jobName" | grep -v grep | awk '{print $2}'`
-echo "${YELLOW}check $jobName pid $TAILPID ${NOCOLOR}"
-if [ "0$TAILPID" != "0" ]; then
-    echo "${YELLOW}正在停止 $jobName 进程 (PID: $TAILPID)${NOCOLOR}"
-    kill -9 $TAILPID
-    echo "${GREEN}$jobName 进程已停止${NOCOLOR}"
-else
-    echo "${GREEN}没有找到运行中的 $jobName 进程${NOCOLOR}"
-fi
+# worker 数量与优雅退出等待时间，可通过环境变量覆盖
+workers=${WORKERS:-1}
+gracefulTimeout=${GRACEFUL_TIMEOUT:-30}
 
-# 默认操作为 restart，如果有参数且为 stop，则只执行停止操作
+# 用法: ./run_backend.sh [restart|stop|start|reload]
+#   restart  默认；多 worker 运行中时滚动重启（等同 reload），否则优雅停止后重新启动，
+#            停止到新进程就绪之间服务不可用（单 worker 时会中断请求，需要不停机请用 WORKERS>=2）
+#   reload   向主进程发送 SIGHUP，逐个替换 worker，新 worker 预热完成后才停止旧 worker，不丢请求
+#   stop     发送 SIGTERM，等待在途请求处理完成后退出，超时才强制结束
+#   start    仅启动
 action=${1:-restart}
 
-# 如果操作为 stop，则到此结束
-if [ "$action" = "stop" ]; then
-    echo "${GREEN}已完成停止操作${NOCOLOR}"
-    exit 0
-fi
+# 只匹配主进程；多 worker 模式下的子进程命令行不包含脚本名。可能匹配到多个进程，按列表处理
+TAILPID=`ps aux | grep "$jobName" | grep -v grep | awk '{print $2}' | xargs`
+echo "${YELLOW}check $jobName pid $TAILPID ${NOCOLOR}"
+
+stop_backend() {
+    if [ -z "$TAILPID" ]; then
+        echo "${GREEN}没有找到运行中的 $jobName 进程${NOCOLOR}"
+        return
+    fi
+    echo "${YELLOW}正在优雅停止 $jobName 进程 (PID: $TAILPID)，最多等待 ${gracefulTimeout}s${NOCOLOR}"
+    kill -TERM $TAILPID
+    waited=0
+    while ps -p "${TAILPID// /,}" > /dev/null 2>&1; do
+        if [ $waited -ge $((gracefulTimeout + 10)) ]; then
+            echo "${RED}$jobName 未能在超时内退出，强制结束${NOCOLOR}"
+            kill -9 $TAILPID
+            break
+        fi
+        sleep 1
+        waited=$((waited + 1))
+    done
+    echo "${GREEN}$jobName 进程已停止${NOCOLOR}"
+}
 
-# 否则继续启动服务
-mkdir -p logs
+start_backend() {
+    mkdir -p logs
+    echo "${YELLOW}nohup $pythonPath $jobDir/$jobName --workers $workers --graceful-timeout $gracefulTimeout > logs/${logName}.log 2>&1 &${NOCOLOR}"
+    nohup $pythonPath $jobDir/$jobName --workers $workers --graceful-timeout $gracefulTimeout > logs/${logName}.log 2>&1 &
+    echo ------Web后台服务已启动-----
+}
 
-echo "${YELLOW}nohup $pythonPath $jobDir/$jobName  > logs/${logName}.log 2>&1 &${NOCOLOR}"
-nohup $pythonPath $jobDir/$jobName  > logs/${logName}.log 2>&1 &
+reload_backend() {
+    echo "${YELLOW}向 $jobName 主进程 (PID: $TAILPID) 发送 SIGHUP，滚动重启 worker${NOCOLOR}"
+    kill -HUP $TAILPID
+    echo "${GREEN}已触发滚动重启，进度见 logs/${logName}.log${NOCOLOR}"
+}
 
-echo ------Web后台服务已启动-----
+# 当前进程是否以多 worker 模式运行（只有多 worker 模式的主进程能处理 SIGHUP）
+running_multi_worker() {
+    [ -n "$TAILPID" ] && ps -o args= -p "${TAILPID// /,}" | grep -q -- "--workers [2-9]\|--workers [1-9][0-9]"
+}
 
+case "$action" in
+    stop)
+        stop_backend
+        echo "${GREEN}已完成停止操作${NOCOLOR}"
+        ;;
+    start)
+        start_backend
+        ;;
+    reload)
+        if running_multi_worker; then
+            reload_backend
+        else
+            echo "${RED}没有以多 worker 模式运行的 $jobName，无法滚动重启${NOCOLOR}"
+            exit 1
+        fi
+        ;;
+    *)
+        if running_multi_worker; then
+            reload_backend
+        else
+            if [ -n "$TAILPID" ]; then
+                echo "${RED}$jobName 未以多 worker 模式运行，将停止后重新启动，期间请求会失败${NOCOLOR}"
+            fi
+            stop_backend
+            start_backend
+        fi
+        ;;
+esac
@@ -0,0 +1,65 @@
+"""Launch the backend under uvicorn, with one or more worker processes.
+
+    python serve_backend.py
+    python serve_backend.py --workers 4 --graceful-timeout 30
+
+uvicorn's worker processes are started with spawn, which re-runs the parent's
+entry script in every worker. This launcher only parses arguments, so each
+worker imports plant-disease-backend.py exactly once (through the
+``plant-disease-backend:app`` import string) and builds one set of
+executors, caches and model registry.
+"""
+import argparse
+import os
+import sys
+
+import uvicorn
+
+from metrics import reset_multiprocess_dir
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP = "plant-disease-backend:app"
+HOST = "0.0.0.0"
+PORT = 8503
+
+# worker 数量、优雅退出等待时间（秒）、多 worker 模式下新 worker 加载预热模型的超时（秒）
+WORKERS = int(os.getenv("WORKERS", "1"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+MODEL_LOAD_TIMEOUT = int(os.getenv("MODEL_LOAD_TIMEOUT", "120"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the Plant Disease Recognition API")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="number of worker processes")
+    parser.add_argument("--graceful-timeout", type=int, default=GRACEFUL_TIMEOUT,
+                        help="seconds to wait for in-flight requests on shutdown")
+    args = parser.parse_args(argv)
+
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    # 设置了 PROMETHEUS_MULTIPROC_DIR 时清理上次运行留下的指标文件
+    reset_multiprocess_dir()
+    # 模型在 lifespan 启动阶段后台加载，/readyz 就绪后再接收流量
+    if args.workers <= 1:
+        uvicorn.run(APP, host=HOST, port=PORT, timeout_graceful_shutdown=args.graceful_timeout)
+        return
+
+    # 多 worker：父进程持有监听端口，SIGHUP 时逐个替换 worker（新 worker 就绪后再停旧的），
+    # SIGTERM 时等待在途请求完成后退出。TensorFlow 不支持 fork 后继续使用，
+    # 因此不做 preload-then-fork；使用 tflite 运行时时权重通过 mmap 在 worker 间共享。
+    if os.getenv("INFERENCE_RUNTIME", "keras") == "keras":
+        print("提示: keras 运行时下每个 worker 各自持有一份模型，"
+              "多 worker 部署建议使用 INFERENCE_RUNTIME=tflite 以共享权重内存")
+    os.environ["WAIT_FOR_MODEL_ON_STARTUP"] = "1"
+    uvicorn.run(
+        APP,
+        host=HOST,
+        port=PORT,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_worker_healthcheck=MODEL_LOAD_TIMEOUT,
+    )
+
+if __name__ == "__main__":
+    main()
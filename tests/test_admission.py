@@ -0,0 +1,46 @@
+import asyncio
+import importlib
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+backend = importlib.import_module("plant-disease-backend")
+
+
+class FakeRequest:
+    headers = {}
+    client = None
+
+    async def is_disconnected(self):
+        return False
+
+
+@pytest.mark.parametrize("timeout", [0, 30])
+@pytest.mark.parametrize("max_inflight,max_queue", [(1, 0), (2, 3)])
+def test_burst_admits_at_most_inflight_plus_queue(timeout, max_inflight, max_queue):
+    async def burst():
+        controller = backend.AdmissionController(max_inflight=max_inflight, max_queue=max_queue,
+                                                 timeout=timeout, rate=0)
+        release = asyncio.Event()
+
+        async def attempt():
+            try:
+                admission = await controller.acquire(FakeRequest())
+            except HTTPException as e:
+                return e.status_code
+            await release.wait()
+            admission.release()
+            return 200
+
+        tasks = [asyncio.create_task(attempt()) for _ in range(10)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*tasks), controller
+
+    statuses, controller = asyncio.run(burst())
+    assert statuses.count(429) == 10 - (max_inflight + max_queue)
+    assert statuses.count(200) == max_inflight + max_queue
+    assert controller.inflight == controller.waiting == 0
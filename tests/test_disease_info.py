@@ -0,0 +1,107 @@
+import asyncio
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+backend = importlib.import_module("plant-disease-backend")
+
+REPLY = ("<think>先分析一下描述和症状</think>描述：叶片出现黑斑。原因：真菌感染。"
+         "症状：斑点扩大。治疗：喷施杀菌剂。预防：保持通风。有用资源：https://example.com/video")
+
+
+def test_concurrent_misses_share_one_load():
+    async def run():
+        cache = backend.DiseaseInfoCache(path="")
+        release = asyncio.Event()
+        calls = []
+
+        async def loader(name):
+            calls.append(name)
+            await release.wait()
+            return {"description": name}
+
+        waiters = [asyncio.create_task(cache.get("Rose___black_spot", loader)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters)
+        assert calls == ["Rose___black_spot"]
+        assert results == [{"description": "Rose___black_spot"}] * 5
+        assert (cache.misses, cache.coalesced) == (1, 4)
+        # 结果已缓存，之后的请求不再调用上游
+        assert await cache.get("Rose___black_spot", loader) == {"description": "Rose___black_spot"}
+        assert cache.hits == 1 and len(calls) == 1
+
+    asyncio.run(run())
+
+
+def test_empty_reply_is_not_cached():
+    async def run():
+        cache = backend.DiseaseInfoCache(path="")
+        calls = []
+
+        async def loader(name):
+            calls.append(name)
+            return None
+
+        assert await cache.get("Rose___black_spot", loader) is None
+        assert await cache.get("Rose___black_spot", loader) is None
+        assert len(calls) == 2
+
+    asyncio.run(run())
+
+
+def test_streamed_miss_is_shared_with_get_and_cached_once():
+    async def run():
+        cache = backend.DiseaseInfoCache(path="")
+        release = asyncio.Event()
+        calls = []
+
+        async def text_source(name):
+            calls.append(name)
+            for start in range(0, len(REPLY), 7):
+                if start == 14:
+                    await release.wait()
+                yield REPLY[start:start + 7]
+
+        async def collect(subscription):
+            return "".join([text async for text in subscription.deltas()]), await subscription.result()
+
+        first = cache.subscribe("Rose___black_spot", text_source)
+        second = cache.subscribe("Rose___black_spot", text_source)
+        # 非流式调用也加入同一次上游请求
+        plain = asyncio.create_task(cache.get("Rose___black_spot", loader=None))
+        assert first.streaming and second.streaming
+        readers = [asyncio.create_task(collect(first)), asyncio.create_task(collect(second))]
+        await asyncio.sleep(0)
+        release.set()
+        streamed = await asyncio.gather(*readers)
+        expected = backend.parse_disease_info(REPLY)
+        assert streamed == [(REPLY, expected)] * 2
+        assert await plain == expected
+        assert calls == ["Rose___black_spot"]
+        assert cache.peek("Rose___black_spot") == expected
+        assert not cache.subscribe("Rose___black_spot", text_source).streaming
+
+    asyncio.run(run())
+
+
+def test_incremental_parser_matches_full_parse_for_any_chunking():
+    expected = backend.parse_disease_info(REPLY)
+    for size in (1, 2, 3, 5, len(REPLY)):
+        parser = backend.IncrementalDiseaseInfoParser()
+        events = []
+        for start in range(0, len(REPLY), size):
+            events.extend(parser.feed(REPLY[start:start + size]))
+        tail, sections = parser.finish()
+        events.extend(tail)
+        assert sections == expected
+        streamed = {}
+        for section, text in events:
+            streamed[section] = streamed.get(section, "") + text
+        # 思考内容和“原因”部分不输出，其余各部分与整体解析结果一致
+        assert "先分析" not in "".join(streamed.values())
+        assert set(streamed) == {"description", "symptoms", "treatment", "prevention", "videos"}
+        assert {section: text.strip() for section, text in streamed.items()} == {
+            section: expected[section] for section in streamed
+        }
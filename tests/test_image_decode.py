@@ -0,0 +1,41 @@
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_decode import DecodeStats, MemoryBudgetError, TiledImage
+
+BUDGET = 4 * 1024 * 1024
+
+
+def encode(size, fmt, mode="RGB"):
+    buffer = io.BytesIO()
+    Image.new(mode, size, 128).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L"])
+def test_png_over_budget_is_rejected_before_decoding(mode):
+    stats = DecodeStats()
+    # 2000x2000 的 PNG 解码并转换为 RGB 至少需要 12MB
+    with pytest.raises(MemoryBudgetError):
+        TiledImage(encode((2000, 2000), "PNG", mode), memory_budget=BUDGET, stats=stats)
+    assert stats.rejected == 1 and stats.decoded == 0
+
+
+def test_jpeg_over_budget_is_dct_scaled_into_budget():
+    # 同样大小的 JPEG 可以按 DCT 缩小解码，不会被拒绝
+    stats = DecodeStats()
+    tiled = TiledImage(encode((2000, 2000), "JPEG"), memory_budget=BUDGET, stats=stats)
+    assert tiled.image_size == (2000, 2000)
+    assert tiled.peak_bytes <= BUDGET
+    assert stats.decoded == 1 and stats.reduced == 1
+
+
+def test_png_within_budget_is_tiled():
+    tiled = TiledImage(encode((1000, 800), "PNG"), memory_budget=BUDGET, stats=DecodeStats())
+    assert not tiled.budget_limited
+    assert tiled.peak_bytes <= BUDGET
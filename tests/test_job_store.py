@@ -0,0 +1,65 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from job_store import DONE, FAILED, PENDING, RUNNING, JobStore
+
+
+def make_store(tmp_path, **kwargs):
+    return JobStore(str(tmp_path / "jobs.db"), **kwargs)
+
+
+def test_expired_lease_is_reclaimed_then_failed(tmp_path):
+    # lease_seconds=0：领取后租约立即过期，相当于处理进程已退出
+    store = make_store(tmp_path, max_attempts=2, lease_seconds=0.0)
+    job_id = store.create_job([("a.jpg", b"a")])
+
+    assert store.claim(10) == [(job_id, 0, b"a")]
+    assert store.job(job_id)["counts"][RUNNING] == 1
+    assert store.claim(10) == [(job_id, 0, b"a")]
+    # 达到最大尝试次数后不再领取，直接判为失败
+    assert store.claim(10) == []
+    job = store.job(job_id)
+    assert job["status"] == "completed"
+    assert job["counts"][FAILED] == 1
+    assert store.results(job_id)[0]["error"] == "Processing did not finish (lease expired)"
+
+
+def test_unexpired_lease_is_not_reclaimed(tmp_path):
+    store = make_store(tmp_path, lease_seconds=300.0)
+    job_id = store.create_job([("a.jpg", b"a"), ("b.jpg", b"b")])
+
+    assert [position for _, position, _ in store.claim(1)] == [0]
+    assert [position for _, position, _ in store.claim(10)] == [1]
+    assert store.claim(10) == []
+    assert store.job(job_id)["counts"][RUNNING] == 2
+
+
+def test_failed_items_retry_until_max_attempts(tmp_path):
+    store = make_store(tmp_path, max_attempts=2, retry_backoff=0.0)
+    job_id = store.create_job([("a.jpg", b"a"), ("b.jpg", b"b")])
+
+    store.claim(10)
+    store.failed([(job_id, 0)], "decode error", retry=False)
+    store.failed([(job_id, 1)], "inference error")
+    assert store.job(job_id)["counts"][PENDING] == 1
+    assert store.retried == 1
+
+    assert store.claim(10) == [(job_id, 1, b"b")]
+    store.failed([(job_id, 1)], "inference error")
+    job = store.job(job_id)
+    assert job["status"] == "completed"
+    assert job["counts"][FAILED] == 2
+    assert [result["error"] for result in store.results(job_id)] == ["decode error", "inference error"]
+
+
+def test_classified_items_finish_the_job(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.create_job([("a.jpg", b"a")], disease_info=False)
+
+    store.claim(10)
+    store.classified([(job_id, 0, "Rose___black_spot", 0.9, "v1")])
+    job = store.job(job_id)
+    assert job["status"] == "completed"
+    assert job["counts"][DONE] == 1
+    assert store.results(job_id)[0]["disease_name"] == "Rose___black_spot"
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import sys
+import time
+
+import openai  # noqa: F401  llm_client 在第一次失败时才导入，提前导入以免计入超时
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import llm_client
+from llm_client import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, ResilientLLMClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeCompletions:
+    """Stands in for client.chat.completions; ``create`` runs ``handler``"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.calls = 0
+
+    async def create(self, **request):
+        self.calls += 1
+        return await self.handler(**request)
+
+
+def client_with(handler, **kwargs):
+    client = ResilientLLMClient("http://llm.invalid/v1", "key", **kwargs)
+    completions = FakeCompletions(handler)
+    client._client = type("FakeClient", (), {"chat": type("Chat", (), {"completions": completions})})()
+    return client, completions
+
+
+def test_breaker_opens_half_opens_and_closes(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_client, "time", clock)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10.0)
+
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+    # 超时后只放行一个探测请求；探测失败重新打开
+    clock.now += 10.0
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.opened_total == 2
+
+    clock.now += 10.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.failures == 0
+    assert breaker.allow()
+
+
+def test_open_breaker_fails_fast():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.0)
+    breaker.record_failure()
+
+    async def never_called(**request):
+        raise AssertionError("upstream called while the breaker is open")
+
+    client, completions = client_with(never_called, breaker=breaker)
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(client.complete(model="m", messages=[]))
+    assert completions.calls == 0
+
+
+def test_total_timeout_bounds_all_retries():
+    async def hang(**request):
+        await asyncio.sleep(10)
+
+    client, completions = client_with(hang, timeout=0.2, total_timeout=0.3, max_retries=5, backoff=0.0,
+                                      breaker=CircuitBreaker(failure_threshold=100))
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(client.complete(model="m", messages=[]))
+    # 第一次尝试用满 0.2s，第二次只剩约 0.1s，之后不再发起
+    assert time.monotonic() - started < 1.0
+    assert completions.calls == 2
+    assert client.timeouts == 2
+
+
+def test_abandoned_stream_is_closed():
+    stream = FakeStream(["a", "b", "c"])
+
+    async def open_stream(**request):
+        return stream
+
+    client, _ = client_with(open_stream)
+
+    async def read_first():
+        chunks = client.stream(model="m", messages=[])
+        first = await chunks.__anext__()
+        await chunks.aclose()
+        return first
+
+    assert asyncio.run(read_first()) == "a"
+    assert stream.closed
@@ -0,0 +1,22 @@
+import importlib
+import importlib.util
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+backend = importlib.import_module("plant-disease-backend")
+
+
+def test_second_import_does_not_break_metrics():
+    # spawn 出的 worker 先以 __mp_main__ 运行脚本，uvicorn 再按模块名导入一次
+    spec = importlib.util.spec_from_file_location("__mp_main__", os.path.join(ROOT, "plant-disease-backend.py"))
+    second = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(second)
+
+    response = TestClient(second.app).get("/metrics")
+    assert response.status_code == 200
+    assert "plant_batching_batches" in response.text
+    assert response.text.count("# TYPE plant_batching_batches gauge") == 1
@@ -0,0 +1,74 @@
+import importlib
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+backend = importlib.import_module("plant-disease-backend")
+
+
+class FakeRuntime:
+    """Outputs as many classes as its model file says, without TensorFlow"""
+
+    name = "fake"
+    input_size = (8, 8)
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, encoding="utf-8") as f:
+            self.num_classes = int(f.read())
+
+    def predict(self, batch_array):
+        return np.zeros((len(batch_array), self.num_classes), dtype=np.float32)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(backend, "runtime_for_path", FakeRuntime)
+    monkeypatch.setattr(backend, "CASCADE_MODEL_PATH", "")
+    monkeypatch.setattr(backend, "MODEL_VERSION", "")
+    # v3 的模型输出 3 类，但类别表只有 2 类，预热检查会失败
+    for version, outputs, classes in [("v1", 2, ["a", "b"]), ("v2", 3, ["a", "b", "c"]), ("v3", 3, ["a", "b"])]:
+        directory = tmp_path / version
+        directory.mkdir()
+        (directory / "model.keras").write_text(str(outputs), encoding="utf-8")
+        (directory / "classes.json").write_text(json.dumps(classes), encoding="utf-8")
+    (tmp_path / "ACTIVE").write_text("v1\n", encoding="utf-8")
+    registry = backend.ModelRegistry(str(tmp_path))
+    registry.ensure_loaded()
+    return registry
+
+
+def test_swap_and_rollback(registry):
+    assert registry.active.version == "v1"
+    old = registry.active
+
+    registry.activate("v2", persist=True)
+    assert registry.active.version == "v2"
+    assert registry.active.class_names == ["a", "b", "c"]
+    assert registry.read_active_file() == "v2"
+    # 正在运行的批次仍持有旧版本的引用，不受切换影响
+    assert old.class_names == ["a", "b"]
+
+    registry.activate("v1", persist=True)
+    assert registry.active.version == "v1"
+    assert registry.read_active_file() == "v1"
+    assert registry.active is not old
+    assert registry.swaps == 2
+
+
+def test_failed_load_keeps_serving_version(registry):
+    registry.activate("v2", persist=True)
+    serving = registry.active
+
+    with pytest.raises(ValueError):
+        registry.activate("v3", persist=True)
+    with pytest.raises(FileNotFoundError):
+        registry.activate("v9")
+    assert registry.active is serving
+    assert registry.read_active_file() == "v2"
+    assert registry.failed_loads == 2
+    assert registry.loading is None